@@ -1,20 +1,34 @@
 from flask import Flask, session
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy import select
-from argon2 import PasswordHasher
-import stripe
+from .metrics import InstrumentedPasswordHasher
+from .lazy import LazyModule
+from .sites import SiteSession
+import click
 import os
 
-stripe.api_key = os.getenv("STRIPE_SECRET")
-# We init the db object
-db = SQLAlchemy()
+# The stripe SDK takes longer to import than the rest of the app, and is only
+# needed for payments, so is imported when first used. See lazy.py
+stripe = LazyModule("stripe")
+
+
+@stripe.on_import
+def configure_stripe(module):
+    module.api_key = os.getenv("STRIPE_SECRET")
+    # Point stripe at a fake gateway, e.g for benchmarks/loadtest.py
+    module.api_base = os.getenv("STRIPE_API_BASE", module.api_base)
+
+
+# We init the db object. SiteSession sends each site's queries to its db.
+db = SQLAlchemy(session_options={"class_": SiteSession})
 login_manager = LoginManager()
 # Use argon2-id for password hashing
-hasher = PasswordHasher()
+hasher = InstrumentedPasswordHasher()
 
 
-def create_app(testing=False):
+def create_app(testing=False, config: "dict" = None):
     app = Flask(__name__, template_folder="./templates")
 
     # This loads the flask configuration data from config.py
@@ -25,19 +39,40 @@ def create_app(testing=False):
             app.config["SECRET_KEY"] = "testing"
         else:
             raise e
+    # Overrides for config.py that have to be set before the db is, e.g in tests.
+    app.config.update(config or {})
+
+    # Tell flask where the db is, and how to connect to it.
+    # See db_config.py for the defaults and environment variables.
+    from .db_config import database_uri, configure_db, register_sqlite_pragmas
 
-    # Tell flask where the db is.
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri(app.config, testing)
+    configure_db(app)
+    db.init_app(app)
 
-    if app.config["DEBUG"]:
-        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///leisure_centre.db"
+    # Which centre each request is for, see sites.py
+    from .sites import init_sites
 
-    elif testing:
-        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///leisure_centre_test.db"
+    init_sites(app)
 
-    else:
-        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///PROD_leisure_centre.db"
+    # Per request timings, see instrumentation.py and metrics.py
+    from .instrumentation import init_instrumentation
+    from .metrics import watch_pool
+    from .slow_queries import init_slow_query_log
+    from .profiler import init_profiler
 
-    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            register_sqlite_pragmas(engine, app.config)
+        init_instrumentation(app, db.engines.values())
+        watch_pool(db.engines)
+        init_slow_query_log(app, db.engines.values())
+    init_profiler(app)
+
+    # ETags and cached fragments, see cache.py
+    from .cache import init_versioning
+
+    init_versioning(app)
 
     login_manager.init_app(app)
 
@@ -76,6 +111,29 @@ def create_app(testing=False):
     app.register_blueprint(admin)
     app.register_blueprint(employee)
 
+    from .datagen import generate_data_command
+    from .timetable import load_timetable_command
+
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(load_timetable_command)
+    app.cli.add_command(generate_data_command)
+
+    # gzip/brotli responses and precompressed static files, see compression.py
+    from .compression import init_compression, compress_static_command
+
+    init_compression(app)
+    app.cli.add_command(compress_static_command)
+
+    # Membership expiry and other housekeeping, see scheduler.py
+    from .scheduler import init_scheduler, run_jobs_command
+
+    init_scheduler(app)
+    app.cli.add_command(run_jobs_command)
+
+    from .archive import archive_sessions_command
+
+    app.cli.add_command(archive_sessions_command)
+
     return app
 
 
@@ -98,20 +156,65 @@ def debugging_add_to_db(db):
 
     warnings.warn("WARNING: DB CONTAINS INSECURE CREDENTIALS")
 
-    db.session.add(cust)
-    db.session.add(cust2)
-    db.session.add(admin)
-    db.session.add(employee)
+    # create_user returns None for the admin if init_db has already added one.
+    for user in [cust, cust2, admin, employee]:
+        if user is not None:
+            db.session.add(user)
     db.session.commit()
 
 
 def init_db(db):
-    from app.utils import create_user
-    from .models import Roles
-
-    create_user("admin@admin.com", "admin", hasher.hash("adminpassword"), Roles.ADMIN)
-    add_facilities(db)
-    add_activities(db)
+    """
+    Adds the admin account, facilities and timetable, skipping any already in the db.
+    Other sites' timetables are added with flask load-timetable.
+    """
+    from app.utils import create_user, get_user_by_username
+    from .models import Activity, Facility, Roles
+    from .sites import DEFAULT_SITE, current_site
+
+    if get_user_by_username("admin") is None:
+        create_user(
+            "admin@admin.com", "admin", hasher.hash("adminpassword"), Roles.ADMIN
+        )
+    if current_site() != DEFAULT_SITE:
+        return
+    if db.session.execute(select(Facility).limit(1)).first() is None:
+        add_facilities(db)
+    if db.session.execute(select(Activity).limit(1)).first() is None:
+        add_activities(db)
+
+
+@click.command("init-db")
+@click.option(
+    "--reset", is_flag=True, help="Drop every table first, deleting all data."
+)
+@click.option(
+    "--debug-data", is_flag=True, help="Add test users and sessions, see README."
+)
+@with_appcontext
+def init_db_command(reset, debug_data):
+    """
+    Creates any missing tables and adds the admin account, facilities and timetable.
+    Sites with their own db get the tables and an admin account.
+    Safe to run again, e.g on every deploy.
+    """
+    from app.utils import get_user_by_username
+    from .sites import site_databases
+
+    for _ in site_databases():
+        engine = db.session.get_bind()
+        if reset:
+            db.metadata.drop_all(engine)
+        db.metadata.create_all(engine)
+        init_db(db)
+
+    if debug_data:
+        if get_user_by_username("cust") is not None:
+            click.echo("Test users already added")
+        else:
+            debugging_add_to_db(db)
+            debugging_add_sessions_to_cust(db)
+    click.echo("Initialised the db")
 
 
 def debugging_add_sessions_to_cust(db):
@@ -173,158 +276,19 @@ def debugging_add_sessions_to_cust(db):
 def add_facilities(db):
     """
     Add each facility to the db with details as defined in spec doument.
+    The details are in timetable.json
     """
-    from .models import Facilities, Facility
-    import datetime
+    from .timetable import DEFAULT_TIMETABLE, load_timetable, read_timetables
 
-    pool = Facility(
-        facility_id=Facilities.POOL,
-        start_time=datetime.time(8),
-        end_time=datetime.time(20),
-        max_capacity=30,
-    )
-    fitness = Facility(
-        facility_id=Facilities.FITNESS,
-        start_time=datetime.time(8),
-        end_time=datetime.time(22),
-        max_capacity=35,
-    )
-    squash = Facility(
-        facility_id=Facilities.SQUASH,
-        start_time=datetime.time(8),
-        end_time=datetime.time(22),
-        max_capacity=8,
-    )
-    sports = Facility(
-        facility_id=Facilities.HALL,
-        start_time=datetime.time(8),
-        end_time=datetime.time(22),
-        max_capacity=45,
-    )
-    climbing = Facility(
-        facility_id=Facilities.CLIMBING,
-        start_time=datetime.time(10),
-        end_time=datetime.time(22),
-        max_capacity=22,
-    )
-    studio = Facility(
-        facility_id=Facilities.STUDIO,
-        start_time=datetime.time(8),
-        end_time=datetime.time(22),
-        max_capacity=25,
-    )
-    db.session.add(pool)
-    db.session.add(fitness)
-    db.session.add(squash)
-    db.session.add(sports)
-    db.session.add(climbing)
-    db.session.add(studio)
-    db.session.commit()
+    for timetable in read_timetables(DEFAULT_TIMETABLE):
+        load_timetable(db.session, timetable, parts=["facilities"])
 
 
 def add_activities(db):
     """
-    Add each activity to the db.
+    Add each activity to the db, following the timetable in timetable.json
     """
-    from .models import Activities, Activity, Facilities, Days
-    import datetime
+    from .timetable import DEFAULT_TIMETABLE, load_timetable, read_timetables
 
-    # Each of these follow the format of (start hour, end hour, [list of activites availble during that timeframe])
-    # One row for each day, for each facility.
-    pool_times = [
-        [(8, 20, [Activities.GENERAL, Activities.LANESWIM, Activities.SWIMLESSON])],
-        [(8, 20, [Activities.GENERAL, Activities.LANESWIM, Activities.SWIMLESSON])],
-        [(8, 20, [Activities.GENERAL, Activities.LANESWIM, Activities.SWIMLESSON])],
-        [(8, 20, [Activities.GENERAL, Activities.LANESWIM, Activities.SWIMLESSON])],
-        [
-            (8, 10, [Activities.TEAM]),
-            (10, 20, [Activities.GENERAL, Activities.LANESWIM, Activities.SWIMLESSON]),
-        ],
-        [(8, 20, [Activities.GENERAL, Activities.LANESWIM, Activities.SWIMLESSON])],
-        [
-            (8, 10, [Activities.TEAM]),
-            (10, 20, [Activities.GENERAL, Activities.LANESWIM, Activities.SWIMLESSON]),
-        ],
-    ]
-
-    fitness_times = [
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-    ]
-
-    squash_times = [
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-    ]
-
-    sports_times = [
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [(8, 22, [Activities.GENERAL])],
-        [
-            (8, 19, [Activities.GENERAL]),
-            (19, 21, [Activities.TEAM]),
-            (21, 22, [Activities.GENERAL]),
-        ],
-        [(8, 22, [Activities.GENERAL])],
-        [
-            (8, 9, [Activities.GENERAL]),
-            (9, 11, [Activities.TEAM]),
-            (11, 22, [Activities.GENERAL]),
-        ],
-        [(8, 22, [Activities.GENERAL])],
-    ]
-
-    climb_times = [
-        [(10, 20, [Activities.GENERAL])],
-        [(10, 20, [Activities.GENERAL])],
-        [(10, 20, [Activities.GENERAL])],
-        [(10, 20, [Activities.GENERAL])],
-        [(10, 20, [Activities.GENERAL])],
-        [(10, 20, [Activities.GENERAL])],
-        [(10, 20, [Activities.GENERAL])],
-    ]
-    studio_times = [
-        [(18, 19, [Activities.PILATES])],
-        [(10, 11, [Activities.AEROBICS])],
-        [(-1, -1, [])],
-        [(19, 20, [Activities.AEROBICS])],
-        [(19, 20, [Activities.YOGA])],
-        [(10, 11, [Activities.AEROBICS])],
-        [(9, 10, [Activities.YOGA])],
-    ]
-
-    for facil_id, timetable in enumerate(
-        [
-            pool_times,
-            fitness_times,
-            squash_times,
-            sports_times,
-            climb_times,
-            studio_times,
-        ]
-    ):
-        for day, details in enumerate(timetable):
-            for open, close, uses in details:
-                if open == -1:
-                    continue
-                for use in uses:
-                    a = Activity(
-                        activity_type=use,
-                        facility_id=Facilities(facil_id),
-                        day=Days(day),
-                        start_time=datetime.time(open),
-                        end_time=datetime.time(close),
-                    )
-                    db.session.add(a)
-    db.session.commit()
+    for timetable in read_timetables(DEFAULT_TIMETABLE):
+        load_timetable(db.session, timetable, parts=["activities"])
@@ -0,0 +1,265 @@
+from app.models import Roles, User, Activity, Facility
+from app.pagination import KeysetPage, keyset_paginate
+from app.sites import current_site
+from app import db
+from sqlalchemy import select, false
+import datetime
+import enum
+import json
+import csv
+import io
+
+
+class AdminTable:
+    def __init__(
+        self,
+        model,
+        id_column,
+        columns: "dict",
+        where=None,
+        sortable: "list[str]" = None,
+        filterable: "list[str]" = None,
+        site_column=None,
+    ) -> None:
+        """
+        Describes one of the admin listings so it can be queried column by column
+        instead of loading every ORM object.
+        params:
+            model: The model the listing is built from.
+            id_column: The primary key column, used to order the rows.
+            columns: Ordered dict of column name: model column.
+            where: Optional filter applied to every query on the table.
+            sortable: Names of the columns the listing can be sorted by. They must not contain NULLs.
+            filterable: Names of the columns the listing can be filtered by.
+            site_column: The model's site column, to only list the rows of the
+                current site.
+        """
+        self.model = model
+        self.id_column = id_column
+        self.columns = columns
+        self.where = where
+        self.sortable = sortable or ["id"]
+        self.filterable = filterable or []
+        self.site_column = site_column
+
+    def select(self, column_names: "list[str]" = None):
+        """
+        Returns a select statement for the given column names, in primary key order.
+        All columns are selected if column_names is None.
+        """
+        if column_names is None:
+            column_names = list(self.columns.keys())
+
+        stmt = select(*[self.columns[name].label(name) for name in column_names])
+        if self.where is not None:
+            stmt = stmt.where(self.where)
+        if self.site_column is not None:
+            stmt = stmt.where(self.site_column == current_site())
+        return stmt.order_by(self.id_column)
+
+    def filter_criteria(self, filters: "dict") -> list:
+        """
+        Turns a dict of column name: value into a list of where clauses.
+        Text columns match on a prefix, enum columns on the name of the value,
+        and anything else must match exactly.
+        Columns that are not filterable are ignored.
+        """
+        criteria = []
+        for name, value in filters.items():
+            if name not in self.filterable or not value:
+                continue
+
+            column = self.columns[name]
+            python_type = column.type.python_type
+
+            if issubclass(python_type, enum.Enum):
+                try:
+                    criteria.append(column == python_type[value.upper()])
+                except KeyError:
+                    # Not a valid value so nothing can match
+                    criteria.append(false())
+            elif python_type is str:
+                criteria.append(column.startswith(value, autoescape=True))
+            else:
+                try:
+                    criteria.append(column == python_type(value))
+                except ValueError:
+                    criteria.append(false())
+        return criteria
+
+    def page(self, args: "dict", per_page: int = 25) -> KeysetPage:
+        """
+        Get one page of the listing.
+        params:
+            args: The request's URL params.
+                sort: The column to sort by, defaults to id.
+                direction: One of 'asc' (default), 'desc'.
+                after, before: Cursors from a previous page.
+                per_page: Rows per page, at most 100.
+                Any filterable column name: Value to filter that column by.
+        """
+        sort = args.get("sort", "id")
+        if sort not in self.sortable:
+            sort = "id"
+        direction = "desc" if args.get("direction") == "desc" else "asc"
+
+        try:
+            per_page = min(max(int(args.get("per_page", per_page)), 1), 100)
+        except ValueError:
+            pass
+
+        filters = {name: args.get(name) for name in self.filterable if args.get(name)}
+
+        stmt = self.select().where(*self.filter_criteria(filters))
+        rows, next_cursor, prev_cursor = keyset_paginate(
+            db.session,
+            stmt,
+            sort_key=sort,
+            id_key="id",
+            descending=direction == "desc",
+            after=args.get("after"),
+            before=args.get("before"),
+            per_page=per_page,
+        )
+
+        return KeysetPage(
+            rows=[dict(row._mapping) for row in rows],
+            columns=list(self.columns.keys()),
+            next_cursor=next_cursor,
+            prev_cursor=prev_cursor,
+            sort=sort,
+            direction=direction,
+            args=dict(filters, per_page=args.get("per_page")),
+        )
+
+
+# The column names match the keys of each models admin_data()
+admin_tables = {
+    "members": AdminTable(
+        User,
+        User.user_id,
+        {
+            "id": User.user_id,
+            "username": User.username,
+            "email": User.email,
+            "stripe_id": User.stripe_id,
+        },
+        where=User.role == Roles.CUSTOMER,
+        sortable=["id", "username", "email"],
+        filterable=["username", "email"],
+    ),
+    "employees": AdminTable(
+        User,
+        User.user_id,
+        {
+            "id": User.user_id,
+            "username": User.username,
+            "role": User.role,
+        },
+        where=(User.role == Roles.ADMIN) | (User.role == Roles.EMPLOYEE),
+        sortable=["id", "username", "role"],
+        filterable=["username", "role"],
+    ),
+    "activities": AdminTable(
+        Activity,
+        Activity.activity_id,
+        {
+            "id": Activity.activity_id,
+            "activity_type": Activity.activity_type,
+            "facility_id": Activity.facility_id,
+            "day": Activity.day,
+            "start_time": Activity.start_time,
+            "end_time": Activity.end_time,
+        },
+        # Not day, which is stored by name so would sort alphabetically.
+        sortable=["id", "activity_type", "facility_id", "start_time"],
+        filterable=["activity_type", "facility_id", "day"],
+        site_column=Activity.site,
+    ),
+    "facilities": AdminTable(
+        Facility,
+        Facility.id,
+        {
+            "id": Facility.id,
+            "facility_id": Facility.facility_id,
+            "start_time": Facility.start_time,
+            "end_time": Facility.end_time,
+            "max_capacity": Facility.max_capacity,
+        },
+        sortable=["id", "facility_id", "max_capacity"],
+        filterable=["facility_id"],
+        site_column=Facility.site,
+    ),
+}
+
+
+def parse_column_selection(table: AdminTable, selection: str) -> "list[str]":
+    """
+    Turns a comma seperated list of column names into a list.
+    Returns every column if selection is empty, or None if any of the names are unknown.
+    """
+    if not selection:
+        return list(table.columns.keys())
+
+    column_names = [name.strip() for name in selection.split(",") if name.strip()]
+    if not column_names or any(name not in table.columns for name in column_names):
+        return None
+    return column_names
+
+
+def export_value(value):
+    """
+    Converts a value from the db into something that can be written to CSV or JSON.
+    """
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def stream_table(
+    table: AdminTable,
+    column_names: "list[str]",
+    format: str,
+    criteria: list = (),
+    chunk_size: int = 500,
+):
+    """
+    Generator that yields the rows of table as CSV or NDJSON text.
+    Rows are fetched from the db `chunk_size` at a time, so memory use does not
+    depend on the number of rows in the table.
+    params:
+        format: One of 'csv', 'ndjson'.
+        criteria: Extra where clauses, see AdminTable.filter_criteria
+    """
+    result = db.session.execute(
+        table.select(column_names)
+        .where(*criteria)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        writer.writerow(column_names)
+
+    try:
+        for partition in result.partitions():
+            for row in partition:
+                values = [export_value(value) for value in row]
+                if format == "csv":
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(column_names, values))) + "\n")
+
+            # Send each chunk as soon as it is ready, then reuse the buffer.
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    finally:
+        result.close()
+
+    # Headers only, the table was empty.
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -1,4 +1,15 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import (
+    Blueprint,
+    render_template,
+    redirect,
+    url_for,
+    flash,
+    request,
+    Response,
+    stream_with_context,
+    current_app,
+    send_from_directory,
+)
 from app.utils import (
     requires_role,
     get_user_by_username,
@@ -16,9 +27,22 @@ from app.models import (
     Facilities,
     Days,
 )
+from app.admin.admin_utils import admin_tables, parse_column_selection, stream_table
+from app.slow_queries import read_slow_queries
+from app.sites import current_site
+from app.timetable import (
+    InvalidTimetable,
+    activity_index,
+    export_timetable,
+    import_activities,
+    read_activity_rows,
+    sessions_outside,
+)
 from app import db, hasher, stripe
 from sqlalchemy import select
 import sqlalchemy
+import datetime
+import math
 from app.forms import (
     EditActivityForm,
     EditUserForm,
@@ -26,7 +50,9 @@ from app.forms import (
     EditEmployeeForm,
     AddEmployeeForm,
     PricingForm,
+    TimetableImportForm,
 )
+import io
 
 admin = Blueprint(
     "admin",
@@ -46,22 +72,9 @@ def index():
 @admin.route("/activities")
 @requires_role(Roles.ADMIN)
 def activities():
-    activity_list = db.session.execute(select(Activity)).all()
-    # .all() gives results in a list of (object,) tuples
-    activity_list = [act[0].admin_data() for act in activity_list]
-
-    if len(activity_list) == 0:
-        return render_template(
-            "show_db_data.html",
-            title="Activities",
-            edit_action="admin.edit_activity",
-        )
-
-    return render_template(
-        "show_db_data.html",
+    return render_listing(
+        "activities",
         title="Activities",
-        columns=activity_list[0].keys(),
-        data=activity_list,
         edit_action="admin.edit_activity",
         delete_from="activity",
         message="Deleting an Activity does not effect already booked sessions.",
@@ -73,8 +86,13 @@ def activities():
 @requires_role(Roles.ADMIN)
 def edit_activity(id=None):
     activity = db.session.execute(
-        select(Activity).where(Activity.activity_id == id)
+        select(Activity)
+        .where(Activity.activity_id == id)
+        .where(Activity.site == current_site())
     ).scalar()
+    if activity is None:
+        flash("Unknown activity", "warning")
+        return redirect(url_for("admin.activities"))
 
     form = EditActivityForm()
 
@@ -85,20 +103,41 @@ def edit_activity(id=None):
         # Session must be at least 1 hour long
         if delta < 1:
             flash("Duration too short. Must be 1 hour minimum", "warning")
-            return render_template("edit_activity.html", form=form)
+            return redirect(url_for("admin.edit_activity", id=id))
+
+        # Cannot be outside the facility's opening hours, or overlap an existing
+        # activity of the same type in the facility on the same day.
+        # e.g. if LANESWIM in POOL 8am to 8pm exists then LANESWIM in POOL 12pm to 5pm
+        # is rejected, but GENERAL in POOL 12pm to 5pm is accepted.
+        old = activity_row(activity)
+        errors = activity_index().check(
+            activity_row_from_form(form), activity.activity_id
+        )
+        if errors:
+            for error in errors:
+                flash(error, "warning")
+            return redirect(url_for("admin.edit_activity", id=id))
 
         activity = set_activity_from_form(activity, form)
         db.session.commit()
+        flash("Updated", "success")
 
-        flash("Updated (not really)", "success")
+        # Booked sessions keep their times, so let the admin know about any that are
+        # no longer on the timetable.
+        outside = sessions_outside(old, activity.activity_id)
+        if outside:
+            times = ", ".join(
+                f"{s.start_time:%d/%m/%Y %H:%M}-{s.end_time:%H:%M}"
+                for s in outside[:10]
+            )
+            more = f" and {len(outside) - 10} more" if len(outside) > 10 else ""
+            flash(
+                f"{len(outside)} booked sessions are no longer within the "
+                f"activity's hours: {times}{more}",
+                "warning",
+            )
         return redirect(url_for("admin.activities"))
 
-        # Cannot be overlapping with existing activity of same type in facility
-        # e.g. if LANESWIM in POOL 8am to 8pm exists then:
-        # LANESWIM in POOL 12pm to 5pm should be rejected (any with start_time before 8pm should be, in fact)
-        # GENERAL in POOL 12pm to 5pm should be accepted (assuming there are no other GENERAL POOL activities that day)
-        # activity_id should be unique
-
     form = set_form_from_activity(form, activity)
 
     return render_template(
@@ -109,24 +148,62 @@ def edit_activity(id=None):
     )
 
 
+@admin.route("/timetable", methods=["GET", "POST"])
+@requires_role(Roles.ADMIN)
+def timetable():
+    """
+    Imports a timetable file of activities, all of them or none if any are invalid.
+    """
+    form = TimetableImportForm()
+    errors = []
+
+    if form.validate_on_submit():
+        upload = form.file.data
+        file_format = "json" if upload.filename.lower().endswith(".json") else "csv"
+        try:
+            rows = read_activity_rows(
+                io.TextIOWrapper(upload.stream, encoding="utf-8-sig"), file_format
+            )
+            counts = import_activities(db.session, rows, replace=form.replace.data)
+        except InvalidTimetable as e:
+            errors = e.errors
+        except UnicodeDecodeError:
+            errors = ["The file must be UTF-8 text"]
+        else:
+            flash(
+                f"Imported timetable: {counts['added']} activities added, "
+                f"{counts['updated']} updated, {counts['deleted']} deleted",
+                "success",
+            )
+            return redirect(url_for("admin.activities"))
+
+    return render_template("timetable.html", form=form, errors=errors)
+
+
+@admin.route("/timetable/export")
+@requires_role(Roles.ADMIN)
+def export_timetable_file():
+    """
+    Downloads the timetable in the format the timetable import reads.
+    URL params:
+        format: One of 'csv' (default), 'json'.
+    """
+    file_format = "json" if request.args.get("format") == "json" else "csv"
+    return Response(
+        export_timetable(db.session, file_format),
+        mimetype="application/json" if file_format == "json" else "text/csv",
+        headers={
+            "Content-Disposition": f"attachment; filename=timetable.{file_format}"
+        },
+    )
+
+
 @admin.route("/members")
 @requires_role(Roles.ADMIN)
 def members():
-    members = db.session.execute(select(User).where(User.role == Roles.CUSTOMER)).all()
-    members = [member[0].admin_data() for member in members]
-
-    if len(members) == 0:
-        return render_template(
-            "show_db_data.html",
-            title="Members",
-            edit_action="admin.edit_activity",
-        )
-
-    return render_template(
-        "show_db_data.html",
+    return render_listing(
+        "members",
         title="Members",
-        columns=members[0].keys(),
-        data=members,
         edit_action="admin.edit_member",
         delete_from="user",
     )
@@ -181,21 +258,9 @@ def edit_member(id=None):
 @admin.route("/facilities")
 @requires_role(Roles.ADMIN)
 def facilities():
-    facils = db.session.execute(select(Facility)).all()
-    facil_data = [facil[0].admin_data() for facil in facils]
-
-    if len(facil_data) == 0:
-        return render_template(
-            "show_db_data.html",
-            title="Activities",
-            edit_action="admin.edit_activity",
-        )
-
-    return render_template(
-        "show_db_data.html",
+    return render_listing(
+        "facilities",
         title="Facilities",
-        columns=facil_data[0].keys(),
-        data=facil_data,
         edit_action="admin.edit_facility",
         delete_from="facility",
         message="Modifying or Deleting a Facility does not effect already booked sessions.",
@@ -206,7 +271,12 @@ def facilities():
 @admin.route("/facilities/edit/<id>", methods=["POST", "GET"])
 @requires_role(Roles.ADMIN)
 def edit_facility(id=None):
-    facility = db.session.execute(select(Facility).where(Facility.id == id)).scalar()
+    facility = db.session.execute(
+        select(Facility).where(Facility.id == id).where(Facility.site == current_site())
+    ).scalar()
+    if facility is None:
+        flash("Unknown facility", "warning")
+        return redirect(url_for("admin.facilities"))
 
     form = EditFacilityForm(obj=facility)
     check_details = False
@@ -251,23 +321,9 @@ def edit_facility(id=None):
 @admin.route("/employees")
 @requires_role(Roles.ADMIN)
 def employees():
-    employees = db.session.execute(
-        select(User).where((User.role == Roles.ADMIN) | (User.role == Roles.EMPLOYEE))
-    )
-    employees = [em[0].admin_data() for em in employees]
-
-    if len(employees) == 0:
-        return render_template(
-            "show_db_data.html",
-            title="Employees",
-            edit_action="admin.edit_activity",
-        )
-
-    return render_template(
-        "show_db_data.html",
+    return render_listing(
+        "employees",
         title="Employees",
-        columns=employees[0].keys(),
-        data=employees,
         edit_action="admin.edit_employee",
         add_action="admin.add_employee",
         delete_from="user",
@@ -347,21 +403,30 @@ def delete(table, id):
 
     if table == "facility":
         obj_to_delete = db.session.execute(
-            select(Facility).where(Facility.id == id)
+            select(Facility)
+            .where(Facility.id == id)
+            .where(Facility.site == current_site())
         ).scalar()
 
         # Delete all associated activities.
-        db.session.execute(
-            sqlalchemy.delete(Activity).where(
-                Activity.facility_id == obj_to_delete.facility_id
+        if obj_to_delete is not None:
+            db.session.execute(
+                sqlalchemy.delete(Activity)
+                .where(Activity.site == obj_to_delete.site)
+                .where(Activity.facility_id == obj_to_delete.facility_id)
             )
-        )
 
     if table == "activity":
         obj_to_delete = db.session.execute(
-            select(Activity).where(Activity.activity_id == id)
+            select(Activity)
+            .where(Activity.activity_id == id)
+            .where(Activity.site == current_site())
         ).scalar()
 
+    if obj_to_delete is None:
+        flash(f"Unknown {table}", "warning")
+        return redirect(request.referrer or url_for("admin.index"))
+
     db.session.delete(obj_to_delete)
     db.session.commit()
 
@@ -370,6 +435,133 @@ def delete(table, id):
     return redirect(request.referrer)
 
 
+@admin.route("/export/<table>")
+@requires_role(Roles.ADMIN)
+def export(table):
+    """
+    Streams one of the admin listings as CSV or NDJSON.
+    URL params:
+        format: One of 'csv' (default), 'ndjson'.
+        columns: Comma seperated list of columns to include, defaults to all.
+        Any filterable column name: Value to filter that column by, as on the listing.
+    """
+    export_format = request.args.get("format", "csv")
+    if table not in admin_tables or export_format not in ("csv", "ndjson"):
+        flash("Unknown export", "warning")
+        return redirect(url_for("admin.index"))
+
+    admin_table = admin_tables[table]
+    column_names = parse_column_selection(admin_table, request.args.get("columns"))
+    if column_names is None:
+        flash("Unknown column selected for export", "warning")
+        return redirect(url_for(f"admin.{table}"))
+
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    extension = "csv" if export_format == "csv" else "ndjson"
+
+    # Use the same filters as the listing the export was requested from.
+    criteria = admin_table.filter_criteria(request.args)
+
+    # No Content-Length is set, so the rows are sent with chunked transfer encoding.
+    return Response(
+        stream_with_context(
+            stream_table(admin_table, column_names, export_format, criteria)
+        ),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={table}.{extension}"},
+    )
+
+
+@admin.route("/metrics")
+@requires_role(Roles.ADMIN)
+def metrics():
+    """
+    Shows the time spent serving each endpoint since the app started (or the stats were reset).
+    """
+    stats = current_app.extensions["request_stats"]
+    return render_template(
+        "metrics.html",
+        endpoints=stats.summary(),
+        since=datetime.datetime.fromtimestamp(stats.since),
+    )
+
+
+@admin.route("/metrics/reset", methods=["POST"])
+@requires_role(Roles.ADMIN)
+def reset_metrics():
+    current_app.extensions["request_stats"].reset()
+    flash("Metrics reset", "success")
+    return redirect(url_for("admin.metrics"))
+
+
+@admin.route("/slow-queries")
+@requires_role(Roles.ADMIN)
+def slow_queries():
+    """
+    Shows the most recent entries in the slow query log.
+    """
+    return render_template(
+        "slow_queries.html",
+        threshold=current_app.config.get("SLOW_QUERY_THRESHOLD_MS"),
+        entries=read_slow_queries(current_app.config["SLOW_QUERY_LOG"]),
+    )
+
+
+@admin.route("/profiler", methods=["GET", "POST"])
+@requires_role(Roles.ADMIN)
+def profiler():
+    """
+    Starts or stops the sampling profiler, and lists the profiles it has written.
+    """
+    sampling_profiler = current_app.extensions["profiler"]
+
+    if request.method == "POST":
+        if request.form.get("action") == "stop":
+            sampling_profiler.stop()
+            flash("Profiler stopped", "success")
+            return redirect(url_for("admin.profiler"))
+
+        endpoints = [
+            e.strip() for e in request.form.get("endpoints", "").split(",") if e.strip()
+        ]
+        unknown = [e for e in endpoints if e not in current_app.view_functions]
+        if not endpoints or unknown:
+            flash(f"Unknown endpoints: {', '.join(unknown) or 'none given'}", "warning")
+            return redirect(url_for("admin.profiler"))
+
+        try:
+            rate = float(request.form.get("rate", 100))
+            # nan gets through the clamp below, and would stop the sampler thread.
+            if not math.isfinite(rate):
+                raise ValueError(rate)
+            rate = min(max(rate, 1), 1000)
+        except ValueError:
+            flash("Invalid sample rate", "warning")
+            return redirect(url_for("admin.profiler"))
+
+        sampling_profiler.start(endpoints, rate)
+        flash("Profiler started", "success")
+        return redirect(url_for("admin.profiler"))
+
+    return render_template(
+        "profiler.html",
+        profiler=sampling_profiler,
+        endpoints=sorted(current_app.view_functions),
+    )
+
+
+@admin.route("/profiler/<name>")
+@requires_role(Roles.ADMIN)
+def download_profile(name):
+    sampling_profiler = current_app.extensions["profiler"]
+    # Write out the latest samples before downloading.
+    if sampling_profiler.running:
+        sampling_profiler.flush()
+    return send_from_directory(
+        sampling_profiler.directory, name, mimetype="text/plain", as_attachment=True
+    )
+
+
 @admin.route("/pricing", methods=["POST", "GET"])
 @requires_role(Roles.ADMIN)
 def pricing():
@@ -398,6 +590,26 @@ def pricing():
     # Get discount threshold.
 
 
+def render_listing(table, **kwargs):
+    """
+    Renders one page of an admin listing, using the sort, filter and cursor URL params.
+    kwargs are passed on to show_db_data.html
+    """
+    admin_table = admin_tables[table]
+    page = admin_table.page(request.args)
+
+    return render_template(
+        "show_db_data.html",
+        page=page,
+        columns=page.columns,
+        data=page.rows,
+        filterable=admin_table.filterable,
+        sortable=admin_table.sortable,
+        export_table=table,
+        **kwargs,
+    )
+
+
 def set_form_from_activity(form, activity):
     form.activity_id.default = activity.activity_id
     form.activity_type.default = activity.activity_type.value
@@ -409,12 +621,31 @@ def set_form_from_activity(form, activity):
     return form
 
 
+def activity_row(activity) -> "dict":
+    """
+    Returns the timetable fields of an Activity.
+    """
+    return {
+        "activity_type": activity.activity_type,
+        "facility_id": activity.facility_id,
+        "day": activity.day,
+        "start_time": activity.start_time,
+        "end_time": activity.end_time,
+    }
+
+
+def activity_row_from_form(form) -> "dict":
+    return {
+        "activity_type": Activities(int(form.activity_type.data)),
+        "facility_id": Facilities(int(form.facility_id.data)),
+        "day": Days(int(form.day.data)),
+        "start_time": form.start_time.data,
+        "end_time": form.end_time.data,
+    }
+
+
 def set_activity_from_form(activity, form):
-    activity.activity_id = form.activity_id.data
-    activity.activity_type = Activities(int(form.activity_type.data))
-    activity.facility_id = Facilities(int(form.facility_id.data))
-    activity.day = Days(int(form.day.data))
-    activity.start_time = form.start_time.data
-    activity.end_time = form.end_time.data
+    for name, value in activity_row_from_form(form).items():
+        setattr(activity, name, value)
 
     return activity
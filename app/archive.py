@@ -0,0 +1,210 @@
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, literal, select, union_all
+from app.models import (
+    ArchivedSession,
+    Session,
+    SessionDisplay,
+    archived_user_session_m2m,
+    user_session_m2m,
+)
+from app.cache import bump_versions, occupancy_versions, user_version
+from app.pagination import KeysetPage, keyset_paginate
+from app.sites import site_databases
+from app import db
+import datetime
+import click
+
+
+def archive_horizon(now: datetime.datetime = None) -> datetime.datetime:
+    """
+    Returns the time before which sessions are archived, ARCHIVE_AFTER_DAYS before now.
+    """
+    now = now or datetime.datetime.now()
+    return now - datetime.timedelta(
+        days=current_app.config.get("ARCHIVE_AFTER_DAYS", 90)
+    )
+
+
+def archive_sessions(before: datetime.datetime, batch_size: int = None) -> "dict":
+    """
+    Moves the sessions that ended before `before`, and their bookings, from the
+    session and user_sessions tables to archived_session and archived_user_sessions.
+    Sessions are moved batch_size at a time in order of session_id, each batch in its
+    own transaction so the db isn't locked for long.
+    Returns the number of sessions and bookings archived.
+    """
+    batch_size = batch_size or current_app.config.get("ARCHIVE_BATCH_SIZE", 1000)
+    columns = [column.name for column in Session.__table__.columns]
+    bookings = user_session_m2m
+
+    counts = {"sessions": 0, "bookings": 0}
+    old = Session.end_time < before
+    while True:
+        last = db.session.execute(
+            select(func.max(Session.session_id)).where(
+                Session.session_id.in_(
+                    select(Session.session_id)
+                    .where(old)
+                    .order_by(Session.session_id)
+                    .limit(batch_size)
+                )
+            )
+        ).scalar()
+        if last is None:
+            break
+
+        batch = old & (Session.session_id <= last)
+        batch_ids = select(Session.session_id).where(batch)
+        users = db.session.execute(
+            select(bookings.c.user_id.distinct()).where(
+                bookings.c.session_id.in_(batch_ids)
+            )
+        ).scalars()
+        names = {user_version(user_id) for user_id in users}
+        names |= occupancy_versions(
+            db.session.execute(
+                select(Session.site, Session.start_time).where(batch).distinct()
+            ).all()
+        )
+
+        db.session.execute(
+            insert(ArchivedSession.__table__).from_select(
+                columns, select(*Session.__table__.c).where(batch)
+            )
+        )
+        db.session.execute(
+            insert(archived_user_session_m2m).from_select(
+                ["user_id", "session_id"],
+                select(bookings.c.user_id, bookings.c.session_id).where(
+                    bookings.c.session_id.in_(batch_ids)
+                ),
+            )
+        )
+        counts["bookings"] += db.session.execute(
+            delete(bookings).where(bookings.c.session_id.in_(batch_ids))
+        ).rowcount
+        counts["sessions"] += db.session.execute(
+            delete(Session).where(batch),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+
+        # The bulk inserts and deletes skip the ORM events that do this.
+        bump_versions(db.session.connection(), names)
+        db.session.commit()
+
+    # Sessions loaded before the move would still show the archived ones.
+    db.session.expire_all()
+    return counts
+
+
+class HistoryEntry(SessionDisplay):
+    def __init__(self, row) -> None:
+        """
+        A session from a user's booking history, see history_page.
+        """
+        self.session_id = row.session_id
+        self.session_type = row.session_type
+        self.facility_id = row.facility_id
+        self.start_time = row.start_time
+        self.end_time = row.end_time
+        self.expired = row.expired
+        self.archived = row.archived
+
+
+def booked_sessions(table, bookings, user_id: int, now: datetime.datetime):
+    """
+    Returns a select of the sessions in table the user has booked, with whether each
+    has started by now as `expired` and whether table is the archive as `archived`.
+    """
+    return (
+        select(
+            table.session_id,
+            table.session_type,
+            table.facility_id,
+            table.start_time,
+            table.end_time,
+            (table.start_time <= now).label("expired"),
+            literal(table is ArchivedSession).label("archived"),
+        )
+        .join(bookings, bookings.c.session_id == table.session_id)
+        .where(bookings.c.user_id == user_id)
+    )
+
+
+def history_page(
+    user_id: int,
+    past: bool,
+    args: "dict",
+    now: datetime.datetime = None,
+    per_page: int = 10,
+) -> KeysetPage:
+    """
+    Gets one page of a user's upcoming sessions, soonest first, or past sessions,
+    most recent first and including archived ones. Each is paged with keyset_paginate,
+    so long time members' pages cost the same as new members'.
+    params:
+        args: The request's URL params. after and before are cursors for the list
+            named by history, 'upcoming' or 'past'. The other list starts at its
+            first page.
+        now: Sessions that started before this are past. Passed to the db rather
+            than using its clock, as times are stored in local time.
+    """
+    now = now or datetime.datetime.now()
+    name = "past" if past else "upcoming"
+    if args.get("history") != name:
+        args = {}
+
+    stmt = booked_sessions(Session, user_session_m2m, user_id, now)
+    if past:
+        # Only past sessions are archived.
+        history = union_all(
+            stmt.where(Session.start_time <= now),
+            booked_sessions(ArchivedSession, archived_user_session_m2m, user_id, now),
+        )
+        stmt = select(history.subquery())
+    else:
+        stmt = stmt.where(Session.start_time > now)
+
+    rows, next_cursor, prev_cursor = keyset_paginate(
+        db.session,
+        stmt,
+        sort_key="start_time",
+        id_key="session_id",
+        descending=past,
+        after=args.get("after"),
+        before=args.get("before"),
+        per_page=per_page,
+    )
+    return KeysetPage(
+        rows=[HistoryEntry(row) for row in rows],
+        columns=list(stmt.selected_columns.keys()),
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        sort="start_time",
+        direction="desc" if past else "asc",
+        args={"history": name},
+    )
+
+
+@click.command("archive-sessions")
+@click.option(
+    "--days",
+    type=int,
+    help="Archive sessions that ended this many days ago. Defaults to ARCHIVE_AFTER_DAYS.",
+)
+@with_appcontext
+def archive_sessions_command(days):
+    """
+    Moves old sessions and their bookings to the archive tables, in each site's db.
+    """
+    if days is None:
+        before = archive_horizon()
+    else:
+        before = datetime.datetime.now() - datetime.timedelta(days=days)
+    for site in site_databases():
+        counts = archive_sessions(before)
+        click.echo(
+            f"{site}: Archived {counts['sessions']} sessions and {counts['bookings']} "
+            f"bookings that ended before {before:%Y-%m-%d %H:%M}"
+        )
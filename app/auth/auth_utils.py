@@ -3,7 +3,7 @@ from flask_login import current_user
 from app.models import Roles, Session, Membership, User
 import datetime
 from app import stripe, db
-import stripe.error
+from app.metrics import CHECKOUTS
 
 
 def determine_login_destination() -> Response:
@@ -76,6 +76,8 @@ def get_stripe_customer_from_user(user):
 def create_booking_checkout(user: "User" = current_user):
     customer = get_stripe_customer_from_user(user)
     if user.membership != Membership.NONE:
+        # Members don't pay per session.
+        CHECKOUTS.inc(kind="booking", outcome="skipped")
         return redirect(url_for("auth.booking_success"))
 
     discounts = []
@@ -113,6 +115,7 @@ def create_booking_checkout(user: "User" = current_user):
             invoice_creation={"enabled": True},
         )
     except stripe.error.InvalidRequestError as e:
+        CHECKOUTS.inc(kind="booking", outcome="error")
         if "email" in str(e):
             flash(
                 "Your email is incompatible with stripe, please update it in the settings page",
@@ -121,4 +124,5 @@ def create_booking_checkout(user: "User" = current_user):
             return redirect("customer.settings")
         return str(e)
 
+    CHECKOUTS.inc(kind="booking", outcome="created")
     return redirect(checkout_session.url, code=303)
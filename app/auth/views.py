@@ -19,6 +19,8 @@ from app.utils import (
     get_user_by_email,
 )
 from .auth_utils import user_home, determine_login_destination, create_booking_checkout
+from app.metrics import BOOKINGS, CHECKOUTS, WEBHOOK_EVENTS
+from app.cache import PRICING, bump_versions
 from app.models import Roles, Session, Membership, User
 import json
 from sqlalchemy import select
@@ -132,8 +134,10 @@ def monthly_membership_checkout():
             customer=current_user.stripe_id,
         )
     except Exception as e:
+        CHECKOUTS.inc(kind="monthly_membership", outcome="error")
         return str(e)
 
+    CHECKOUTS.inc(kind="monthly_membership", outcome="created")
     return redirect(checkout_session.url, code=303)
 
 
@@ -166,8 +170,10 @@ def annual_membership_checkout():
             customer=current_user.stripe_id,
         )
     except Exception as e:
+        CHECKOUTS.inc(kind="annual_membership", outcome="error")
         return str(e)
 
+    CHECKOUTS.inc(kind="annual_membership", outcome="created")
     return redirect(checkout_session.url, code=303)
 
 
@@ -183,6 +189,18 @@ def transaction_cancelled():
     return user_home()
 
 
+# Stripe events that change the prices shown on the site.
+PRICING_EVENTS = {"price.created", "price.updated", "coupon.created", "coupon.updated"}
+
+# The event types webhook handles. Others are counted as 'other', so payloads can't
+# add their own labels to WEBHOOK_EVENTS.
+HANDLED_EVENTS = {
+    "payment_intent.succeeded",
+    "customer.subscription.updated",
+    "customer.created",
+} | PRICING_EVENTS
+
+
 @auth.route("/webhook", methods=["POST"])
 def webhook():
     endpoint_secret = (
@@ -195,6 +213,7 @@ def webhook():
         event = json.loads(payload)
     except Exception as e:
         print("Error" + str(e))
+        WEBHOOK_EVENTS.inc(type="invalid_payload")
         return jsonify(success=False)
 
     if endpoint_secret:
@@ -205,16 +224,21 @@ def webhook():
             event = stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
         except stripe.error.SignatureVerificationError as e:
             print("⚠️  Webhook signature verification failed." + str(e))
+            WEBHOOK_EVENTS.inc(type="invalid_signature")
             return jsonify(success=False)
 
     # Handle the event
     if event:
+        event_type = str(event.get("type"))
+        WEBHOOK_EVENTS.inc(type=event_type if event_type in HANDLED_EVENTS else "other")
         if event.type == "payment_intent.succeeded":
             handle_payment_success(event)
         elif event.type == "customer.subscription.updated":
             handle_subscription_change(event)
         elif event.type == "customer.created":
             handle_new_customer(event)
+        elif event.type in PRICING_EVENTS:
+            handle_pricing_change(event)
 
     return jsonify(success=True)
 
@@ -224,6 +248,12 @@ def handle_payment_success(event):
     pass
 
 
+def handle_pricing_change(event):
+    # Re-render pages showing prices.
+    bump_versions(db.session.connection(), {PRICING})
+    db.session.commit()
+
+
 def handle_new_customer(event):
     object = event.data.object
 
@@ -288,6 +318,7 @@ def booking_success():
                     & (Session.end_time == s.end_time)
                     & (Session.facility_id == s.facility_id)
                     & (Session.session_type == s.session_type)
+                    & (Session.site == s.site)
                 )
             ).scalar()
 
@@ -297,6 +328,7 @@ def booking_success():
             sess_objs.append(s)
             db.session.add(s)
         db.session.commit()
+        BOOKINGS.inc(len(sess_objs), booked_by=current_user.role.name.lower())
         session["booked_sessions"] = []
         flash("Booked", "success")
     return user_home()
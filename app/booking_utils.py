@@ -7,20 +7,41 @@ from app.models import (
     act_to_str,
     facil_to_str,
     Facility,
+    user_session_m2m,
 )
-from sqlalchemy import select
+from app.cache import TIMETABLE, occupancy_version, user_version, cached_fragment
+from app.sites import current_site
+from sqlalchemy import and_, func, select
 from app import db
+from flask import render_template
 from flask_login import current_user
-import json
+from markupsafe import Markup
 
 
 class CalanderItem:
-    def __init__(self, date: datetime.date, type="general") -> None:
+    # The columns of each row in create_columnar_JSON_from_activities.
+    COLUMNS = [
+        "id",
+        "activity",
+        "facility",
+        "start_time",
+        "end_time",
+        "session_type",
+        "facility_id",
+        "length",
+        "starts",
+        "remaining",
+    ]
+
+    def __init__(
+        self, date: datetime.date, type="general", hide_full: bool = False
+    ) -> None:
         """
         A class that generates items that can be displayed as some kind of calander to help the user book a session.
         params:
             date: The date to generate activities for.
             type: One of 'general', 'class', 'team', 'all'. Filters the returned results.
+            hide_full: Leave out sessions with no places left.
         """
         self.date = date
         self.weekday = date.weekday()
@@ -37,9 +58,14 @@ class CalanderItem:
             "all": list(Activities),
         }
         self.filter = self.filters[type]
+        self._busy_times = None
+        self.hide_full = hide_full
+        self.capacity = SlotCapacity(date, date + datetime.timedelta(days=1))
         self.activities = (
             db.session.execute(
-                select(Activity).where((Activity.day == Days(self.weekday)))
+                select(Activity)
+                .where(Activity.site == current_site())
+                .where(Activity.day == Days(self.weekday))
             )
             .scalars()
             .all()
@@ -57,6 +83,7 @@ class CalanderItem:
             activity.start_time.hour, activity.end_time.hour, session_length
         ):
             s = Session(
+                site=activity.site,
                 session_type=activity.activity_type,
                 facility_id=activity.facility_id,
                 start_time=datetime.datetime(
@@ -70,6 +97,8 @@ class CalanderItem:
             sessions.append(s)
 
         sessions = self.remove_invalid_sessions(sessions)
+        if self.hide_full:
+            sessions = [s for s in sessions if self.capacity.remaining_for(s) > 0]
         return sessions
 
     @staticmethod
@@ -122,6 +151,8 @@ class CalanderItem:
                 "start_time": act.start_time,
                 "end_time": act.end_time,
                 "sessions": sessions,
+                # Places left on each session, in the same order.
+                "remaining": [self.capacity.remaining_for(s) for s in sessions],
             }
             activity_dicts.append(a)
 
@@ -130,7 +161,8 @@ class CalanderItem:
     def create_JSON_from_activities(self) -> "list[dict]":
         """
         Creates a dict for each activity on self.date along with a list of bookable sessions.
-        Intended to be passed to a template for front-end use.
+        Intended to be returned as JSON, see create_columnar_JSON_from_activities for
+        a smaller version.
         """
         activity_dicts = []
         for act in self.activities:
@@ -152,11 +184,85 @@ class CalanderItem:
                 "facility": facil_to_str[act.facility_id],
                 "start_time": act.start_time.isoformat(),
                 "end_time": act.end_time.isoformat(),
-                "sessions": [s.to_dict() for s in sessions],
+                "sessions": [
+                    dict(s.to_dict(), remaining=self.capacity.remaining_for(s))
+                    for s in sessions
+                ],
             }
             activity_dicts.append(a)
 
-        return json.dumps(activity_dicts)
+        return activity_dicts
+
+    def busy_times(self) -> "list[list[datetime.datetime]]":
+        """
+        Returns the merged [start_time, end_time] of the sessions the user has booked.
+        """
+        if self._busy_times is None:
+            times = [[s.start_time, s.end_time] for s in current_user.sessions]
+            self._busy_times = merge_session_times(times) if times else []
+        return self._busy_times
+
+    def available_start_hours(
+        self, activity: Activity, session_length: int
+    ) -> "list[int]":
+        """
+        Returns the start hours of the sessions of activity the user can book,
+        the same sessions as generate_sessions without creating a Session for each.
+        """
+        hours = []
+        for hour in range(
+            activity.start_time.hour, activity.end_time.hour, session_length
+        ):
+            start = datetime.datetime.combine(self.date, datetime.time(hour))
+            if any(busy[0] <= start < busy[1] for busy in self.busy_times()):
+                continue
+            if self.hide_full and self.remaining(activity, hour, session_length) <= 0:
+                continue
+            hours.append(hour)
+        return hours
+
+    def remaining(self, activity: Activity, hour: int, session_length: int) -> int:
+        """
+        Returns the places left on the session of activity starting at hour.
+        """
+        start = datetime.datetime.combine(self.date, datetime.time(hour))
+        return self.capacity.remaining(
+            activity.facility_id,
+            start,
+            start + datetime.timedelta(hours=session_length),
+        )
+
+    def create_columnar_JSON_from_activities(self) -> "dict":
+        """
+        A compact version of create_JSON_from_activities, for the calendar.
+        Each activity is a row of values in the order of CalanderItem.COLUMNS, and
+        instead of a dict for each session the row has the start hours of its sessions
+        and the places left on each.
+        A session's times and unique code can be rebuilt from its row, date and start hour.
+        """
+        rows = []
+        for act in self.activities:
+            if act.activity_type not in self.filter:
+                continue
+
+            length = 2 if act.activity_type == Activities.TEAM else 1
+            starts = self.available_start_hours(act, length)
+            rows.append(
+                [
+                    act.activity_id,
+                    act_to_str[act.activity_type],
+                    facil_to_str[act.facility_id],
+                    act.start_time.isoformat(),
+                    act.end_time.isoformat(),
+                    act.activity_type.value,
+                    act.facility_id.value,
+                    length,
+                    starts,
+                    [self.remaining(act, hour, length) for hour in starts],
+                ]
+            )
+
+        return {"date": self.date.isoformat(), "columns": self.COLUMNS, "rows": rows}
 
     def generate_overview(self) -> "tuple[str, list[dict]]":
         """
@@ -170,6 +276,104 @@ class CalanderItem:
         return (self.date.strftime("%a %d %b"), activity_dicts)
 
 
+def render_overview(
+    date: datetime.date, type: str, hide_full: bool, action: str
+) -> Markup:
+    """
+    Returns the sessions of a day rendered for the booking pages, with checkboxes
+    submitted to action. It only changes with the timetable, how full the day's
+    sessions are and the user's bookings, so is cached until one of those does.
+    """
+
+    def render():
+        c = CalanderItem(date, type=type, hide_full=hide_full)
+        return render_template(
+            "session_overview.html", activities=c.generate_overview(), action=action
+        )
+
+    user_id = current_user.user_id
+    return Markup(
+        cached_fragment(
+            ("session_overview", date, type, hide_full, action, user_id),
+            [
+                TIMETABLE,
+                occupancy_version(current_site(), date),
+                user_version(user_id),
+            ],
+            render,
+        )
+    )
+
+
+class SlotCapacity:
+    def __init__(self, start: datetime.date, end: datetime.date) -> None:
+        """
+        The places left on every session slot from start up to end, with one query.
+        As in get_facility_attendance, everyone booked into a facility at the same
+        time counts towards its max_capacity, whatever the activity.
+        """
+        self.start = start
+        self.end = end
+        self._capacities = None
+        # (facility_id, start_time, end_time): number booked
+        self._booked = None
+
+    def load(self) -> None:
+        start = datetime.datetime.combine(self.start, datetime.time())
+        end = datetime.datetime.combine(self.end, datetime.time())
+        # Facilities are outer joined so those without bookings still have a row.
+        rows = db.session.execute(
+            select(
+                Facility.facility_id,
+                Facility.max_capacity,
+                Session.start_time,
+                Session.end_time,
+                func.count(user_session_m2m.c.user_id),
+            )
+            .select_from(Facility)
+            .outerjoin(
+                Session,
+                and_(
+                    Session.site == Facility.site,
+                    Session.facility_id == Facility.facility_id,
+                    Session.start_time >= start,
+                    Session.start_time < end,
+                ),
+            )
+            .outerjoin(
+                user_session_m2m, user_session_m2m.c.session_id == Session.session_id
+            )
+            .where(Facility.site == current_site())
+            .group_by(
+                Facility.facility_id,
+                Facility.max_capacity,
+                Session.start_time,
+                Session.end_time,
+            )
+        ).all()
+
+        self._capacities = {}
+        self._booked = {}
+        for facility, capacity, start_time, end_time, booked in rows:
+            self._capacities[facility] = capacity
+            if start_time is not None:
+                self._booked[(facility, start_time, end_time)] = booked
+
+    def remaining(
+        self, facility, start_time: datetime.datetime, end_time: datetime.datetime
+    ) -> int:
+        """
+        Returns the places left in facility from start_time to end_time, 0 if it is full.
+        """
+        if self._capacities is None:
+            self.load()
+        capacity = self._capacities.get(facility) or 0
+        return max(capacity - self._booked.get((facility, start_time, end_time), 0), 0)
+
+    def remaining_for(self, session: Session) -> int:
+        return self.remaining(session.facility_id, session.start_time, session.end_time)
+
+
 def get_overlapping_sessions(session: Session) -> "list[Session]":
     """
     Get all session that are occuring at the same time and in the same facility as a given session.
@@ -181,6 +385,7 @@ def get_overlapping_sessions(session: Session) -> "list[Session]":
                 (Session.start_time == session.start_time)
                 & (Session.end_time == session.end_time)
                 & (Session.facility_id == session.facility_id)
+                & (Session.site == session.site)
             )
         )
         .scalars()
@@ -206,7 +411,9 @@ def get_facility(session: Session) -> Facility:
     Returns the Facility object of a given session
     """
     return db.session.execute(
-        select(Facility).where(Facility.facility_id == session.facility_id)
+        select(Facility)
+        .where(Facility.site == session.site)
+        .where(Facility.facility_id == session.facility_id)
     ).scalar()
 
 
@@ -232,14 +439,13 @@ def merge_session_times(
     return booked_time
 
 
-def session_expired(
-    session: Session, time: datetime.datetime = datetime.datetime.now()
-) -> bool:
+def session_expired(session: Session, time: datetime.datetime = None) -> bool:
     """
-    If the `start_time` of the session happened before `time` return True, else False
+    If the `start_time` of the session happened before `time` (default now) return True, else False
     """
-    if session.start_time <= time:
-        return True
+    if time is None:
+        time = datetime.datetime.now()
+    return session.start_time <= time
 
 
 def get_users_next_sessions(num: int = 3) -> "list[Session]":
@@ -0,0 +1,333 @@
+from flask import current_app, request, make_response, Response
+from flask import session as flask_session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event, inspect, select, update, insert
+from app.models import Activity, DataVersion, Facility, Session, User
+from app.metrics import CACHE_LOOKUPS
+from app.sites import current_site
+from app import db
+import collections
+import datetime
+import functools
+import threading
+import hashlib
+import time
+
+TIMETABLE = "timetable"
+# Bumped when Stripe tells us prices or discounts have changed.
+PRICING = "pricing"
+
+# The versions that aren't per user or per day, see shared_versions()
+SHARED_VERSIONS = (TIMETABLE, PRICING)
+
+# Browsers may keep responses, but must check they are still current with the
+# ETag before using them, as bookings can change at any time.
+CACHE_CONTROL = "private, no-cache"
+
+
+def user_version(user_id: int) -> str:
+    """
+    Returns the name of the version of a user's bookings.
+    """
+    return f"user:{user_id}"
+
+
+def occupancy_version(site: str, date: datetime.date) -> str:
+    """
+    Returns the name of the version of how full a site's sessions on date are.
+    Kept per site and day so bookings don't all wait on the same row to update it.
+    """
+    return f"occupancy:{site}:{date.isoformat()}"
+
+
+def occupancy_versions(sessions) -> "set[str]":
+    """
+    Returns the occupancy versions of the days of sessions, which can be Session
+    objects or rows with their site and start_time.
+    """
+    return {
+        occupancy_version(session.site, session.start_time.date())
+        for session in sessions
+        if session.start_time is not None
+    }
+
+
+def session_occupancy(obj: Session) -> "set[str]":
+    """
+    Returns the occupancy versions of the day a session is on, and the day it was
+    on if that is being changed.
+    """
+    state = inspect(obj)
+    sites = set(state.attrs.site.history.sum()) or {obj.site}
+    starts = state.attrs.start_time.history.sum() or [obj.start_time]
+    return {
+        occupancy_version(site, start.date())
+        for site in sites
+        for start in starts
+        if site is not None and start is not None
+    }
+
+
+def changed_versions(session) -> "set[str]":
+    """
+    Returns the names of the versions changed by the objects a db session is flushing.
+    """
+    names = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Activity, Facility)):
+            names.add(TIMETABLE)
+
+        elif isinstance(obj, Session):
+            users = inspect(obj).attrs.users
+            history = users.history
+            changed = list(history.added) + list(history.deleted)
+            if obj in session.deleted and isinstance(users.loaded_value, list):
+                changed += users.loaded_value
+            if changed or obj in session.deleted:
+                names.update(session_occupancy(obj))
+            names.update(user_version(u.user_id) for u in changed)
+
+        elif isinstance(obj, User):
+            sessions = inspect(obj).attrs.sessions
+            changed = list(sessions.history.added) + list(sessions.history.deleted)
+            if obj in session.deleted and isinstance(sessions.loaded_value, list):
+                changed += sessions.loaded_value
+            if changed or obj in session.deleted:
+                names.add(user_version(obj.user_id))
+            for booked in changed:
+                names.update(session_occupancy(booked))
+    return names
+
+
+def bump_versions(connection, names: "set[str]") -> None:
+    """
+    Increments the named versions, creating any that don't exist yet.
+    """
+    if not names:
+        return
+
+    # Imported here as importing the postgresql dialect is slow, and it is already
+    # imported by the time this runs if the db is PostgreSQL.
+    from sqlalchemy.dialects import postgresql, sqlite
+
+    dialects = {"sqlite": sqlite, "postgresql": postgresql}
+    dialect = dialects.get(connection.dialect.name)
+    table = DataVersion.__table__
+    if dialect is not None:
+        statement = dialect.insert(table).values(
+            [{"name": name, "version": 1} for name in sorted(names)]
+        )
+        connection.execute(
+            statement.on_conflict_do_update(
+                index_elements=[table.c.name],
+                set_={"version": table.c.version + 1},
+            )
+        )
+        return
+
+    for name in sorted(names):
+        result = connection.execute(
+            update(table)
+            .where(table.c.name == name)
+            .values(version=table.c.version + 1)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(name=name, version=1))
+
+
+def get_versions(names: "list[str]") -> "dict":
+    """
+    Returns the current number of each named version, 0 if it has never changed.
+    """
+    rows = db.session.execute(
+        select(DataVersion.name, DataVersion.version).where(DataVersion.name.in_(names))
+    ).all()
+    versions = dict.fromkeys(names, 0)
+    versions.update(rows)
+    return versions
+
+
+def make_etag(names: "list[str]", *parts) -> str:
+    """
+    Returns an ETag that changes whenever one of the named versions or parts does.
+    params:
+        names: The versions the response depends on.
+        parts: Anything else it depends on, e.g the URL params.
+    """
+    versions = get_versions(names)
+    key = "|".join([f"{n}={versions[n]}" for n in names] + [str(p) for p in parts])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def not_modified(etag: str):
+    """
+    Returns True if the client already has the response with this ETag.
+    The ETag may have been made weak by compression, see compression.py
+    """
+    return request.if_none_match.contains_weak(etag)
+
+
+def cacheable(response, etag: str):
+    """
+    Returns response, or an empty 304 Not Modified, with the ETag and cache headers set.
+    """
+    response = make_response(response if response is not None else ("", 304))
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.vary.add("Cookie")
+    return response
+
+
+def init_versioning(app) -> None:
+    """
+    Bumps the versions affected by each flush, in the same transaction so they are
+    rolled back with it.
+    Bulk inserts and updates that skip the ORM must call bump_versions themselves.
+    Also makes cache_fragment available to templates.
+    """
+    fragments.maxsize = app.config.get("FRAGMENT_CACHE_SIZE", 512)
+    fragments.clear()
+    _snapshots.clear()
+    app.jinja_env.globals["cache_fragment"] = cache_fragment
+
+    if event.contains(db.session, "after_flush", on_flush):
+        return
+    event.listen(db.session, "after_flush", on_flush)
+
+
+def on_flush(session, flush_context) -> None:
+    names = changed_versions(session)
+    bump_versions(session.connection(), names)
+    if names & set(SHARED_VERSIONS):
+        # Don't wait for the snapshot to expire to see our own changes.
+        _snapshots.pop(current_site(), None)
+
+
+# The SHARED_VERSIONS of each site as last read from the db by this process, sites
+# with their own db have their own versions.
+_snapshots = {}
+_snapshot_lock = threading.Lock()
+
+
+def shared_versions(names: "list[str]") -> "dict":
+    """
+    Returns the named SHARED_VERSIONS, reading them from the db at most once every
+    VERSION_CHECK_SECONDS in each process. Changes made by other processes can take
+    that long to be seen, changes made by this one are seen straight away.
+    """
+    max_age = current_app.config.get("VERSION_CHECK_SECONDS", 5)
+    site = current_site()
+    with _snapshot_lock:
+        snapshot = _snapshots.get(site)
+        if snapshot is None or time.monotonic() - snapshot["loaded"] > max_age:
+            snapshot = {
+                "versions": get_versions(list(SHARED_VERSIONS)),
+                "loaded": time.monotonic(),
+            }
+            _snapshots[site] = snapshot
+    return {name: snapshot["versions"][name] for name in names}
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 512) -> None:
+        """
+        A dict that keeps the maxsize most recently used items.
+        Each worker process has its own.
+        """
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+# Rendered fragments and pages, keyed by what they depend on and the versions
+# they were rendered at. Entries for old versions are never used again, and are
+# dropped as new ones push them out.
+fragments = LRUCache()
+
+_MISSING = object()
+
+
+def cached_fragment(key: tuple, names: "list[str]", render, shared: bool = False):
+    """
+    Returns render(), reusing the result until one of the named versions changes.
+    params:
+        key: Everything else the fragment depends on, e.g ("overview", date, user_id).
+        names: The versions it depends on.
+        render: Function that builds the fragment.
+        shared: Read the versions with shared_versions(), which doesn't query the db
+            but can be a few seconds out of date. Only for SHARED_VERSIONS.
+    """
+    versions = shared_versions(names) if shared else get_versions(names)
+    # Each site has its own timetable, and its own versions if it has its own db.
+    full_key = (current_site(), key, tuple(versions[name] for name in names))
+    value = fragments.get(full_key, _MISSING)
+    if value is not _MISSING:
+        CACHE_LOOKUPS.inc(cache=key[0], result="hit")
+        return value
+
+    CACHE_LOOKUPS.inc(cache=key[0], result="miss")
+    value = render()
+    fragments.set(full_key, value)
+    return value
+
+
+def cache_fragment(name: str, *parts, versions=(TIMETABLE, PRICING), caller=None):
+    """
+    Caches the body of a {% call cache_fragment(name, *parts) %} block in a template
+    until one of the versions changes. The block must be the same for everyone.
+    """
+    return Markup(cached_fragment((name,) + parts, list(versions), caller, shared=True))
+
+
+def cache_page(*names):
+    """
+    Decorator for pages that are the same for every visitor who isn't logged in.
+    They are sent a copy of the page rendered for an earlier one until one of the
+    named versions changes, without the view being called or the db queried.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Flashed messages and the basket are shown in the nav bar.
+            if (
+                current_user.is_authenticated
+                or flask_session.get("_flashes")
+                or flask_session.get("booked_sessions")
+            ):
+                return view(*args, **kwargs)
+
+            def render():
+                response = make_response(view(*args, **kwargs))
+                return response.status_code, response.get_data(), response.mimetype
+
+            status, body, mimetype = cached_fragment(
+                ("page", request.full_path), list(names), render, shared=True
+            )
+            return Response(body, status, mimetype=mimetype)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,167 @@
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+from werkzeug.security import safe_join
+import mimetypes
+import gzip
+import os
+import click
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/csv",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+}
+
+# Static files worth precompressing, images are already compressed.
+STATIC_EXTENSIONS = (".css", ".js", ".json", ".svg", ".html", ".txt", ".map")
+
+# Content-Encoding: file extension of the precompressed copy, best first.
+PRECOMPRESSED = {"br": ".br", "gzip": ".gz"}
+
+
+def accepted_encoding(encodings=None) -> str:
+    """
+    Returns the best encoding the client accepts out of encodings, or None.
+    params:
+        encodings: Defaults to br if brotli is installed, then gzip.
+    """
+    if encodings is None:
+        encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+    for encoding in encodings:
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    # mtime=0 so the same data always compresses to the same bytes.
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_response(response):
+    """
+    Compresses the body of a response if the client accepts it and it is worth it.
+    """
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+        or response.content_length is None
+        or response.content_length < current_app.config.get("COMPRESS_MIN_SIZE", 500)
+    ):
+        return response
+
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+
+    level = current_app.config.get(
+        "COMPRESS_BR_QUALITY" if encoding == "br" else "COMPRESS_LEVEL",
+        4 if encoding == "br" else 6,
+    )
+    response.set_data(compress(response.get_data(), encoding, level))
+    response.headers["Content-Encoding"] = encoding
+
+    # The compressed body is a different representation to the uncompressed one.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def send_precompressed(directory: str, filename: str):
+    """
+    Sends a static file, using its .br or .gz copy if the client accepts it and the
+    copy is at least as new as the file. See compress_static_command.
+    """
+    path = safe_join(directory, filename)
+    if path is not None and filename.endswith(STATIC_EXTENSIONS):
+        # The brotli module isn't needed to serve files it compressed earlier.
+        for encoding, extension in PRECOMPRESSED.items():
+            if not request.accept_encodings[encoding]:
+                continue
+            if not os.path.isfile(path + extension) or os.path.getmtime(
+                path + extension
+            ) < os.path.getmtime(path):
+                continue
+
+            response = send_from_directory(
+                directory,
+                filename + extension,
+                mimetype=mimetypes.guess_type(filename)[0],
+            )
+            response.headers["Content-Encoding"] = encoding
+            response.vary.add("Accept-Encoding")
+            return response
+    return send_from_directory(directory, filename)
+
+
+def static_folders(app) -> "dict":
+    """
+    Returns the static endpoint: folder of the app and each blueprint with static files.
+    """
+    folders = {}
+    if app.static_folder:
+        folders["static"] = app.static_folder
+    for name, blueprint in app.blueprints.items():
+        if blueprint.static_folder:
+            folders[f"{name}.static"] = blueprint.static_folder
+    return folders
+
+
+def init_compression(app) -> None:
+    """
+    Compresses responses of at least COMPRESS_MIN_SIZE bytes with brotli (if installed)
+    or gzip, and serves precompressed static files. Call after registering blueprints.
+    """
+    app.after_request(compress_response)
+
+    for endpoint, folder in static_folders(app).items():
+
+        def send_static(filename, folder=folder):
+            return send_precompressed(folder, filename)
+
+        app.view_functions[endpoint] = send_static
+
+
+@click.command("compress-static")
+@with_appcontext
+def compress_static_command():
+    """
+    Writes a .gz (and .br if brotli is installed) copy of each text file in the
+    static folders, for send_precompressed to serve. Run again after editing them.
+    """
+    written = 0
+    for folder in static_folders(current_app).values():
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if not name.endswith(STATIC_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, "rb") as file:
+                    data = file.read()
+
+                for encoding, extension in PRECOMPRESSED.items():
+                    if encoding == "br" and brotli is None:
+                        continue
+                    level = 11 if encoding == "br" else 9
+                    with open(path + extension, "wb") as file:
+                        file.write(compress(data, encoding, level))
+                    written += 1
+    click.echo(f"Wrote {written} compressed files")
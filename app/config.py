@@ -2,6 +2,68 @@ import os
 
 TESTING = False
 DEBUG = False
+
+# SQLite tuning, applied to every new connection. See app/db_config.py
+SQLITE_JOURNAL_MODE = "WAL"
+SQLITE_SYNCHRONOUS = "NORMAL"
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+SQLITE_BUSY_TIMEOUT = 5000
+
+# Connection pool
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT = 30
+DB_POOL_RECYCLE = 3600
+# Log queries slower than this many milliseconds to instance/slow_queries.log
+# Leave unset to disable.
+SLOW_QUERY_THRESHOLD_MS = os.getenv("SLOW_QUERY_THRESHOLD_MS")
+SLOW_QUERY_LOG_MAX_BYTES = 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+# Log the values bound to slow statements, which include password hashes and emails.
+# Only their types are logged otherwise.
+SLOW_QUERY_LOG_PARAMETERS = False
+
+# Sample the stacks of these endpoints (comma seperated) from startup, see app/profiler.py
+# They can also be profiled from the admin area without restarting.
+PROFILE_ENDPOINTS = os.getenv("PROFILE_ENDPOINTS")
+PROFILE_RATE_HZ = 100
+
+# Bearer token required to read /metrics. Without one it is only served in debug
+# mode and tests.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Compress responses of at least this many bytes, see app/compression.py
+COMPRESS_MIN_SIZE = 500
+COMPRESS_LEVEL = 6  # gzip, 1-9
+COMPRESS_BR_QUALITY = 4  # brotli, 0-11. Higher is much slower.
+
+# Rendered fragments and pages each worker keeps, see app/cache.py
+FRAGMENT_CACHE_SIZE = 512
+# How often each worker checks for timetable and pricing changes made by other workers.
+VERSION_CHECK_SECONDS = 5
+
+# Background jobs such as expiring memberships, see app/scheduler.py
+# Set SCHEDULER_ENABLED=0 on all but one deployment, or to run them with `flask run-jobs` from cron.
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") != "0"
+SCHEDULER_POLL_SECONDS = 60
+# How long after a membership expires before it is ended, if Stripe hasn't renewed it.
+MEMBERSHIP_GRACE_HOURS = 24
+
+# Sessions that ended this many days ago are moved to the archive tables, see app/archive.py
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 1000
+
+# Each centre is a site, see app/sites.py. Requests are for the site matching their
+# host name or first part of the path, or "main" if neither match.
+SITE_HOSTS = {}  # e.g {"north.example.com": "north"}
+SITE_PATHS = {}  # e.g {"/north": "north"}
+
+# Site name: SQLALCHEMY_BINDS key of a db just for that site, including its user
+# accounts. Sites not listed share the default db, told apart by a site column.
+# e.g SITE_BINDS = {"north": "north"}
+#     SQLALCHEMY_BINDS = {"north": "sqlite:///north.db"}
+SITE_BINDS = {}
+
 # This is the DEV secret, when we release
 SECRET_KEY = os.getenv("SECRET_KEY")
 if SECRET_KEY is None:
@@ -163,17 +163,63 @@ const updateSessDisplay = () => {
 }
 updateSessDisplay();
 
+const pad = (n) => String(n).padStart(2, "0");
+
+// Turns the columnar get_sessions format back into an object per activity, with a list
+// of its sessions, rebuilding each session's times and code from its start hour.
+const decodeColumnar = (data) => {
+    const col = {};
+    data.columns.forEach((name, i) => col[name] = i);
+    const [y, m, d] = data.date.split("-");
+
+    return data.rows.map(row => ({
+        id: row[col.id],
+        activity: row[col.activity],
+        facility: row[col.facility],
+        start_time: row[col.start_time],
+        end_time: row[col.end_time],
+        sessions: row[col.starts].map((hour, i) => {
+            const end = hour + row[col.length];
+            return {
+                session_type: row[col.session_type],
+                facility_id: row[col.facility_id],
+                start_time: `${data.date}T${pad(hour)}:00:00`,
+                end_time: `${data.date}T${pad(end)}:00:00`,
+                remaining: row[col.remaining][i],
+                // Same as Session.unique_code()
+                session_code: `${row[col.session_type]}-${row[col.facility_id]}-${d}/${m}/${y.slice(2)}-${pad(hour)}-${pad(end)}`
+            };
+        })
+    }));
+}
+
+// url: {etag, response}, so days that have been seen before are only re-sent if they changed.
+const sessionCache = {};
+
 const generateHTTPRequest = () => {
     var sessionContainer = $(".session-container") // find the element with session-container class
     var dataToParse = `${dateButtonYear}-${dateButtonMonth}-${dateButtonDate}-${type}` // FORMAT: YYYY-MM-DD-type
+    var url = '/customer/get_sessions/' + `${dataToParse}` + '?format=columnar';
+    var cached = sessionCache[url];
 
     $.ajax({
-        url: '/customer/get_sessions/' + `${dataToParse}`,
+        url: url,
         type: 'GET',
         contentType: "application/json; charset=utf-8",
         dataType: "json",
-
-        success: function (response) {
+        // The server replies 304 Not Modified, with no body, if our copy is still current.
+        headers: cached ? { "If-None-Match": cached.etag } : {},
+
+        success: function (response, status, xhr) {
+            if (xhr.status == 304) {
+                response = cached.response;
+            }
+            else {
+                response = decodeColumnar(response);
+                if (xhr.getResponseHeader("ETag")) {
+                    sessionCache[url] = { etag: xhr.getResponseHeader("ETag"), response: response };
+                }
+            }
 
             var listGroup = document.createElement("div");
             listGroup.classList.add("list-group", "mb-4");
@@ -14,16 +14,24 @@ from sqlalchemy import select
 from app.forms import ActivitySelectForm, UpdateUserDetailsForm
 from app.booking_utils import (
     CalanderItem,
+    render_overview,
     get_facility,
     get_facility_attendance,
-    session_expired,
     get_users_next_sessions,
     group_session_list_by_day,
 )
+from app.cache import (
+    TIMETABLE,
+    occupancy_version,
+    user_version,
+    make_etag,
+    not_modified,
+    cacheable,
+)
+from app.archive import history_page
+from app.sites import current_site
 from werkzeug.urls import url_parse
-from stripe import error
 import datetime
-import json
 
 
 customer = Blueprint(
@@ -58,15 +66,15 @@ def membership():
 @requires_role(Roles.CUSTOMER)
 def booking():
     form = ActivitySelectForm()
-    sessions = None
 
     if form.validate_on_submit():
-        c = CalanderItem(form.date.data, type=form.type.data)
-        sessions = c.generate_overview()
-
-        # Remove any sessions the user has already booked.
-        sessions = [s for s in sessions if s not in flask_session["booked_sessions"]]
-        return render_template("session_booking.html", form=form, activities=sessions)
+        overview = render_overview(
+            form.date.data,
+            form.type.data,
+            form.hide_full.data,
+            url_for("customer.save_session"),
+        )
+        return render_template("session_booking.html", form=form, overview=overview)
 
     return render_template("session_booking.html", form=form)
 
@@ -91,13 +99,10 @@ def save_session():
 @customer.route("/manage_sessions")
 @requires_role(Roles.CUSTOMER)
 def manage_sessions():
-    sessions = current_user.sessions
+    upcoming = history_page(current_user.user_id, past=False, args=request.args)
+    past = history_page(current_user.user_id, past=True, args=request.args)
 
-    sessions = [
-        (sess, True) if session_expired(sess) else (sess, False) for sess in sessions
-    ]
-
-    return render_template("session_management.html", sessions=sessions)
+    return render_template("session_management.html", upcoming=upcoming, past=past)
 
 
 @customer.route("/delete_session/<id>", methods=["GET", "POST"])
@@ -140,6 +145,7 @@ def checkout():
                 & (Session.end_time == s.end_time)
                 & (Session.facility_id == s.facility_id)
                 & (Session.session_type == s.session_type)
+                & (Session.site == s.site)
             )
         ).scalar()
 
@@ -183,6 +189,18 @@ def checkout():
 @customer.route("/get_sessions/<data>")
 @requires_role(Roles.CUSTOMER)
 def get_sessions(data=None):  # data: YYYY-MM-DD-type
+    """
+    Returns the bookable sessions for a day as JSON.
+    URL params:
+        format: 'columnar' for the compact format of
+            CalanderItem.create_columnar_JSON_from_activities
+        hide_full: Set to leave out sessions with no places left.
+    The response only changes with the timetable, how full the day's sessions are and
+    the user's own bookings, so it has an ETag built from their versions and
+    unchanged responses are sent as a 304 without being rebuilt.
+    """
+    columnar = request.args.get("format") == "columnar"
+    hide_full = bool(request.args.get("hide_full"))
     if data is None:
         date = datetime.date.today()
         type = "general"
@@ -195,11 +213,24 @@ def get_sessions(data=None):  # data: YYYY-MM-DD-type
 
         type = data.split("-")[3]
 
-    c = CalanderItem(date, type)
-    sessions = c.create_JSON_from_activities()
-    js = json.loads(sessions)
+    etag = make_etag(
+        [
+            TIMETABLE,
+            occupancy_version(current_site(), date),
+            user_version(current_user.user_id),
+        ],
+        data,
+        columnar,
+        hide_full,
+        datetime.date.today(),
+    )
+    if not_modified(etag):
+        return cacheable(None, etag)
 
-    return js
+    c = CalanderItem(date, type, hide_full)
+    if columnar:
+        return cacheable(c.create_columnar_JSON_from_activities(), etag)
+    return cacheable(c.create_JSON_from_activities(), etag)
 
 
 @customer.route("/settings", methods=["POST", "GET"])
@@ -249,7 +280,7 @@ def delete_account():
     if current_user.stripe_id is not None:
         try:
             stripe.Customer.delete(current_user.stripe_id)
-        except error.InvalidRequestError as e:
+        except stripe.error.InvalidRequestError as e:
             print(str(e))
 
     user_id = current_user.user_id
@@ -279,7 +310,7 @@ def payment_info():
             customer=current_user.stripe_id,
             return_url=url_for("customer.settings", _external=True),
         )
-    except error.InvalidRequestError:
+    except stripe.error.InvalidRequestError:
         flash("Could not create billing portal", "warning")
 
     if portal is not None:
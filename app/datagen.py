@@ -0,0 +1,309 @@
+from app.models import (
+    Activities,
+    Activity,
+    Days,
+    Facility,
+    Membership,
+    Roles,
+    Session,
+    User,
+    user_session_m2m,
+)
+from app.search_utils import customer_index_suspended
+from app.cache import bump_versions, occupancy_version
+from app.sites import current_site
+from app import db, hasher
+from sqlalchemy import func, insert, select
+from flask.cli import with_appcontext
+import collections
+import datetime
+import random
+import string
+import click
+
+# Share of members with each membership.
+MEMBERSHIPS = {Membership.NONE: 0.6, Membership.MONTH: 0.28, Membership.YEAR: 0.12}
+
+# Share of members without a membership who have a Stripe customer,
+# i.e. have paid for a session before.
+PAYING_NON_MEMBERS = 0.45
+
+# How full each facility is by hour of the day, as a fraction of max_capacity.
+HOURLY_DEMAND = {
+    8: 0.35, 9: 0.3, 10: 0.25, 11: 0.25, 12: 0.4, 13: 0.35, 14: 0.2,
+    15: 0.2, 16: 0.3, 17: 0.6, 18: 0.75, 19: 0.7, 20: 0.5, 21: 0.3,
+}  # fmt: skip
+
+# Weekends are busier in the day, quieter in the evening.
+WEEKEND_DEMAND = {hour: 0.5 if hour < 17 else 0.35 for hour in range(8, 22)}
+
+# Rows per INSERT when loading, larger uses more memory.
+CHUNK_SIZE = 50000
+
+
+def stripe_id(rng: random.Random) -> str:
+    return "cus_" + "".join(rng.choices(string.ascii_letters + string.digits, k=14))
+
+
+def generate_members(
+    count: int, rng: random.Random, password: str = None, employees: int = 0
+) -> "list[int]":
+    """
+    Bulk inserts `count` customers and `employees` employees.
+    Memberships and Stripe customers are spread as in MEMBERSHIPS and PAYING_NON_MEMBERS,
+    with active memberships expiring some time in the next month or year.
+    Every user shares one password hash (of 'password' by default), as hashing is slow.
+    Returns the ids of the new customers.
+    """
+    password = password or hasher.hash("password")
+    now = datetime.datetime.now()
+    # Only used to make unique usernames, the db gives each user its id.
+    first = (db.session.execute(select(func.max(User.user_id))).scalar() or 0) + 1
+
+    users = []
+    for number in range(first, first + count + employees):
+        if number >= first + count:
+            users.append(
+                {
+                    "username": f"employee{number}",
+                    "email": "",
+                    "password": password,
+                    "role": Roles.EMPLOYEE,
+                    "membership": Membership.NONE,
+                    "membership_expiration_date": None,
+                    "stripe_id": None,
+                }
+            )
+            continue
+
+        membership = rng.choices(list(MEMBERSHIPS), weights=MEMBERSHIPS.values())[0]
+        expires = None
+        if membership == Membership.MONTH:
+            expires = now + datetime.timedelta(days=rng.uniform(0, 31))
+        elif membership == Membership.YEAR:
+            expires = now + datetime.timedelta(days=rng.uniform(0, 365))
+
+        paying = membership != Membership.NONE or rng.random() < PAYING_NON_MEMBERS
+        users.append(
+            {
+                "username": f"member{number}",
+                "email": f"member{number}@mail.com",
+                "password": password,
+                "role": Roles.CUSTOMER,
+                "membership": membership,
+                "membership_expiration_date": expires,
+                "stripe_id": stripe_id(rng) if paying else None,
+            }
+        )
+
+    with customer_index_suspended():
+        user_ids = insert_with_ids(User.__table__, users, ["username"])
+    return user_ids[:count]
+
+
+def timetable_slots(date: datetime.date, activities: "list[Activity]") -> "dict":
+    """
+    Returns the bookable slots on date, following the Activity timetable.
+    The dict is keyed by (facility, start, end), with a list of the activity types
+    that can be booked in that slot, as the facility's capacity is shared between them.
+    """
+    slots = collections.defaultdict(list)
+    for act in activities:
+        if act.day != Days(date.weekday()):
+            continue
+        length = 2 if act.activity_type == Activities.TEAM else 1
+        for hour in range(act.start_time.hour, act.end_time.hour, length):
+            start = datetime.datetime.combine(date, datetime.time(hour))
+            end = start + datetime.timedelta(hours=length)
+            slots[(act.facility_id, start, end)].append(act.activity_type)
+    return slots
+
+
+def generate_bookings(
+    customer_ids: "list[int]",
+    start: datetime.date,
+    end: datetime.date,
+    rng: random.Random,
+    demand: float = 1.0,
+) -> "tuple[int, int]":
+    """
+    Bulk inserts sessions for every timetabled slot from start up to end, booked by
+    customers in customer_ids. Each slot is filled to a share of its facility's
+    max_capacity that depends on the time of day (HOURLY_DEMAND, WEEKEND_DEMAND) and
+    demand, and no customer is booked onto two sessions that start at the same time.
+    Only the sessions someone booked are created, as in the app.
+    Returns (number of sessions, number of bookings).
+    """
+    site = current_site()
+    activities = (
+        db.session.execute(select(Activity).where(Activity.site == site))
+        .scalars()
+        .all()
+    )
+    capacities = dict(
+        db.session.execute(
+            select(Facility.facility_id, Facility.max_capacity).where(
+                Facility.site == site
+            )
+        ).all()
+    )
+    sessions = []
+    # (user_id, index of the session in sessions), as the sessions' ids are only
+    # known once they are inserted.
+    bookings = []
+    session_count = booking_count = 0
+    date = start
+    while date < end:
+        weekend = date.weekday() >= 5
+        busy = collections.defaultdict(set)
+        for (facility, begin, finish), types in timetable_slots(
+            date, activities
+        ).items():
+            hours = WEEKEND_DEMAND if weekend else HOURLY_DEMAND
+            fill = min(hours.get(begin.hour, 0.2) * demand * rng.uniform(0.5, 1.5), 1)
+            attendees = min(int(capacities.get(facility, 0) * fill), len(customer_ids))
+
+            # Split the attendees between the activities in the slot.
+            booked = collections.defaultdict(list)
+            taken = busy[begin]
+            user_ids = [
+                u for u in rng.sample(customer_ids, attendees) if u not in taken
+            ]
+            taken.update(user_ids)
+            for user_id, activity_type in zip(
+                user_ids, rng.choices(types, k=len(user_ids))
+            ):
+                booked[activity_type].append(user_id)
+
+            for activity_type, user_ids in booked.items():
+                sessions.append(
+                    {
+                        "site": site,
+                        "session_type": activity_type,
+                        "facility_id": facility,
+                        "start_time": begin,
+                        "end_time": finish,
+                        "is_class": 0,
+                    }
+                )
+                bookings += [(user_id, len(sessions) - 1) for user_id in user_ids]
+
+        # Load as we go so memory use doesn't grow with the number of months.
+        if len(bookings) >= CHUNK_SIZE:
+            session_count += len(sessions)
+            booking_count += insert_sessions(sessions, bookings)
+            sessions, bookings = [], []
+        date += datetime.timedelta(days=1)
+
+    session_count += len(sessions)
+    booking_count += insert_sessions(sessions, bookings)
+    return session_count, booking_count
+
+
+def insert_sessions(sessions: "list[dict]", bookings: "list[tuple[int, int]]") -> int:
+    """
+    Inserts sessions, then bookings of (user_id, index of the session in sessions).
+    Returns the number of bookings inserted.
+    """
+    session_ids = insert_with_ids(
+        Session.__table__, sessions, ["session_type", "facility_id", "start_time"]
+    )
+    return insert_bookings([(user_id, session_ids[i]) for user_id, i in bookings])
+
+
+def insert_with_ids(table, rows: "list[dict]", key: "list[str]") -> "list[int]":
+    """
+    Inserts rows into table CHUNK_SIZE at a time with executemany, skipping the ORM.
+    The db gives each row its primary key, so the table's sequence (or SQLite's
+    AUTOINCREMENT counter) moves on past them.
+    params:
+        key: Columns whose values are unique among rows, used to match up the keys
+            the db returns with the rows, as they can come back in any order.
+    Returns the primary key of each row, in the order of rows.
+    """
+    [primary_key] = table.primary_key.columns
+    statement = insert(table).returning(primary_key, *[table.c[name] for name in key])
+    ids = {}
+    for i in range(0, len(rows), CHUNK_SIZE):
+        result = db.session.execute(statement, rows[i : i + CHUNK_SIZE])
+        ids.update((tuple(values), new_id) for new_id, *values in result)
+    return [ids[tuple(row[name] for name in key)] for row in rows]
+
+
+def insert_bookings(bookings: "list[tuple[int, int]]") -> int:
+    """
+    Inserts (user_id, session_id) rows into user_sessions.
+    There are far more of these than anything else, so they go straight to the
+    driver's executemany, skipping SQLAlchemy's per row parameter processing.
+    Returns the number of rows inserted.
+    """
+    connection = db.session.connection()
+    placeholder = "?" if connection.dialect.paramstyle == "qmark" else "%s"
+    table = user_session_m2m.name
+    statement = f"INSERT INTO {table} (user_id, session_id) VALUES ({placeholder}, {placeholder})"
+    for i in range(0, len(bookings), CHUNK_SIZE):
+        connection.exec_driver_sql(statement, bookings[i : i + CHUNK_SIZE])
+    return len(bookings)
+
+
+def generate(
+    members: int,
+    months: float,
+    future_days: int = 14,
+    employees: int = 0,
+    demand: float = 1.0,
+    seed: int = None,
+) -> "dict":
+    """
+    Adds synthetic members and bookings to the db, which must already have the
+    facilities and timetable (see init_db).
+    params:
+        members: Number of customers to create.
+        months: How many months of past bookings to create.
+        future_days: Days of upcoming bookings to create.
+        employees: Number of employees to create.
+        demand: Multiplies how full each session is.
+        seed: Seed for the random choices, so the same data can be made again.
+    Returns the number of users, sessions and bookings created.
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+
+    start = today - datetime.timedelta(days=round(months * 30))
+    end = today + datetime.timedelta(days=future_days)
+
+    customer_ids = generate_members(members, rng, employees=employees)
+    sessions, bookings = generate_bookings(customer_ids, start, end, rng, demand)
+    # The bulk inserts skip the ORM events that do this.
+    site = current_site()
+    bump_versions(
+        db.session.connection(),
+        {
+            occupancy_version(site, start + datetime.timedelta(days=day))
+            for day in range((end - start).days)
+        },
+    )
+    db.session.commit()
+    return {"users": members + employees, "sessions": sessions, "bookings": bookings}
+
+
+@click.command("generate-data")
+@click.option("--members", default=1000, show_default=True, help="Customers to add.")
+@click.option("--months", default=3.0, show_default=True, help="Months of bookings.")
+@click.option("--future-days", default=14, show_default=True)
+@click.option("--employees", default=0, show_default=True)
+@click.option("--demand", default=1.0, show_default=True, help="How busy sessions are.")
+@click.option("--seed", type=int, help="Random seed, for repeatable data.")
+@with_appcontext
+def generate_data_command(members, months, future_days, employees, demand, seed):
+    """
+    Adds synthetic members and bookings to the db, for benchmarks and load tests.
+    """
+    import time
+
+    start = time.perf_counter()
+    counts = generate(members, months, future_days, employees, demand, seed)
+    click.echo(
+        f"Added {counts['users']} users, {counts['sessions']} sessions and "
+        f"{counts['bookings']} bookings in {time.perf_counter() - start:.1f}s"
+    )
@@ -0,0 +1,42 @@
+// Type-ahead suggestions for the customer search form
+
+const searchURL = document.currentScript.dataset.searchUrl;
+const identifierInput = document.querySelector("#identifier");
+const matchList = document.querySelector("#customer-matches");
+
+let searchTimer;
+let latestQuery = "";
+
+const showMatches = (customers) => {
+    matchList.innerHTML = "";
+    customers.forEach(customer => {
+        // Offer both the username and email, either can be used to find the customer.
+        var option = document.createElement("option");
+        option.value = customer.username;
+        option.label = customer.email;
+        matchList.append(option);
+    });
+}
+
+identifierInput.addEventListener("input", () => {
+    // Wait until staff stop typing so we don't send a request per key press.
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => {
+        let query = identifierInput.value.trim();
+        latestQuery = query;
+        if (!query) {
+            showMatches([]);
+            return;
+        }
+
+        fetch(`${searchURL}?q=${encodeURIComponent(query)}`)
+            .then(response => response.json())
+            .then(customers => {
+                // Ignore responses for queries that have since been replaced.
+                if (query == latestQuery) {
+                    showMatches(customers);
+                }
+            })
+            .catch(error => console.log(error));
+    }, 150);
+});
@@ -1,4 +1,13 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, session, request
+from flask import (
+    Blueprint,
+    render_template,
+    redirect,
+    url_for,
+    flash,
+    session,
+    request,
+    jsonify,
+)
 from app.utils import (
     requires_role,
     get_user_by_email,
@@ -8,11 +17,12 @@ from app.utils import (
     update_username,
 )
 from app.booking_utils import (
-    CalanderItem,
+    render_overview,
     get_facility,
     get_facility_attendance,
-    session_expired,
 )
+from app.search_utils import search_customers
+from app.archive import history_page
 from app.models import Roles, Session, User
 from app.forms import (
     UserSearchForm,
@@ -91,6 +101,18 @@ def search():
     )
 
 
+@employee.route("/search/customers")
+@requires_role(Roles.EMPLOYEE)
+def search_customers_json():
+    """
+    Type-ahead lookup of customers, used by the search form as staff type.
+    URL params:
+        q: Part of a username or email.
+    Returns a JSON list of {id, username, email}, best matches first.
+    """
+    return jsonify(search_customers(request.args.get("q", "")))
+
+
 @employee.route("/create", methods=["POST"])
 @requires_role(Roles.EMPLOYEE)
 def create():
@@ -131,15 +153,15 @@ def create():
 @requires_role(Roles.EMPLOYEE)
 def booking():
     form = ActivitySelectForm()
-    sessions = None
 
     if form.validate_on_submit():
-        c = CalanderItem(form.date.data, type=form.type.data)
-        sessions = c.generate_overview()
-
-        # Remove any sessions the user has already booked.
-        sessions = [s for s in sessions if s not in session["booked_sessions"]]
-        return render_template("booking.html", form=form, activities=sessions)
+        overview = render_overview(
+            form.date.data,
+            form.type.data,
+            form.hide_full.data,
+            url_for("employee.save_session"),
+        )
+        return render_template("booking.html", form=form, overview=overview)
 
     return render_template("booking.html", form=form)
 
@@ -176,6 +198,7 @@ def basket():
                 & (Session.end_time == s.end_time)
                 & (Session.facility_id == s.facility_id)
                 & (Session.session_type == s.session_type)
+                & (Session.site == s.site)
             )
         ).scalar()
 
@@ -220,13 +243,10 @@ def basket():
 def manage_sessions():
     user = User.get_by_id(session["customer_id"])
 
-    sessions = user.sessions
-
-    sessions = [
-        (sess, True) if session_expired(sess) else (sess, False) for sess in sessions
-    ]
+    upcoming = history_page(user.user_id, past=False, args=request.args)
+    past = history_page(user.user_id, past=True, args=request.args)
 
-    return render_template("session_management.html", sessions=sessions)
+    return render_template("session_management.html", upcoming=upcoming, past=past)
 
 
 @employee.route("/delete_session/<id>", methods=["GET", "POST"])
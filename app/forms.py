@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField, FileRequired
 from wtforms.validators import DataRequired, Length, EqualTo, Optional
 import wtforms.fields
 from app.models import Days, Facilities, Activities, Roles
@@ -41,6 +42,7 @@ class ActivitySelectForm(FlaskForm):
         ],
     )
     date = wtforms.fields.DateField("Date")
+    hide_full = wtforms.fields.BooleanField("Hide full sessions")
 
     submit = wtforms.fields.SubmitField("Find Sessions")
 
@@ -86,7 +88,7 @@ class ReAuthForm(FlaskForm):
 
 
 class EditActivityForm(FlaskForm):
-    activity_id = wtforms.fields.IntegerField()
+    activity_id = wtforms.fields.IntegerField(render_kw={"readonly": True})
     activity_type = wtforms.fields.SelectField(
         choices=[(e.value, e.name) for e in Activities]
     )
@@ -156,6 +158,20 @@ class AddEmployeeForm(FlaskForm):
     )
 
 
+class TimetableImportForm(FlaskForm):
+    file = FileField(
+        "Timetable (CSV or JSON)",
+        validators=[FileRequired(), FileAllowed(["csv", "json"], "CSV or JSON only")],
+    )
+    replace = wtforms.fields.BooleanField(
+        "Delete activities of the facilities in the file that aren't in it"
+    )
+
+    upload = wtforms.fields.SubmitField(
+        "Import", render_kw={"class": "btn btn-primary"}
+    )
+
+
 class PricingForm(FlaskForm):
     price_per_session = wtforms.fields.DecimalField(
         "The price of a 1-hour session in £",
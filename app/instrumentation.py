@@ -0,0 +1,278 @@
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from jinja2 import Template
+from .metrics import observe_request
+import collections
+import threading
+import statistics
+import time
+
+# Each timing recorded for a request, as (key in g.timings, Server-Timing name).
+TIMINGS = [
+    ("sql_time", "db"),
+    ("template_time", "tpl"),
+    ("stripe_time", "stripe"),
+]
+
+# Number of recent wall times kept per endpoint for the percentiles.
+RECENT_REQUESTS = 200
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        """
+        Running totals for every request served by one endpoint.
+        """
+        self.count = 0
+        self.wall_time = 0.0
+        self.max_wall_time = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.stripe_count = 0
+        self.stripe_time = 0.0
+        self.recent = collections.deque(maxlen=RECENT_REQUESTS)
+
+    def add(self, wall_time: float, timings: "dict") -> None:
+        self.count += 1
+        self.wall_time += wall_time
+        self.max_wall_time = max(self.max_wall_time, wall_time)
+        self.sql_count += timings["sql_count"]
+        self.sql_time += timings["sql_time"]
+        self.template_time += timings["template_time"]
+        self.stripe_count += timings["stripe_count"]
+        self.stripe_time += timings["stripe_time"]
+        self.recent.append(wall_time)
+
+    def summary(self) -> "dict":
+        """
+        Returns the averages per request, times are in milliseconds.
+        """
+        recent = sorted(self.recent)
+        if len(recent) > 1:
+            centiles = statistics.quantiles(recent, n=100)
+            p50, p95 = centiles[49], centiles[94]
+        else:
+            p50 = p95 = recent[0] if recent else 0.0
+
+        return {
+            "count": self.count,
+            "avg_ms": self.wall_time / self.count * 1000,
+            "p50_ms": p50 * 1000,
+            "p95_ms": p95 * 1000,
+            "max_ms": self.max_wall_time * 1000,
+            "avg_queries": self.sql_count / self.count,
+            "avg_sql_ms": self.sql_time / self.count * 1000,
+            "avg_template_ms": self.template_time / self.count * 1000,
+            "avg_stripe_calls": self.stripe_count / self.count,
+            "avg_stripe_ms": self.stripe_time / self.count * 1000,
+        }
+
+
+class RequestStats:
+    def __init__(self) -> None:
+        """
+        In-process aggregate of the request timings, keyed by endpoint.
+        Each worker process keeps its own.
+        """
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.since = time.time()
+
+    def record(self, endpoint: str, wall_time: float, timings: "dict") -> None:
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, EndpointStats())
+            stats.add(wall_time, timings)
+
+    def summary(self) -> "list[dict]":
+        """
+        Returns the stats for every endpoint, slowest in total first.
+        """
+        with self._lock:
+            rows = [
+                dict(
+                    endpoint=endpoint,
+                    total_ms=stats.wall_time * 1000,
+                    **stats.summary(),
+                )
+                for endpoint, stats in self._endpoints.items()
+            ]
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._endpoints = {}
+            self.since = time.time()
+
+
+def current_timings() -> "dict":
+    """
+    Returns the timings of the request being handled, or None outside of a request.
+    """
+    if not has_request_context():
+        return None
+    return g.get("timings")
+
+
+def add_timing(name: str, seconds: float, count_name: str = None) -> None:
+    """
+    Adds seconds to one of the current request's timings, and increments count_name if given.
+    Does nothing outside of a request, e.g in the CLI or tests that use the db directly.
+    """
+    timings = current_timings()
+    if timings is None:
+        return
+    timings[name] += seconds
+    if count_name:
+        timings[count_name] += 1
+
+
+class TimedTemplate(Template):
+    """
+    Jinja template that adds its render time to the current request.
+    Templates that are extended or imported are rendered as part of their child,
+    so each render_template call is only counted once.
+    """
+
+    def render(self, *args, **kwargs) -> str:
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            add_timing("template_time", time.perf_counter() - start)
+
+
+class TimedHTTPClient:
+    def __init__(self, client) -> None:
+        """
+        Wraps the HTTP client stripe uses for API calls so their time is added to the current request.
+        Everything other than the requests themselves is passed on to the wrapped client.
+        """
+        self._client = client
+
+    def request_with_retries(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._client.request_with_retries(*args, **kwargs)
+        finally:
+            add_timing("stripe_time", time.perf_counter() - start, "stripe_count")
+
+    def request_stream_with_retries(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._client.request_stream_with_retries(*args, **kwargs)
+        finally:
+            add_timing("stripe_time", time.perf_counter() - start, "stripe_count")
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def instrument_stripe(stripe) -> None:
+    """
+    Installs TimedHTTPClient as the client used for all stripe API calls.
+    params:
+        stripe: The stripe module.
+    """
+    if isinstance(stripe.default_http_client, TimedHTTPClient):
+        return
+
+    client = stripe.default_http_client
+    if client is None:
+        # What stripe would create on the first API call.
+        client = stripe.http_client.new_default_http_client(
+            verify_ssl_certs=stripe.verify_ssl_certs, proxy=stripe.proxy
+        )
+    stripe.default_http_client = TimedHTTPClient(client)
+
+
+def instrument_engine(engine) -> None:
+    """
+    Counts and times every query run by the engine during a request.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        add_timing("sql_time", time.perf_counter() - start, "sql_count")
+
+    @event.listens_for(engine, "handle_error")
+    def failed_query(context):
+        # after_cursor_execute isn't called for statements that raise. Only the
+        # statement running now can have its start time on the connection.
+        if context.connection is None:
+            return
+        starts = context.connection.info.get("query_start")
+        if starts:
+            starts.pop()
+
+
+def server_timing(wall_time: float, timings: "dict") -> str:
+    """
+    Builds a Server-Timing header, which browser dev tools show alongside the request.
+    """
+    entries = [f"app;dur={wall_time * 1000:.1f}"]
+    for key, name in TIMINGS:
+        entries.append(f"{name};dur={timings[key] * 1000:.1f}")
+    entries[1] += f';desc="{timings["sql_count"]} queries"'
+    return ", ".join(entries)
+
+
+def init_instrumentation(app, engines) -> None:
+    """
+    Records the wall time, SQL, template and stripe time of every request.
+    The totals per endpoint are kept in app.extensions["request_stats"], and shown on the admin metrics page.
+    In debug mode (or with PERF_HEADERS set) they are also added to each response as headers.
+    params:
+        engines: The db engines to count queries on.
+    """
+    stats = RequestStats()
+    app.extensions["request_stats"] = stats
+    app.jinja_env.template_class = TimedTemplate
+
+    for engine in engines:
+        instrument_engine(engine)
+    # Once something first uses stripe, see app.stripe
+    from app import stripe
+
+    stripe.on_import(instrument_stripe)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.timings = {
+            "sql_count": 0,
+            "sql_time": 0.0,
+            "template_time": 0.0,
+            "stripe_count": 0,
+            "stripe_time": 0.0,
+        }
+
+    @app.after_request
+    def record_timings(response):
+        # Streamed responses are timed up to the start of the body.
+        timings = current_timings()
+        if timings is None:
+            return response
+
+        wall_time = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or "<unmatched>"
+        stats.record(endpoint, wall_time, timings)
+        observe_request(
+            request.blueprint,
+            endpoint,
+            request.method,
+            response.status_code,
+            wall_time,
+        )
+
+        if app.debug or app.config.get("PERF_HEADERS"):
+            response.headers["Server-Timing"] = server_timing(wall_time, timings)
+            response.headers["X-Request-Time"] = f"{wall_time * 1000:.1f}"
+            response.headers["X-SQL-Queries"] = str(timings["sql_count"])
+            response.headers["X-Stripe-Calls"] = str(timings["stripe_count"])
+        return response
@@ -0,0 +1,54 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    def __init__(self, name: str) -> None:
+        """
+        Stands in for a module that is slow to import and not needed by every request,
+        importing it the first time one of its attributes is used.
+        e.g stripe = LazyModule("stripe") then stripe.Customer.create(...)
+        """
+        # Set through __dict__ as __setattr__ is passed on to the module.
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_callbacks"] = []
+        self.__dict__["_lock"] = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def on_import(self, callback):
+        """
+        Calls callback(module) once the module is imported, straight away if it already is.
+        Can be used as a decorator.
+        """
+        if self.loaded:
+            callback(self._module)
+        elif callback not in self._callbacks:
+            self._callbacks.append(callback)
+        return callback
+
+    def load(self):
+        """
+        Imports the module, if it hasn't been already, and returns it.
+        """
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    for callback in self._callbacks:
+                        callback(module)
+                    self.__dict__["_module"] = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value) -> None:
+        setattr(self.load(), name, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
@@ -1,11 +1,15 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, request, current_app, Response, abort
 from .auth.auth_utils import user_home
 from flask_login import current_user
+from .metrics import registry
+from .cache import cache_page, TIMETABLE, PRICING
+import hmac
 
 main = Blueprint("main", __name__, static_folder="static", template_folder="templates")
 
 
 @main.route("/")
+@cache_page(TIMETABLE, PRICING)
 def index():
     if not current_user.is_authenticated:
         return render_template("index.html")
@@ -14,10 +18,31 @@ def index():
 
 
 @main.route("/facilities")
+@cache_page(TIMETABLE, PRICING)
 def facilities():
     return render_template("facilities.html")
 
 
 @main.route("/pricing")
+@cache_page(TIMETABLE, PRICING)
 def pricing():
     return render_template("pricing.html")
+
+
+@main.route("/metrics")
+def metrics():
+    """
+    Metrics for Prometheus to scrape, which must send METRICS_TOKEN as a bearer token.
+    Without a METRICS_TOKEN they are only served in debug or testing.
+    """
+    token = current_app.config.get("METRICS_TOKEN")
+    if token:
+        given = request.headers.get("Authorization", "")
+        if not given.startswith("Bearer ") or not hmac.compare_digest(
+            given[len("Bearer ") :].encode(), token.encode()
+        ):
+            abort(401)
+    elif not (current_app.debug or current_app.testing):
+        abort(404)
+
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
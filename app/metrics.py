@@ -0,0 +1,347 @@
+from argon2 import PasswordHasher
+import bisect
+import abc
+import threading
+import time
+
+# Upper bounds in seconds, the same as the Prometheus client libraries.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(names: "tuple[str]", values: "tuple[str]") -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(abc.ABC):
+    kind = None
+
+    def __init__(self, name: str, description: str, labels: "tuple[str]" = ()) -> None:
+        """
+        Base class of each metric type.
+        params:
+            name: The metric name, e.g. http_requests_total
+            description: Shown as the HELP text.
+            labels: Names of the labels each value is split by.
+        """
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: "dict") -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abc.abstractmethod
+    def samples(self) -> "list[tuple[str, str, float]]":
+        """
+        Returns each (name, labels, value) to expose.
+        """
+
+    def render(self) -> "list[str]":
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {format_value(value)}")
+        return lines
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            (self.name, format_labels(self.label_names, key), value)
+            for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=(), collect=None) -> None:
+        """
+        A value that can go up and down.
+        params:
+            collect: Optional function called on every scrape, returning a dict of
+                label values tuple: value. Used for values read from elsewhere, e.g the db pool.
+        """
+        super().__init__(name, description, labels)
+        self.collect = collect
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.collect is not None:
+            values = self.collect()
+            with self._lock:
+                self._values = dict(values)
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS) -> None:
+        """
+        Counts observations into cumulative buckets, so quantiles such as p99 can be
+        calculated with histogram_quantile() in Prometheus.
+        """
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * len(self.buckets)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(c), s)) for key, (c, s) in self._values.items())
+
+        samples = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(
+                    self.label_names + ("le",), key + (format_value(bound),)
+                )
+                samples.append((f"{self.name}_bucket", labels, cumulative))
+            labels = format_labels(self.label_names, key)
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self) -> None:
+        """
+        The metrics served at /metrics, in the Prometheus text format.
+        Values are kept in-process, so each worker process has its own and
+        Prometheus should scrape every worker.
+        """
+        self.metrics = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        for metric in self.metrics:
+            metric.reset()
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.add(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time taken to handle each request.",
+        ("blueprint", "endpoint", "method"),
+    )
+)
+REQUESTS = registry.add(
+    Counter(
+        "http_requests_total",
+        "Requests handled, by response status.",
+        ("blueprint", "endpoint", "status"),
+    )
+)
+BOOKINGS = registry.add(
+    Counter(
+        "bookings_total",
+        "Sessions booked, by who made the booking.",
+        ("booked_by",),
+    )
+)
+CHECKOUTS = registry.add(
+    Counter(
+        "checkout_sessions_total",
+        "Stripe checkout sessions started.",
+        ("kind", "outcome"),
+    )
+)
+WEBHOOK_EVENTS = registry.add(
+    Counter(
+        "stripe_webhook_events_total",
+        "Stripe webhook events received, by event type.",
+        ("type",),
+    )
+)
+CACHE_LOOKUPS = registry.add(
+    Counter(
+        "cache_lookups_total",
+        "Fragment and page cache lookups, by fragment and whether it was cached.",
+        ("cache", "result"),
+    )
+)
+SCHEDULED_JOB_DURATION = registry.add(
+    Histogram(
+        "scheduled_job_duration_seconds",
+        "Time taken by each run of a background job, see scheduler.py",
+        ("job",),
+        buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+    )
+)
+SCHEDULED_JOB_RUNS = registry.add(
+    Counter(
+        "scheduled_job_runs_total",
+        "Background job runs, by whether they succeeded.",
+        ("job", "outcome"),
+    )
+)
+SCHEDULED_JOB_ROWS = registry.add(
+    Counter(
+        "scheduled_job_rows_total",
+        "Rows changed by background jobs.",
+        ("job",),
+    )
+)
+PASSWORD_HASHES_IN_PROGRESS = registry.add(
+    Gauge(
+        "password_hashes_in_progress",
+        "Password hashes and verifications currently running or waiting for a CPU.",
+    )
+)
+PASSWORD_HASH_LATENCY = registry.add(
+    Histogram(
+        "password_hash_duration_seconds",
+        "Time taken to hash or verify a password.",
+        ("operation",),
+        buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    )
+)
+PASSWORD_HASHES_IN_PROGRESS.set(0)
+
+
+class InstrumentedPasswordHasher(PasswordHasher):
+    """
+    argon2 PasswordHasher that records how many hashes are in progress and how long they take.
+    Hashing is deliberately slow, so a growing number in progress means logins are queueing for CPU.
+    """
+
+    def _timed(self, operation: str, function, *args, **kwargs):
+        PASSWORD_HASHES_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            PASSWORD_HASHES_IN_PROGRESS.dec()
+            PASSWORD_HASH_LATENCY.observe(
+                time.perf_counter() - start, operation=operation
+            )
+
+    def hash(self, password, *args, **kwargs) -> str:
+        return self._timed("hash", super().hash, password, *args, **kwargs)
+
+    def verify(self, hash, password) -> bool:
+        return self._timed("verify", super().verify, hash, password)
+
+
+# dict of bind name: engine, as in db.engines. Set by watch_pool().
+_pool_engines = {}
+
+
+def watch_pool(engines: "dict") -> None:
+    """
+    Sets the engines the db_pool_* gauges report on.
+    """
+    _pool_engines.clear()
+    _pool_engines.update(engines)
+
+
+def pool_stat(stat: str):
+    """
+    Returns a function that reads stat from each engine's pool, for Gauge(collect=)
+    """
+
+    def collect():
+        values = {}
+        for bind, engine in _pool_engines.items():
+            # Pools that don't queue connections (e.g for in-memory SQLite) have no stats.
+            if hasattr(engine.pool, stat):
+                # overflow() counts up from -pool_size until the pool is full.
+                values[(bind or "default",)] = max(getattr(engine.pool, stat)(), 0)
+        return values
+
+    return collect
+
+
+for _stat, _description in [
+    ("size", "Connections the pool keeps open."),
+    ("checkedout", "Connections currently in use."),
+    ("checkedin", "Idle connections in the pool."),
+    ("overflow", "Connections open beyond the pool size."),
+]:
+    registry.add(
+        Gauge(f"db_pool_{_stat}", _description, ("bind",), collect=pool_stat(_stat))
+    )
+
+
+def observe_request(
+    blueprint: str, endpoint: str, method: str, status: int, seconds: float
+):
+    """
+    Records a request that has been handled, called from instrumentation.py
+    """
+    REQUEST_LATENCY.observe(
+        seconds, blueprint=blueprint or "app", endpoint=endpoint, method=method
+    )
+    REQUESTS.inc(blueprint=blueprint or "app", endpoint=endpoint, status=status)
@@ -1,4 +1,5 @@
 from . import db
+from .sites import DEFAULT_SITE, current_site
 from flask_login import UserMixin
 from sqlalchemy import Enum, select
 import sqlalchemy as sqla
@@ -82,7 +83,7 @@ class User(db.Model, UserMixin):
     user_id = sqla.Column(sqla.Integer, primary_key=True)
     username = sqla.Column(sqla.String, unique=True)
     password = sqla.Column(sqla.String)
-    email = sqla.Column(sqla.String)
+    email = sqla.Column(sqla.String, index=True)
     role = sqla.Column(Enum(Roles))
     membership = sqla.Column(Enum(Membership), default=Membership.NONE)
     membership_expiration_date = sqla.Column(sqla.DateTime)
@@ -125,8 +126,16 @@ class User(db.Model, UserMixin):
             }
 
 
+# For the customer search, which matches the start of usernames and emails whatever
+# their case, see search_utils.search_prefix
+sqla.Index("ix_user_username_lower", sqla.func.lower(User.username))
+sqla.Index("ix_user_email_lower", sqla.func.lower(User.email))
+
+
 class Facility(db.Model):
     id = sqla.Column(sqla.Integer, primary_key=True)
+    # The centre, see sites.py
+    site = sqla.Column(sqla.String, nullable=False, default=DEFAULT_SITE, index=True)
     facility_id = sqla.Column(Enum(Facilities))
     start_time = sqla.Column(sqla.Time)
     end_time = sqla.Column(sqla.Time)
@@ -142,17 +151,10 @@ class Facility(db.Model):
         }
 
 
-class Session(db.Model):
-    session_id = sqla.Column(sqla.Integer, primary_key=True)
-    session_type = sqla.Column(Enum(Activities))
-    facility_id = sqla.Column(Enum(Facilities))
-    start_time = sqla.Column(sqla.DateTime)
-    end_time = sqla.Column(sqla.DateTime)
-    is_class = sqla.Column(sqla.Integer)
-
-    # Also has a Session.users - a list of users who have booked the session
-    def __repr__(self):
-        return f"<Session Type: {self.session_type}, at {Facilities(self.facility_id)} from: {self.start_time} to: {self.end_time}>"
+class SessionDisplay:
+    """
+    Methods shared by Session and ArchivedSession for showing them.
+    """
 
     def display_facility(self):
         return facil_to_str[self.facility_id]
@@ -180,10 +182,30 @@ class Session(db.Model):
             + self.end_time.strftime("%H")
         )
 
+
+class Session(SessionDisplay, db.Model):
+    # Without AUTOINCREMENT SQLite hands out the highest id again once it is deleted,
+    # which would clash with the archived copy, see archive_sessions.
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    session_id = sqla.Column(sqla.Integer, primary_key=True)
+    # The centre, see sites.py
+    site = sqla.Column(sqla.String, nullable=False, default=DEFAULT_SITE, index=True)
+    session_type = sqla.Column(Enum(Activities))
+    facility_id = sqla.Column(Enum(Facilities))
+    start_time = sqla.Column(sqla.DateTime)
+    end_time = sqla.Column(sqla.DateTime)
+    is_class = sqla.Column(sqla.Integer)
+
+    # Also has a Session.users - a list of users who have booked the session
+    def __repr__(self):
+        return f"<Session Type: {self.session_type}, at {Facilities(self.facility_id)} from: {self.start_time} to: {self.end_time}>"
+
     def from_unique_code(code):
         print(code)
         sections = code.split("-")
-        s = Session()
+        # Codes are only used within a site.
+        s = Session(site=current_site())
         s.session_type = Activities(int(sections[0]))
         s.facility_id = Facilities(int(sections[1]))
         s.start_time = datetime.datetime.strptime(
@@ -223,8 +245,42 @@ class Session(db.Model):
         self.is_class = data["is_class"]
 
 
+# The bookings of archived sessions, see archive.py
+archived_user_session_m2m = db.Table(
+    "archived_user_sessions",
+    sqla.Column("user_id", sqla.ForeignKey("user.user_id"), primary_key=True),
+    sqla.Column(
+        "session_id",
+        sqla.ForeignKey("archived_session.session_id"),
+        primary_key=True,
+        index=True,
+    ),
+)
+
+
+class ArchivedSession(SessionDisplay, db.Model):
+    """
+    A Session that ended before the archive horizon, moved out of the session table
+    so the queries on upcoming bookings don't grow with the history. See archive.py
+    """
+
+    session_id = sqla.Column(sqla.Integer, primary_key=True)
+    site = sqla.Column(sqla.String, nullable=False, default=DEFAULT_SITE, index=True)
+    session_type = sqla.Column(Enum(Activities))
+    facility_id = sqla.Column(Enum(Facilities))
+    start_time = sqla.Column(sqla.DateTime, index=True)
+    end_time = sqla.Column(sqla.DateTime)
+    is_class = sqla.Column(sqla.Integer)
+
+    users = db.relationship(
+        "User", secondary=archived_user_session_m2m, backref="archived_sessions"
+    )
+
+
 class Activity(db.Model):
     activity_id = sqla.Column(sqla.Integer, primary_key=True)
+    # The centre, see sites.py
+    site = sqla.Column(sqla.String, nullable=False, default=DEFAULT_SITE, index=True)
     activity_type = sqla.Column(Enum(Activities))
     facility_id = sqla.Column(Enum(Facilities))
     day = sqla.Column(Enum(Days))
@@ -266,3 +322,28 @@ class Statistics(db.Model):
     members = sqla.Column(sqla.Integer)
     trainers = sqla.Column(sqla.Integer)
     sales = sqla.Column(sqla.Integer)
+
+
+class DataVersion(db.Model):
+    """
+    A counter bumped whenever the data it names changes, e.g 'timetable',
+    'occupancy:<site>:<date>' for how full a day's sessions are or 'user:<user_id>'
+    for a user's bookings. Used to build ETags, see cache.py
+    """
+
+    name = sqla.Column(sqla.String, primary_key=True)
+    version = sqla.Column(sqla.Integer, nullable=False, default=0)
+
+
+class ScheduledJob(db.Model):
+    """
+    When each background job last ran and is next due, see scheduler.py
+    Shared by every worker process, so each run is only done by one of them.
+    """
+
+    name = sqla.Column(sqla.String, primary_key=True)
+    next_run = sqla.Column(sqla.DateTime, nullable=False)
+    last_run = sqla.Column(sqla.DateTime)
+    last_duration = sqla.Column(sqla.Float)
+    last_error = sqla.Column(sqla.String)
+    runs = sqla.Column(sqla.Integer, nullable=False, default=0)
@@ -0,0 +1,161 @@
+from sqlalchemy import and_, or_
+import base64
+import datetime
+import enum
+import json
+
+
+class KeysetPage:
+    def __init__(
+        self, rows, columns, next_cursor, prev_cursor, sort, direction, args
+    ) -> None:
+        """
+        One page of results from keyset_paginate.
+        params:
+            rows: A list of dicts, column name: value.
+            columns: The column names, in display order.
+            next_cursor, prev_cursor: Cursors for the neighbouring pages, None if there is no page.
+            sort, direction: The sort column name and 'asc' or 'desc'.
+            args: The URL params (filters etc.) the page was generated with.
+        """
+        self.rows = rows
+        self.columns = columns
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.sort = sort
+        self.direction = direction
+        self._args = args
+
+    def args(self, **changes) -> "dict":
+        """
+        Returns the URL params for this page with the given changes applied.
+        Intended to be passed to url_for, e.g url_for(endpoint, **page.args(after=page.next_cursor))
+        Moving to another page, or changing the sort, always drops the current cursor.
+        """
+        args = {k: v for k, v in self._args.items() if k not in ("after", "before")}
+        args.update({"sort": self.sort, "direction": self.direction})
+        args.update(changes)
+        return {k: v for k, v in args.items() if v not in (None, "")}
+
+
+def encode_cursor(values: list) -> str:
+    """
+    Encodes the sort key of a row into an opaque URL safe string.
+    """
+    values = [
+        v.name
+        if isinstance(v, enum.Enum)
+        else v.isoformat()
+        if isinstance(v, (datetime.date, datetime.time))
+        else v
+        for v in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, columns: list) -> list:
+    """
+    Decodes a cursor made by encode_cursor, converting each value back to the python type of columns.
+    Returns None if the cursor is invalid.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(columns):
+            return None
+
+        decoded = []
+        for value, column in zip(values, columns):
+            python_type = column.type.python_type
+            if value is None:
+                decoded.append(None)
+            elif issubclass(python_type, enum.Enum):
+                decoded.append(python_type[value])
+            elif python_type in (datetime.date, datetime.time, datetime.datetime):
+                decoded.append(python_type.fromisoformat(value))
+            else:
+                decoded.append(python_type(value))
+        return decoded
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def keyset_paginate(
+    session,
+    stmt,
+    sort_key: str,
+    id_key: str,
+    descending: bool = False,
+    after: str = None,
+    before: str = None,
+    per_page: int = 25,
+) -> "tuple[list, str, str]":
+    """
+    Runs stmt one page at a time using keyset (cursor) pagination.
+    Rather than using an OFFSET, each page starts from the sort key of the last row of the previous one,
+    so fetching a page costs the same no matter how deep into the results it is.
+    params:
+        stmt: A select statement.
+        sort_key: The name of the selected column to order by. Must not contain NULLs.
+        id_key: The name of a unique selected column, used to break ties between rows with the same sort value.
+        after: A cursor, return the page following it.
+        before: A cursor, return the page preceding it. Ignored if after is given.
+    Returns (rows, next_cursor, prev_cursor). rows are sqlalchemy Row objects.
+    """
+    sort_column = stmt.selected_columns[sort_key]
+    id_column = stmt.selected_columns[id_key]
+    key_columns = [sort_column, id_column]
+    cursor = None
+    backwards = False
+    if after:
+        cursor = decode_cursor(after, key_columns)
+    elif before:
+        cursor = decode_cursor(before, key_columns)
+        backwards = cursor is not None
+
+    # Walking backwards is the same as walking forwards with the order reversed.
+    reverse = descending != backwards
+
+    if cursor is not None:
+        sort_value, id_value = cursor
+        if reverse:
+            stmt = stmt.where(
+                or_(
+                    sort_column < sort_value,
+                    and_(sort_column == sort_value, id_column < id_value),
+                )
+            )
+        else:
+            stmt = stmt.where(
+                or_(
+                    sort_column > sort_value,
+                    and_(sort_column == sort_value, id_column > id_value),
+                )
+            )
+
+    if reverse:
+        stmt = stmt.order_by(None).order_by(sort_column.desc(), id_column.desc())
+    else:
+        stmt = stmt.order_by(None).order_by(sort_column.asc(), id_column.asc())
+
+    # Fetch one extra row to find out if there is another page.
+    rows = session.execute(stmt.limit(per_page + 1)).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if backwards:
+        rows.reverse()
+
+    def row_cursor(row):
+        mapping = row._mapping
+        return encode_cursor([mapping[sort_key], mapping[id_key]])
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards:
+            next_cursor = row_cursor(rows[-1])
+            prev_cursor = row_cursor(rows[0]) if has_more else None
+        else:
+            next_cursor = row_cursor(rows[-1]) if has_more else None
+            prev_cursor = row_cursor(rows[0]) if cursor is not None else None
+
+    return rows, next_cursor, prev_cursor
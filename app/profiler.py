@@ -0,0 +1,179 @@
+from flask import request
+import collections
+import threading
+import datetime
+import math
+import time
+import sys
+import os
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{frame.f_globals.get('__name__', '?')}:{name}"
+
+
+def collapse_stack(frame) -> str:
+    """
+    Returns the stack ending at frame as 'outermost;...;innermost', the collapsed format
+    used by flamegraph.pl and speedscope.
+    """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, directory: str) -> None:
+        """
+        Samples the stacks of threads serving selected endpoints, and writes them to
+        collapsed stack files in directory, one per endpoint each time profiling is started.
+        Each worker process has its own profiler.
+        params:
+            directory: Where the .folded files are written.
+        """
+        self.directory = directory
+        self.endpoints = set()
+        self.rate = 100
+        self.started = None
+        self._lock = threading.Lock()
+        # thread id: endpoint, for the requests currently being profiled.
+        self._active = {}
+        # endpoint: Counter of collapsed stack: samples.
+        self._samples = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, endpoints: "list[str]", rate: float = 100) -> None:
+        """
+        Starts sampling requests to endpoints, rate times a second.
+        Restarts the profiler if it is already running.
+        """
+        if not math.isfinite(rate) or rate <= 0:
+            raise ValueError(f"Invalid sample rate: {rate}")
+        self.stop()
+        self.endpoints = set(endpoints)
+        self.rate = rate
+        self.started = datetime.datetime.now()
+        self._samples = {}
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops sampling and writes out the stacks collected so far.
+        """
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def request_started(self, endpoint: str) -> None:
+        if endpoint in self.endpoints and self.running:
+            with self._lock:
+                self._active[threading.get_ident()] = endpoint
+
+    def request_finished(self) -> None:
+        if self._active:
+            with self._lock:
+                self._active.pop(threading.get_ident(), None)
+
+    def sample(self) -> None:
+        """
+        Records the current stack of every thread serving a profiled endpoint.
+        """
+        with self._lock:
+            active = dict(self._active)
+        if not active:
+            return
+
+        frames = sys._current_frames()
+        samples = [
+            (endpoint, collapse_stack(frames[thread_id]))
+            for thread_id, endpoint in active.items()
+            if thread_id in frames
+        ]
+        # flush() may be reading the counts from a request thread.
+        with self._lock:
+            for endpoint, stack in samples:
+                self._samples.setdefault(endpoint, collections.Counter())[stack] += 1
+
+    def _run(self) -> None:
+        interval = 1 / self.rate
+        last_flush = time.monotonic()
+        while not self._stop.wait(interval):
+            self.sample()
+            # Write out regularly so the files can be read while profiling.
+            if time.monotonic() - last_flush > 10:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def path(self, endpoint: str) -> str:
+        started = self.started.strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.directory, f"{endpoint}-{started}.folded")
+
+    def flush(self) -> None:
+        """
+        (Re)writes the collapsed stack file of each endpoint with every sample so far.
+        """
+        with self._lock:
+            samples = {
+                endpoint: stacks.most_common()
+                for endpoint, stacks in self._samples.items()
+            }
+        if not samples:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for endpoint, stacks in samples.items():
+            lines = [f"{stack} {count}\n" for stack, count in stacks]
+            with open(self.path(endpoint), "w") as file:
+                file.writelines(lines)
+
+    def files(self) -> "list[str]":
+        """
+        Returns the names of the profiles written so far, newest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        names = [n for n in os.listdir(self.directory) if n.endswith(".folded")]
+        return sorted(
+            names,
+            key=lambda n: os.path.getmtime(os.path.join(self.directory, n)),
+            reverse=True,
+        )
+
+
+def init_profiler(app) -> None:
+    """
+    Adds a SamplingProfiler to app.extensions["profiler"], writing to instance/profiles.
+    It can be started from the admin area, or at startup by setting PROFILE_ENDPOINTS
+    to a comma seperated list of endpoints (and PROFILE_RATE_HZ to the samples per second).
+    """
+    profiler = SamplingProfiler(os.path.join(app.instance_path, "profiles"))
+    app.extensions["profiler"] = profiler
+
+    endpoints = os.getenv("PROFILE_ENDPOINTS") or app.config.get("PROFILE_ENDPOINTS")
+    if endpoints:
+        rate = os.getenv("PROFILE_RATE_HZ") or app.config.get("PROFILE_RATE_HZ", 100)
+        profiler.start(
+            [e.strip() for e in endpoints.split(",") if e.strip()], float(rate)
+        )
+
+    @app.before_request
+    def start_profiling_request():
+        profiler.request_started(request.endpoint)
+
+    @app.teardown_request
+    def finish_profiling_request(exception=None):
+        profiler.request_finished()
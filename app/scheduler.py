@@ -0,0 +1,343 @@
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, exists, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from app.models import (
+    ArchivedSession,
+    Membership,
+    Roles,
+    ScheduledJob,
+    Session,
+    Statistics,
+    User,
+    archived_user_session_m2m,
+    user_session_m2m,
+)
+from app.metrics import SCHEDULED_JOB_DURATION, SCHEDULED_JOB_ROWS, SCHEDULED_JOB_RUNS
+from app.cache import PRICING, bump_versions, occupancy_versions
+from app.archive import archive_horizon, archive_sessions
+from app.sites import site_databases
+from app import db
+import threading
+import datetime
+import time
+import click
+
+
+class Job:
+    def __init__(self, name: str, function, interval: datetime.timedelta) -> None:
+        """
+        A function the Scheduler runs every interval.
+        params:
+            function: Called with no arguments in an app context. Returns the number
+                of rows it changed, or None.
+        """
+        self.name = name
+        self.function = function
+        self.interval = interval
+
+
+# name: Job, in the order they are run.
+JOBS = {}
+
+
+def job(name: str, **every):
+    """
+    Decorator that registers a function as a Job, e.g @job("purge", hours=1)
+    params:
+        every: The interval, as arguments to datetime.timedelta.
+    """
+
+    def register(function):
+        JOBS[name] = Job(name, function, datetime.timedelta(**every))
+        return function
+
+    return register
+
+
+def add_jobs(now: datetime.datetime) -> None:
+    """
+    Adds a ScheduledJob row, due now, for each job that doesn't have one yet.
+    """
+    existing = set(db.session.execute(select(ScheduledJob.name)).scalars())
+    missing = [name for name in JOBS if name not in existing]
+    if not missing:
+        return
+    try:
+        db.session.execute(
+            insert(ScheduledJob),
+            [{"name": name, "next_run": now, "runs": 0} for name in missing],
+        )
+        db.session.commit()
+    except IntegrityError:
+        # Another worker added them first.
+        db.session.rollback()
+
+
+def claim(scheduled: Job, now: datetime.datetime, force: bool = False) -> bool:
+    """
+    Moves a job's next run on by its interval if it is due, returning True if it was.
+    The check and the update are one statement, so when several workers are running
+    a scheduler only one of them gets each run.
+    params:
+        force: Claim the job even if it isn't due.
+    """
+    statement = update(ScheduledJob).where(ScheduledJob.name == scheduled.name)
+    if not force:
+        statement = statement.where(ScheduledJob.next_run <= now)
+    result = db.session.execute(
+        statement.values(next_run=now + scheduled.interval),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def run_job(scheduled: Job, now: datetime.datetime) -> bool:
+    """
+    Runs a job in its own transaction and records how it went.
+    Returns False if it raised an exception, which is logged rather than raised.
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        rows = scheduled.function()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception("Scheduled job %s failed", scheduled.name)
+        error = f"{type(e).__name__}: {e}"
+        rows = None
+    duration = time.perf_counter() - start
+
+    SCHEDULED_JOB_DURATION.observe(duration, job=scheduled.name)
+    SCHEDULED_JOB_RUNS.inc(job=scheduled.name, outcome="error" if error else "success")
+    if rows:
+        SCHEDULED_JOB_ROWS.inc(rows, job=scheduled.name)
+
+    db.session.execute(
+        update(ScheduledJob)
+        .where(ScheduledJob.name == scheduled.name)
+        .values(
+            last_run=now,
+            last_duration=duration,
+            last_error=error,
+            runs=ScheduledJob.runs + 1,
+        ),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.commit()
+    return error is None
+
+
+def run_pending(now: datetime.datetime = None, names: "list[str]" = None) -> "dict":
+    """
+    Runs every job that is due.
+    params:
+        now: Defaults to the current time.
+        names: Run these jobs whether they are due or not, instead.
+    Returns job name: whether it succeeded, for each job that was run.
+    """
+    now = now or datetime.datetime.now()
+    add_jobs(now)
+    results = {}
+    for name, scheduled in JOBS.items():
+        if names is not None and name not in names:
+            continue
+        if claim(scheduled, now, force=names is not None):
+            results[name] = run_job(scheduled, now)
+    return results
+
+
+class Scheduler:
+    def __init__(self, app, poll_seconds: float = 60) -> None:
+        """
+        Runs the due JOBS in a background thread, checking every poll_seconds.
+        Each worker process can have one, see claim() for how they share the work.
+        """
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+        self._thread = None
+
+    def tick(self) -> None:
+        with self.app.app_context():
+            # Sites with their own db have their own jobs table and data.
+            for site in site_databases():
+                try:
+                    run_pending()
+                except Exception:
+                    # e.g the db is down, try again next time.
+                    self.app.logger.exception(
+                        "Scheduler failed to check for jobs for %s", site
+                    )
+
+    def _run(self) -> None:
+        while True:
+            self.tick()
+            if self._stop.wait(self.poll_seconds):
+                return
+
+
+def init_scheduler(app) -> None:
+    """
+    Adds a Scheduler to app.extensions["scheduler"]. If SCHEDULER_ENABLED is set it
+    is started by the first request, so CLI commands and tests don't start one.
+    """
+    scheduler = Scheduler(app, app.config.get("SCHEDULER_POLL_SECONDS", 60))
+    app.extensions["scheduler"] = scheduler
+
+    @app.before_request
+    def start_scheduler():
+        if (
+            app.config.get("SCHEDULER_ENABLED")
+            and not app.testing
+            and not scheduler.running
+        ):
+            scheduler.start()
+
+
+@click.command("run-jobs")
+@click.argument("names", nargs=-1)
+@with_appcontext
+def run_jobs_command(names):
+    """
+    Runs the background jobs that are due, or the named jobs now, in each site's db.
+    For running them from cron instead of the scheduler thread.
+    """
+    unknown = [name for name in names if name not in JOBS]
+    if unknown:
+        raise click.BadParameter(f"unknown jobs {unknown}, choose from {list(JOBS)}")
+
+    for site in site_databases():
+        results = run_pending(names=list(names) or None)
+        for name, ok in results.items():
+            click.echo(f"{site}: {name}: {'ok' if ok else 'failed'}")
+        if not results:
+            click.echo(f"{site}: No jobs due")
+
+
+@job("expire_memberships", minutes=15)
+def expire_memberships() -> int:
+    """
+    Ends memberships that expired over MEMBERSHIP_GRACE_HOURS ago, in case Stripe's
+    customer.subscription.updated webhook never arrived. Renewals move the
+    expiration date on, so the grace period gives Stripe time to retry payment.
+    """
+    grace = datetime.timedelta(
+        hours=current_app.config.get("MEMBERSHIP_GRACE_HOURS", 24)
+    )
+    result = db.session.execute(
+        update(User)
+        .where(
+            User.membership != Membership.NONE,
+            User.membership_expiration_date < datetime.datetime.now() - grace,
+        )
+        .values(membership=Membership.NONE, membership_expiration_date=None),
+        execution_options={"synchronize_session": False},
+    )
+    return result.rowcount
+
+
+@job("purge_orphaned_sessions", hours=1)
+def purge_orphaned_sessions() -> int:
+    """
+    Deletes bookings of sessions or users that no longer exist, then sessions nobody
+    has booked. delete_session does this as it goes, bulk deletes don't.
+    """
+    bookings = user_session_m2m
+    # Bookings of deleted users change how full their sessions are.
+    changed = occupancy_versions(
+        db.session.execute(
+            select(Session.site, Session.start_time)
+            .join(bookings, bookings.c.session_id == Session.session_id)
+            .where(~exists().where(User.user_id == bookings.c.user_id))
+            .distinct()
+        ).all()
+    )
+    orphaned = db.session.execute(
+        delete(bookings).where(
+            ~exists().where(Session.session_id == bookings.c.session_id)
+            | ~exists().where(User.user_id == bookings.c.user_id)
+        )
+    ).rowcount
+    empty = db.session.execute(
+        delete(Session).where(
+            ~exists().where(bookings.c.session_id == Session.session_id)
+        ),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+
+    # The bulk deletes skip the ORM events that do this.
+    bump_versions(db.session.connection(), changed)
+    return orphaned + empty
+
+
+@job("archive_sessions", days=1)
+def archive_old_sessions() -> int:
+    """
+    Moves sessions that ended over ARCHIVE_AFTER_DAYS ago to the archive tables.
+    """
+    return archive_sessions(archive_horizon())["sessions"]
+
+
+@job("refresh_pricing", hours=1)
+def refresh_pricing() -> None:
+    """
+    Re-renders the cached pages showing prices, in case a Stripe pricing webhook
+    was missed. See PRICING in cache.py
+    """
+    bump_versions(db.session.connection(), {PRICING})
+
+
+@job("rollup_statistics", hours=6)
+def rollup_statistics() -> int:
+    """
+    Updates this year's Statistics with the current number of members and trainers,
+    and the sessions booked so far this year.
+    """
+    year = datetime.date.today().year
+    start = datetime.datetime(year, 1, 1)
+    members = db.session.execute(
+        select(func.count())
+        .select_from(User)
+        .where(User.role == Roles.CUSTOMER, User.membership != Membership.NONE)
+    ).scalar()
+    trainers = db.session.execute(
+        select(func.count()).select_from(User).where(User.role == Roles.EMPLOYEE)
+    ).scalar()
+    end = start.replace(year=year + 1)
+    sales = 0
+    # Bookings from earlier in the year may have been archived.
+    for table, bookings in [
+        (Session, user_session_m2m),
+        (ArchivedSession, archived_user_session_m2m),
+    ]:
+        sales += db.session.execute(
+            select(func.count())
+            .select_from(table)
+            .join(bookings)
+            .where(table.start_time >= start, table.start_time < end)
+        ).scalar()
+
+    db.session.merge(
+        Statistics(year=year, members=members, trainers=trainers, sales=sales)
+    )
+    return 1
@@ -0,0 +1,247 @@
+from app.models import User, Roles
+from app import db
+from sqlalchemy import event, func, select, or_, table, column, literal_column
+from sqlalchemy.schema import CreateIndex
+import contextlib
+import threading
+
+# Only fires for the indexed columns, so e.g password changes and expire_memberships
+# don't rewrite the index.
+CREATE_UPDATE_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS customer_search_update
+    AFTER UPDATE OF username, email, role ON user BEGIN
+        DELETE FROM customer_search WHERE rowid = old.user_id;
+        INSERT INTO customer_search(rowid, username, email)
+        SELECT new.user_id, new.username, new.email WHERE new.role = 'CUSTOMER';
+    END
+"""
+
+# FTS5 table of customers usernames and emails, keyed by user_id.
+# The trigram tokenizer lets us match any part of a username or email.
+CREATE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS customer_search
+    USING fts5(username, email, tokenize='trigram')
+    """,
+    # Triggers keep the index in sync with every write to the user table,
+    # including create_user, update_email, update_username and bulk inserts.
+    """
+    CREATE TRIGGER IF NOT EXISTS customer_search_insert AFTER INSERT ON user
+    WHEN new.role = 'CUSTOMER' BEGIN
+        INSERT INTO customer_search(rowid, username, email)
+        VALUES (new.user_id, new.username, new.email);
+    END
+    """,
+    CREATE_UPDATE_TRIGGER,
+    """
+    CREATE TRIGGER IF NOT EXISTS customer_search_delete AFTER DELETE ON user BEGIN
+        DELETE FROM customer_search WHERE rowid = old.user_id;
+    END
+    """,
+]
+
+customer_search = table("customer_search", column("rowid"), column("rank"))
+
+REBUILD_INDEX = """
+    INSERT INTO customer_search(rowid, username, email)
+    SELECT user_id, username, email FROM user WHERE role = 'CUSTOMER'
+"""
+
+# Engines that are known to have an up to date index.
+_indexed_engines = set()
+_index_lock = threading.Lock()
+
+
+def drop_customer_index(connection):
+    """
+    Drops the customer search index and its triggers.
+    """
+    for trigger in ("insert", "update", "delete"):
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS customer_search_{trigger}")
+    connection.exec_driver_sql("DROP TABLE IF EXISTS customer_search")
+
+
+def create_customer_index(connection, rebuild=True):
+    """
+    (Re)creates the customer search index and the triggers that maintain it.
+    Only supported on SQLite.
+    """
+    connection.exec_driver_sql("DROP TABLE IF EXISTS customer_search")
+    for statement in CREATE_INDEX:
+        connection.exec_driver_sql(statement)
+    if rebuild:
+        connection.exec_driver_sql(REBUILD_INDEX)
+
+
+@event.listens_for(User.__table__, "after_create")
+def _create_index_with_user_table(target, connection, **kwargs):
+    if connection.dialect.name == "sqlite":
+        create_customer_index(connection, rebuild=False)
+
+
+@event.listens_for(User.__table__, "after_drop")
+def _drop_index_with_user_table(target, connection, **kwargs):
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS customer_search")
+
+
+def ensure_customer_index() -> bool:
+    """
+    Makes sure the current db has a customer search index, building it from the user table if not,
+    and the user table's indexes.
+    This covers databases created before the indexes existed.
+    Returns False if the db does not support the index.
+    """
+    # Sites with their own db each have their own index, see sites.py
+    engine = db.session.get_bind()
+    if engine.dialect.name != "sqlite":
+        return False
+    if engine in _indexed_engines:
+        return True
+
+    with _index_lock:
+        with engine.begin() as connection:
+            exists = connection.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE name = 'customer_search'"
+            ).scalar()
+            if not exists:
+                create_customer_index(connection)
+            update_trigger = connection.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE name = 'customer_search_update'"
+            ).scalar()
+            if update_trigger is not None and "UPDATE OF" not in update_trigger:
+                # Made before it only fired for the indexed columns.
+                connection.exec_driver_sql("DROP TRIGGER customer_search_update")
+                connection.exec_driver_sql(CREATE_UPDATE_TRIGGER)
+            for index in User.__table__.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+        _indexed_engines.add(engine)
+    return True
+
+
+@contextlib.contextmanager
+def customer_index_suspended():
+    """
+    Drops the customer search index for the duration of the with block, then rebuilds it.
+    Bulk inserting users is much faster without the triggers updating the index row by row.
+    If the block raises, the index is rebuilt the next time it is searched instead.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name != "sqlite":
+        yield
+        return
+
+    drop_customer_index(connection)
+    try:
+        yield
+    except BaseException:
+        # The transaction may need rolling back before the index can be rebuilt, so
+        # leave that to the next ensure_customer_index().
+        _indexed_engines.discard(connection.engine)
+        raise
+    create_customer_index(connection)
+
+
+def fts_phrase(query: str) -> str:
+    """
+    Quotes query so that it is matched literally by FTS5.
+    """
+    return '"' + query.replace('"', '""') + '"'
+
+
+def search_customers(query: str, limit: int = 10) -> "list[dict]":
+    """
+    Type-ahead search for customers by username or email.
+    Results are ranked with usernames and emails that start with the query first,
+    then anything containing the query. If there are not enough of those then
+    usernames that share trigrams with the query are added, so small typos still match.
+    Returns a list of dicts with keys id, username, email.
+    """
+    query = query.strip().lower()
+    if not query:
+        return []
+
+    if not ensure_customer_index():
+        return search_customers_like(query, limit)
+
+    found = search_prefix(query, limit)
+
+    # Trigrams need at least 3 characters to match anything.
+    if len(found) < limit and len(query) >= 3:
+        found += search_index(fts_phrase(query), limit, exclude=found)
+
+    # Emails share very common trigrams (e.g '@mail.com') so only fuzzy match usernames.
+    if len(found) < limit and len(query) >= 4 and "@" not in query:
+        # Fuzzy match, any username trigram in the query.
+        trigrams = sorted({query[i : i + 3] for i in range(len(query) - 2)})
+        match = "username : (" + " OR ".join(fts_phrase(t) for t in trigrams) + ")"
+        found += search_index(match, limit, exclude=found)
+
+    return found[:limit]
+
+
+def search_prefix(query: str, limit: int) -> "list[dict]":
+    """
+    Finds customers whose username or email starts with query, which must be lower case.
+    Uses a range on the lower case columns' indexes rather than LIKE so it doesn't need to
+    scan the user table.
+    """
+    found = []
+    for col in (func.lower(User.username), func.lower(User.email)):
+        stmt = (
+            select(User.user_id, User.username, User.email)
+            .where(col >= query, col < query + "\uffff")
+            .where(User.role == Roles.CUSTOMER)
+            .order_by(col)
+            .limit(limit)
+        )
+        found += to_dicts(db.session.execute(stmt).all(), exclude=found)
+    return found
+
+
+def search_index(match: str, limit: int, exclude: "list[dict]" = ()) -> "list[dict]":
+    """
+    Runs an FTS5 MATCH against the customer search index, best matches (by bm25) first.
+    Customers in exclude are left out of the results.
+    """
+    stmt = (
+        select(User.user_id, User.username, User.email)
+        .join(customer_search, customer_search.c.rowid == User.user_id)
+        .where(literal_column("customer_search").match(match))
+        .where(User.role == Roles.CUSTOMER)
+        .order_by(customer_search.c.rank)
+        .limit(limit + len(exclude))
+    )
+    return to_dicts(db.session.execute(stmt).all(), exclude=exclude)
+
+
+def to_dicts(rows, exclude: "list[dict]" = ()) -> "list[dict]":
+    excluded_ids = {user["id"] for user in exclude}
+    return [
+        {"id": r.user_id, "username": r.username, "email": r.email}
+        for r in rows
+        if r.user_id not in excluded_ids
+    ]
+
+
+def search_customers_like(query: str, limit: int = 10) -> "list[dict]":
+    """
+    Search used for dbs without FTS5.
+    Usernames and emails starting with the query come first, then ones containing it.
+    """
+    found = []
+    for match in ("istartswith", "icontains"):
+        stmt = (
+            select(User.user_id, User.username, User.email)
+            .where(User.role == Roles.CUSTOMER)
+            .where(
+                or_(
+                    getattr(User.username, match)(query, autoescape=True),
+                    getattr(User.email, match)(query, autoescape=True),
+                )
+            )
+            .order_by(User.username)
+            .limit(limit + len(found))
+        )
+        found += to_dicts(db.session.execute(stmt).all(), exclude=found)
+    return found[:limit]
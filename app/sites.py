@@ -0,0 +1,153 @@
+from flask import current_app, has_request_context, request
+from flask.sessions import SecureCookieSessionInterface
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+import contextlib
+import contextvars
+
+# The site of requests that don't match SITE_HOSTS or SITE_PATHS, and of CLI
+# commands and jobs unless they say otherwise.
+DEFAULT_SITE = "main"
+
+# Where SiteMiddleware puts the site in the WSGI environ.
+ENVIRON_KEY = "leisure_centre.site"
+
+_site = contextvars.ContextVar("site", default=None)
+
+
+def current_site() -> str:
+    """
+    Returns the site being worked on, the one set by using_site or else the one the
+    request is for, see SiteMiddleware.
+    """
+    site = _site.get()
+    if site is None and has_request_context():
+        site = request.environ.get(ENVIRON_KEY)
+    return site or DEFAULT_SITE
+
+
+@contextlib.contextmanager
+def using_site(site: str):
+    """
+    Makes current_site() return site inside the with block, e.g for CLI commands.
+    """
+    token = _site.set(site)
+    try:
+        yield site
+    finally:
+        _site.reset(token)
+
+
+def site_bind_key(site: str):
+    """
+    Returns the SQLALCHEMY_BINDS key of the site's own db, or None if the site is in
+    the default db with the others.
+    """
+    return current_app.config.get("SITE_BINDS", {}).get(site)
+
+
+def site_databases():
+    """
+    Generator that goes through each db in turn, with current_site() set to a site
+    stored in it: DEFAULT_SITE for the default db, then each site with its own.
+    db.session is removed after each so objects from one db aren't used with another.
+    """
+    from app import db
+
+    sites = [DEFAULT_SITE] + [
+        site
+        for site in current_app.config.get("SITE_BINDS", {})
+        if site != DEFAULT_SITE
+    ]
+    for site in sites:
+        with using_site(site):
+            try:
+                yield site
+            finally:
+                db.session.remove()
+
+
+class SiteMiddleware:
+    def __init__(self, wsgi_app, hosts: "dict" = None, paths: "dict" = None) -> None:
+        """
+        Works out which site each request is for, before Flask sees it.
+        params:
+            hosts: host name: site, e.g {"north.example.com": "north"}
+            paths: path prefix: site, e.g {"/north": "north"}. The prefix is moved
+                onto SCRIPT_NAME, so the app's routes are the same for every site and
+                url_for keeps links within the site.
+        A path prefix wins over the host, and requests that match neither are for
+        DEFAULT_SITE.
+        """
+        self.wsgi_app = wsgi_app
+        self.hosts = {host.lower(): site for host, site in (hosts or {}).items()}
+        # Longest first so /north-east isn't taken for /north.
+        self.paths = sorted(
+            ((prefix.rstrip("/"), site) for prefix, site in (paths or {}).items()),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+
+    def __call__(self, environ, start_response):
+        host = environ.get("HTTP_HOST") or environ.get("SERVER_NAME", "")
+        site = self.hosts.get(host.split(":")[0].lower())
+
+        path = environ.get("PATH_INFO", "")
+        for prefix, prefix_site in self.paths:
+            if path == prefix or path.startswith(prefix + "/"):
+                environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + prefix
+                environ["PATH_INFO"] = path[len(prefix) :] or "/"
+                site = prefix_site
+                break
+
+        environ[ENVIRON_KEY] = site or DEFAULT_SITE
+        return self.wsgi_app(environ, start_response)
+
+
+class SiteSession(FlaskSQLAlchemySession):
+    """
+    The class of db.session. Statements for sites with their own db (see SITE_BINDS)
+    are sent to that db, so each site's bookings are written to its own SQLite file
+    and a busy site doesn't hold up the others.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            bind_key = site_bind_key(current_site())
+            if bind_key is not None:
+                return self._db.engines[bind_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class SiteSessionInterface(SecureCookieSessionInterface):
+    """
+    Gives sites with their own db their own session cookie, as their user accounts
+    are in that db. Only matters when sites share a host and are told apart by path.
+    """
+
+    def get_cookie_name(self, app) -> str:
+        name = super().get_cookie_name(app)
+        site = current_site()
+        if site_bind_key(site) is not None:
+            return f"{name}_{site}"
+        return name
+
+
+def init_sites(app) -> None:
+    """
+    Routes requests to sites with SITE_HOSTS and SITE_PATHS, and checks SITE_BINDS
+    only names binds in SQLALCHEMY_BINDS.
+    """
+    unknown = {
+        site: bind_key
+        for site, bind_key in app.config.get("SITE_BINDS", {}).items()
+        if bind_key not in app.config.get("SQLALCHEMY_BINDS", {})
+    }
+    if unknown:
+        raise ValueError(
+            f"SITE_BINDS names binds missing from SQLALCHEMY_BINDS: {unknown}"
+        )
+
+    app.wsgi_app = SiteMiddleware(
+        app.wsgi_app, app.config.get("SITE_HOSTS"), app.config.get("SITE_PATHS")
+    )
+    app.session_interface = SiteSessionInterface()
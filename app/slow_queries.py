@@ -0,0 +1,207 @@
+from flask import current_app, has_request_context, request
+from sqlalchemy import event
+import logging.handlers
+import collections
+import traceback
+import datetime
+import json
+import time
+import os
+
+# Frames from these folders are skipped when looking for the code that ran a query.
+LIBRARY_PATHS = ("site-packages", "dist-packages", os.path.dirname(logging.__file__))
+
+
+def open_log_file(path: str, max_bytes: int, backups: int) -> "logging.Logger":
+    """
+    Returns a logger that writes slow query entries to a rotating file at path.
+    Each app has its own, kept in app.extensions["slow_query_log"], so they don't
+    build up on a global logger.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    # Not from logging.getLogger, which would keep it for the life of the process.
+    logger = logging.Logger("app.slow_queries", logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+def query_origin() -> "dict":
+    """
+    Returns the view handling the current request and the line of app code that ran the query.
+    """
+    origin = {"view": None, "url": None, "source": None}
+    if has_request_context():
+        view = current_app.view_functions.get(request.endpoint)
+        if view is not None:
+            origin["view"] = f"{view.__module__}.{view.__qualname__}"
+        origin["url"] = f"{request.method} {request.path}"
+
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if frame.filename == __file__ or any(
+            p in frame.filename for p in LIBRARY_PATHS
+        ):
+            continue
+        origin["source"] = f"{frame.filename}:{frame.lineno} in {frame.name}"
+        break
+    return origin
+
+
+def explain(cursor, statement: str, parameters) -> "list[str]":
+    """
+    Runs EXPLAIN QUERY PLAN for a statement on the same SQLite connection.
+    Returns the plan's lines, indented by depth, or None if it could not be explained.
+    """
+    plan_cursor = cursor.connection.cursor()
+    try:
+        plan_cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        rows = plan_cursor.fetchall()
+    except Exception:
+        return None
+    finally:
+        plan_cursor.close()
+
+    # Each row is (id, parent, notused, detail).
+    depth = {0: -1}
+    lines = []
+    for id, parent, _, detail in rows:
+        depth[id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[id] + detail)
+    return lines
+
+
+def redact_parameters(parameters, executemany: bool):
+    """
+    Returns the types of a statement's parameters in place of their values, which
+    can be password hashes or emails.
+    """
+    if executemany:
+        return f"{len(parameters)} rows"
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+def log_slow_queries(
+    engine, threshold_ms: float, logger, log_parameters: bool = False
+) -> "list[tuple]":
+    """
+    Logs every statement the engine runs that takes longer than threshold_ms.
+    params:
+        logger: Where to log them, see open_log_file.
+        log_parameters: Log the values of the statement's parameters, not just their
+            types.
+    Returns the (engine, event name, listener) of each listener added.
+    """
+
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    def check_query(conn, cursor, statement, parameters, context, executemany):
+        duration = (time.perf_counter() - conn.info["slow_query_start"].pop()) * 1000
+        if duration < threshold_ms:
+            return
+
+        entry = {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "duration_ms": round(duration, 2),
+            "statement": statement,
+            "parameters": (
+                parameters
+                if log_parameters
+                else redact_parameters(parameters, executemany)
+            ),
+            "executemany": executemany,
+            "plan": None,
+            **query_origin(),
+        }
+        if engine.dialect.name == "sqlite" and not executemany:
+            entry["plan"] = explain(cursor, statement, parameters)
+
+        logger.info(json.dumps(entry, default=str))
+
+    def failed_query(context):
+        # after_cursor_execute isn't called for statements that raise. Only the
+        # statement running now can have its start time on the connection.
+        if context.connection is None:
+            return
+        starts = context.connection.info.get("slow_query_start")
+        if starts:
+            starts.pop()
+
+    listeners = [
+        (engine, "before_cursor_execute", start_query),
+        (engine, "after_cursor_execute", check_query),
+        (engine, "handle_error", failed_query),
+    ]
+    for listener in listeners:
+        event.listen(*listener)
+    return listeners
+
+
+def stop_slow_query_log(app) -> None:
+    """
+    Stops logging the app's slow queries and closes the log file.
+    """
+    log = app.extensions.pop("slow_query_log", None)
+    if log is None:
+        return
+    for listener in log["listeners"]:
+        event.remove(*listener)
+    for handler in log["logger"].handlers:
+        handler.close()
+
+
+def init_slow_query_log(app, engines) -> None:
+    """
+    Logs slow queries to SLOW_QUERY_LOG (instance/slow_queries.log by default) if
+    SLOW_QUERY_THRESHOLD_MS is set, in the config or the environment.
+    Parameter values are only logged if SLOW_QUERY_LOG_PARAMETERS is set.
+    Calling it again replaces the app's earlier slow query log.
+    params:
+        engines: The db engines to watch.
+    """
+    threshold = os.getenv("SLOW_QUERY_THRESHOLD_MS") or app.config.get(
+        "SLOW_QUERY_THRESHOLD_MS"
+    )
+    path = app.config.setdefault(
+        "SLOW_QUERY_LOG", os.path.join(app.instance_path, "slow_queries.log")
+    )
+    stop_slow_query_log(app)
+    if threshold in (None, ""):
+        return
+
+    app.config["SLOW_QUERY_THRESHOLD_MS"] = float(threshold)
+    logger = open_log_file(
+        path,
+        app.config.get("SLOW_QUERY_LOG_MAX_BYTES", 1024 * 1024),
+        app.config.get("SLOW_QUERY_LOG_BACKUPS", 3),
+    )
+    log_parameters = bool(app.config.get("SLOW_QUERY_LOG_PARAMETERS"))
+    listeners = []
+    for engine in engines:
+        listeners += log_slow_queries(engine, float(threshold), logger, log_parameters)
+    app.extensions["slow_query_log"] = {"logger": logger, "listeners": listeners}
+
+
+def read_slow_queries(path: str, limit: int = 100) -> "list[dict]":
+    """
+    Returns the last `limit` entries in the slow query log at path, newest first.
+    """
+    if not os.path.exists(path):
+        return []
+
+    with open(path, encoding="utf-8") as log:
+        lines = collections.deque(log, maxlen=limit)
+
+    entries = []
+    for line in reversed(lines):
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # Partly written line.
+            continue
+    return entries
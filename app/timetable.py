@@ -0,0 +1,614 @@
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, insert, select, update
+from app.models import Activities, Activity, Days, Facilities, Facility, Session
+from app.cache import TIMETABLE, bump_versions, get_versions
+from app.sites import DEFAULT_SITE, current_site, using_site
+from app import db
+import collections
+import threading
+import bisect
+import datetime
+import json
+import csv
+import io
+import os
+import click
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# The timetable add_facilities and add_activities load.
+DEFAULT_TIMETABLE = os.path.join(os.path.dirname(__file__), "timetable.json")
+
+# Columns of timetable CSV files, one row per activity.
+CSV_COLUMNS = ["facility", "day", "activity", "start", "end"]
+
+# Facilities and activities are matched to existing rows on these columns.
+FACILITY_KEY = ["site", "facility_id"]
+ACTIVITY_KEY = ["site", "facility_id", "day", "activity_type", "start_time"]
+
+
+class InvalidTimetable(ValueError):
+    def __init__(self, errors: "list[str]") -> None:
+        """
+        Raised when an imported timetable has problems, with a message for each one.
+        """
+        super().__init__(f"{len(errors)} problems with the timetable")
+        self.errors = errors
+
+
+def read_timetables(path: str) -> "list[dict]":
+    """
+    Reads a timetable file, see timetable.json for the format. The file can hold one
+    site's timetable or a list of them. YAML files can be read if PyYAML is installed.
+    Returns a list with each site's timetable.
+    """
+    with open(path) as file:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ValueError("Install PyYAML to read YAML timetables")
+            data = yaml.safe_load(file)
+        else:
+            data = json.load(file)
+    return data if isinstance(data, list) else [data]
+
+
+def parse_time(value: str) -> datetime.time:
+    return datetime.time.fromisoformat(value)
+
+
+def timetable_rows(timetable: "dict") -> "tuple[list[dict], list[dict]]":
+    """
+    Converts a site's timetable into rows for the facility and activity tables.
+    Raises ValueError naming the entry if a facility, day, activity or time is invalid.
+    """
+    site = timetable.get("site", DEFAULT_SITE)
+    facilities, activities = [], []
+    for facility_name, details in timetable["facilities"].items():
+        try:
+            facility_id = Facilities[facility_name]
+            facilities.append(
+                {
+                    "site": site,
+                    "facility_id": facility_id,
+                    "start_time": parse_time(details["open"]),
+                    "end_time": parse_time(details["close"]),
+                    "max_capacity": int(details["capacity"]),
+                }
+            )
+            for day, slots in details.get("timetable", {}).items():
+                for slot in slots:
+                    for activity in slot["activities"]:
+                        activities.append(
+                            {
+                                "site": site,
+                                "activity_type": Activities[activity],
+                                "facility_id": facility_id,
+                                "day": Days[day],
+                                "start_time": parse_time(slot["start"]),
+                                "end_time": parse_time(slot["end"]),
+                            }
+                        )
+        except (KeyError, ValueError, TypeError) as e:
+            raise ValueError(f"Invalid timetable entry for {facility_name}: {e!r}")
+    return facilities, activities
+
+
+def upsert(session, model, key: "list[str]", rows: "list[dict]") -> "dict":
+    """
+    Inserts the rows that aren't in the table yet and updates those that have changed,
+    matching them to existing rows on the key columns. Each is done with a single
+    executemany, rather than an ORM object per row.
+    Returns the number of rows added and updated.
+    """
+    table = model.__table__
+    primary_key = table.primary_key.columns.values()[0]
+    columns = [table.c[name] for name in rows[0]] if rows else []
+    existing = {
+        tuple(row._mapping[name] for name in key): row
+        for row in session.execute(
+            select(*columns, primary_key).where(
+                table.c[key[0]].in_({row[key[0]] for row in rows})
+            )
+        )
+    }
+
+    added, changed = [], []
+    for row in rows:
+        current = existing.get(tuple(row[name] for name in key))
+        if current is None:
+            added.append(row)
+        elif any(current._mapping[name] != value for name, value in row.items()):
+            changed.append(dict(row, **{primary_key.name: current[-1]}))
+
+    if added:
+        session.execute(insert(model), added)
+    if changed:
+        # Bulk UPDATE by primary key.
+        session.execute(update(model), changed)
+    return {"added": len(added), "updated": len(changed)}
+
+
+def load_timetable(session, timetable: "dict", parts=("facilities", "activities")):
+    """
+    Adds or updates a site's facilities and activities. Safe to run again, rows that
+    match the timetable are left alone. Activities not in the timetable are kept.
+    params:
+        session: The db session to use, with current_site() set to the timetable's
+            site if the site has its own db.
+        parts: Load only the facilities or only the activities.
+    Returns the number of facilities and activities added and updated.
+    """
+    facilities, activities = timetable_rows(timetable)
+    counts = {}
+    if "facilities" in parts:
+        # Each facility appears once per site.
+        counts["facilities"] = upsert(session, Facility, FACILITY_KEY, facilities)
+    if "activities" in parts:
+        counts["activities"] = upsert(session, Activity, ACTIVITY_KEY, activities)
+
+    # The bulk statements skip the ORM events that do this.
+    if any(c["added"] or c["updated"] for c in counts.values()):
+        bump_versions(session.connection(), {TIMETABLE})
+    session.commit()
+    return counts
+
+
+def load_timetables(timetables: "list[dict]") -> "dict":
+    """
+    Loads each site's timetable, into the site's own db if it has one.
+    Returns site: counts, see load_timetable.
+    """
+    # Check them all first, so an invalid one doesn't leave the others half loaded.
+    for timetable in timetables:
+        timetable_rows(timetable)
+
+    results = {}
+    for timetable in timetables:
+        with using_site(timetable.get("site", DEFAULT_SITE)) as site:
+            try:
+                results[site] = load_timetable(db.session, timetable)
+            finally:
+                db.session.remove()
+    return results
+
+
+@click.command("load-timetable")
+@click.argument("paths", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def load_timetable_command(paths):
+    """
+    Adds or updates the facilities and activities in timetable files (JSON, or YAML
+    with PyYAML), app/timetable.json by default. Files can hold several sites.
+    """
+    try:
+        timetables = []
+        for path in paths or [DEFAULT_TIMETABLE]:
+            timetables += read_timetables(path)
+        results = load_timetables(timetables)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    for site, counts in results.items():
+        summary = ", ".join(
+            f"{part}: {c['added']} added, {c['updated']} updated"
+            for part, c in counts.items()
+        )
+        click.echo(f"{site}: {summary}")
+
+
+def describe_activity(row: "dict") -> str:
+    return (
+        f"{row['activity_type'].name} in {row['facility_id'].name} on "
+        f"{row['day'].name} {row['start_time']:%H:%M}-{row['end_time']:%H:%M}"
+    )
+
+
+def read_activity_rows(file, format: str) -> "list[dict]":
+    """
+    Reads the activities from an uploaded timetable, in the format export_timetable
+    writes. Facility details in JSON timetables are ignored.
+    params:
+        file: Text file object.
+        format: One of 'csv', 'json'.
+    Raises InvalidTimetable listing every row that can't be read.
+    """
+    if format == "json":
+        try:
+            data = json.load(file)
+            timetables = data if isinstance(data, list) else [data]
+            return [row for t in timetables for row in timetable_rows(t)[1]]
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            raise InvalidTimetable([f"Invalid JSON timetable: {e}"])
+
+    rows, errors = [], []
+    reader = csv.DictReader(file)
+    if reader.fieldnames != CSV_COLUMNS:
+        raise InvalidTimetable([f"The CSV columns must be {', '.join(CSV_COLUMNS)}"])
+    for line, record in enumerate(reader, start=2):
+        try:
+            rows.append(
+                {
+                    "activity_type": Activities[record["activity"].strip().upper()],
+                    "facility_id": Facilities[record["facility"].strip().upper()],
+                    "day": Days[record["day"].strip().upper()],
+                    "start_time": parse_time(record["start"].strip()),
+                    "end_time": parse_time(record["end"].strip()),
+                }
+            )
+        except (KeyError, ValueError, AttributeError) as e:
+            errors.append(f"Line {line}: invalid value {e}")
+    if errors:
+        raise InvalidTimetable(errors)
+    return rows
+
+
+def find_overlaps(rows: "list[dict]") -> "list[tuple[dict, dict]]":
+    """
+    Finds pairs of activities with overlapping times, by sorting them on start time
+    and sweeping through them keeping the one that ends latest so far. Each activity
+    is reported once, against the earlier activity it overlaps.
+    Times that only touch (one ending at 10:00, the next starting at 10:00) are fine.
+    """
+    overlaps = []
+    latest = None
+    for row in sorted(rows, key=lambda r: (r["start_time"], r["end_time"])):
+        if latest is not None and row["start_time"] < latest["end_time"]:
+            overlaps.append((latest, row))
+        if latest is None or row["end_time"] > latest["end_time"]:
+            latest = row
+    return overlaps
+
+
+def validate_activities(
+    rows: "list[dict]", existing: "list[dict]", facilities: "dict"
+) -> "list[str]":
+    """
+    Checks imported activities against the facilities' opening hours, and against
+    each other and the existing activities for activities of the same type in the
+    same facility on the same day overlapping. Overlaps between existing activities
+    aren't reported, they were there before the import.
+    params:
+        rows: Activities being imported.
+        existing: Activities staying in the db, that aren't replaced by rows.
+        facilities: facility_id: (start_time, end_time) opening hours.
+    Returns a message for each problem found.
+    """
+    errors = []
+    seen = set()
+    for row in rows:
+        key = tuple(row[name] for name in ACTIVITY_KEY)
+        if key in seen:
+            errors.append(f"{describe_activity(row)} is listed more than once")
+        seen.add(key)
+
+        hours = facilities.get(row["facility_id"])
+        if hours is None:
+            errors.append(
+                f"{describe_activity(row)}: {row['facility_id'].name} isn't a facility"
+            )
+        elif row["start_time"] < hours[0] or row["end_time"] > hours[1]:
+            errors.append(
+                f"{describe_activity(row)} is outside the opening hours "
+                f"{hours[0]:%H:%M}-{hours[1]:%H:%M}"
+            )
+        if row["end_time"] <= row["start_time"]:
+            errors.append(f"{describe_activity(row)} ends before it starts")
+
+    groups = collections.defaultdict(list)
+    for row in rows + existing:
+        groups[row["facility_id"], row["activity_type"], row["day"]].append(row)
+    imported = {id(row) for row in rows}
+    for group in groups.values():
+        for earlier, later in find_overlaps(group):
+            if id(earlier) in imported or id(later) in imported:
+                errors.append(
+                    f"{describe_activity(later)} overlaps {describe_activity(earlier)}"
+                )
+    return errors
+
+
+def import_activities(session, rows: "list[dict]", replace: bool = False) -> "dict":
+    """
+    Validates the activities then adds or updates them in one transaction, or changes
+    nothing if any of them are invalid, see validate_activities.
+    The activities are for current_site(), whatever site the file says.
+    params:
+        replace: Delete the existing activities of the facilities in rows that are
+            not in rows, rather than keeping them.
+    Returns the number of activities added, updated and deleted.
+    Raises InvalidTimetable listing every problem found.
+    """
+    if not rows:
+        raise InvalidTimetable(["The timetable has no activities"])
+
+    # Files exported from one site can be imported into another.
+    site = current_site()
+    rows = [dict(row, site=site) for row in rows]
+
+    facilities = {
+        facility_id: (start_time, end_time)
+        for facility_id, start_time, end_time in session.execute(
+            select(Facility.facility_id, Facility.start_time, Facility.end_time).where(
+                Facility.site == site
+            )
+        )
+    }
+    columns = [Activity.__table__.c[name] for name in rows[0]]
+    existing = {
+        tuple(row._mapping[name] for name in ACTIVITY_KEY): row
+        for row in session.execute(
+            select(Activity.activity_id, *columns).where(Activity.site == site)
+        )
+    }
+
+    imported_keys = {tuple(row[name] for name in ACTIVITY_KEY) for row in rows}
+    imported_facilities = {row["facility_id"] for row in rows}
+    kept, deleted = [], []
+    for key, row in existing.items():
+        if key in imported_keys:
+            continue
+        if replace and row.facility_id in imported_facilities:
+            deleted.append(row.activity_id)
+        else:
+            kept.append({name: row._mapping[name] for name in rows[0]})
+
+    errors = validate_activities(rows, kept, facilities)
+    if errors:
+        raise InvalidTimetable(errors)
+
+    try:
+        counts = upsert(session, Activity, ACTIVITY_KEY, rows)
+        if deleted:
+            session.execute(delete(Activity).where(Activity.activity_id.in_(deleted)))
+        counts["deleted"] = len(deleted)
+        # The bulk statements skip the ORM events that do this.
+        if any(counts.values()):
+            bump_versions(session.connection(), {TIMETABLE})
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return counts
+
+
+def export_timetable(session, format: str) -> str:
+    """
+    Writes out current_site()'s facilities and activities in a format
+    import_activities can read.
+    params:
+        format: One of 'csv', one row per activity, or 'json', the format of
+            timetable.json with the activities at the same times grouped together.
+    """
+    activities = session.execute(
+        select(
+            Activity.facility_id,
+            Activity.day,
+            Activity.activity_type,
+            Activity.start_time,
+            Activity.end_time,
+        )
+        .where(Activity.site == current_site())
+        .order_by(
+            Activity.facility_id,
+            Activity.day,
+            Activity.start_time,
+            Activity.end_time,
+            Activity.activity_type,
+        )
+    ).all()
+
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_COLUMNS)
+        for facility_id, day, activity_type, start_time, end_time in activities:
+            writer.writerow(
+                [
+                    facility_id.name,
+                    day.name,
+                    activity_type.name,
+                    f"{start_time:%H:%M}",
+                    f"{end_time:%H:%M}",
+                ]
+            )
+        return buffer.getvalue()
+
+    facilities = {}
+    for facility in session.execute(
+        select(Facility)
+        .where(Facility.site == current_site())
+        .order_by(Facility.facility_id)
+    ).scalars():
+        facilities[facility.facility_id.name] = {
+            "open": f"{facility.start_time:%H:%M}",
+            "close": f"{facility.end_time:%H:%M}",
+            "capacity": facility.max_capacity,
+            "timetable": {},
+        }
+    for facility_id, day, activity_type, start_time, end_time in activities:
+        details = facilities.setdefault(facility_id.name, {"timetable": {}})
+        slots = details["timetable"].setdefault(day.name, [])
+        start, end = f"{start_time:%H:%M}", f"{end_time:%H:%M}"
+        if not slots or (slots[-1]["start"], slots[-1]["end"]) != (start, end):
+            slots.append({"start": start, "end": end, "activities": []})
+        slots[-1]["activities"].append(activity_type.name)
+    return json.dumps({"site": current_site(), "facilities": facilities}, indent=2)
+
+
+class IntervalGroup:
+    def __init__(self, intervals: "list[tuple]") -> None:
+        """
+        The activities of one type in a facility on one day, sorted by start time so
+        overlaps can be found with a binary search instead of a scan.
+        params:
+            intervals: (start_time, end_time, activity_id) of each activity.
+        """
+        intervals = sorted(intervals)
+        self.starts = [start for start, _, _ in intervals]
+        # latest[i] holds the two activities that end latest out of the first i + 1,
+        # so one can be left out when it is the activity being edited.
+        self.latest = []
+        best = []
+        for start, end, activity_id in intervals:
+            best = sorted(best + [(end, activity_id)], reverse=True)[:2]
+            self.latest.append(best)
+
+    def latest_ending(self, time: datetime.time, inclusive: bool, exclude=None):
+        """
+        Returns (end_time, activity_id) of the activity that ends latest out of those
+        starting before time (or at it if inclusive), or None if there aren't any.
+        params:
+            exclude: activity_id to leave out.
+        """
+        search = bisect.bisect_right if inclusive else bisect.bisect_left
+        count = search(self.starts, time)
+        if count == 0:
+            return None
+        for end, activity_id in self.latest[count - 1]:
+            if activity_id != exclude:
+                return end, activity_id
+        return None
+
+    def overlapping(self, start, end, exclude=None):
+        """
+        Returns the id of an activity overlapping start to end, or None.
+        """
+        latest = self.latest_ending(end, inclusive=False, exclude=exclude)
+        if latest is not None and latest[0] > start:
+            return latest[1]
+        return None
+
+    def covers(self, start, end, exclude=None) -> bool:
+        """
+        Returns True if an activity runs for the whole of start to end.
+        """
+        latest = self.latest_ending(start, inclusive=True, exclude=exclude)
+        return latest is not None and latest[0] >= end
+
+
+class ActivityIndex:
+    def __init__(self, activities: "list", facilities: "list") -> None:
+        """
+        The timetable grouped by facility, then by activity type and day, for checking
+        edits to single activities. Each check takes O(log n) time in the number of
+        activities of that type on that day.
+        params:
+            activities: Rows of activity_id, facility_id, activity_type, day,
+                start_time, end_time.
+            facilities: Rows of facility_id, start_time, end_time.
+        """
+        self.hours = {f.facility_id: (f.start_time, f.end_time) for f in facilities}
+        grouped = collections.defaultdict(lambda: collections.defaultdict(list))
+        for a in activities:
+            grouped[a.facility_id][a.activity_type, a.day].append(
+                (a.start_time, a.end_time, a.activity_id)
+            )
+        self.facilities = {
+            facility_id: {key: IntervalGroup(rows) for key, rows in groups.items()}
+            for facility_id, groups in grouped.items()
+        }
+
+    def group(self, facility_id, activity_type, day) -> IntervalGroup:
+        return self.facilities.get(facility_id, {}).get(
+            (activity_type, day), IntervalGroup([])
+        )
+
+    def check(self, row: "dict", activity_id=None) -> "list[str]":
+        """
+        Checks an activity is within its facility's opening hours and doesn't overlap
+        another of the same type in the same facility on the same day.
+        params:
+            row: The activity's facility_id, activity_type, day, start_time and end_time.
+            activity_id: The activity being edited, so it isn't compared with itself.
+        Returns a message for each problem found.
+        """
+        errors = []
+        hours = self.hours.get(row["facility_id"])
+        if hours is None:
+            errors.append(f"{row['facility_id'].name} isn't a facility")
+        elif row["start_time"] < hours[0] or row["end_time"] > hours[1]:
+            errors.append(
+                f"{describe_activity(row)} is outside the opening hours "
+                f"{hours[0]:%H:%M}-{hours[1]:%H:%M}"
+            )
+
+        group = self.group(row["facility_id"], row["activity_type"], row["day"])
+        overlap = group.overlapping(row["start_time"], row["end_time"], activity_id)
+        if overlap is not None:
+            errors.append(f"{describe_activity(row)} overlaps activity {overlap}")
+        return errors
+
+
+_index_lock = threading.Lock()
+
+
+def activity_index() -> ActivityIndex:
+    """
+    Returns this process's ActivityIndex of current_site()'s timetable, rebuilding it
+    if the timetable has changed since it was built.
+    """
+    site = current_site()
+    version = get_versions([TIMETABLE])[TIMETABLE]
+    indexes = current_app.extensions.setdefault("activity_index", {})
+    cached = indexes.get(site)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with _index_lock:
+        index = ActivityIndex(
+            db.session.execute(
+                select(
+                    Activity.activity_id,
+                    Activity.facility_id,
+                    Activity.activity_type,
+                    Activity.day,
+                    Activity.start_time,
+                    Activity.end_time,
+                ).where(Activity.site == site)
+            ).all(),
+            db.session.execute(
+                select(
+                    Facility.facility_id, Facility.start_time, Facility.end_time
+                ).where(Facility.site == site)
+            ).all(),
+        )
+        indexes[site] = (version, index)
+    return index
+
+
+def sessions_outside(old: "dict", activity_id: int, now=None) -> "list[Session]":
+    """
+    Finds the booked sessions that were within an activity's hours before it was
+    edited, and aren't within any activity of theirs now.
+    Call after the edit has been saved.
+    params:
+        old: The activity's facility_id, activity_type, day, start_time and end_time
+            before the edit.
+    """
+    now = now or datetime.datetime.now()
+    sessions = db.session.execute(
+        select(Session)
+        .where(Session.site == current_site())
+        .where(Session.facility_id == old["facility_id"])
+        .where(Session.session_type == old["activity_type"])
+        .where(Session.start_time >= now)
+        .where(Session.users.any())
+        .order_by(Session.start_time)
+    ).scalars()
+    group = activity_index().group(old["facility_id"], old["activity_type"], old["day"])
+
+    outside = []
+    for session in sessions:
+        start, end = session.start_time.time(), session.end_time.time()
+        if (
+            session.start_time.weekday() == old["day"].value
+            and old["start_time"] <= start
+            and end <= old["end_time"]
+            and not group.covers(start, end)
+        ):
+            outside.append(session)
+    return outside
@@ -5,7 +5,6 @@ from functools import wraps
 from flask import request, redirect, url_for, flash
 from flask_login import current_user
 from argon2.exceptions import VerifyMismatchError
-from stripe import error
 
 
 def update_password(password, user=current_user):
@@ -21,7 +20,7 @@ def update_stripe_details(user):
     try:
         customer = stripe.Customer.retrieve(user.stripe_id)
 
-    except error.InvalidRequestError as e:
+    except stripe.error.InvalidRequestError as e:
         print(str(e))
 
     if customer:
@@ -0,0 +1,11 @@
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark", action="store_true", help="Run the benchmarks in benchmarks/"
+    )
+    parser.addoption(
+        "--benchmark-compare",
+        help="JSON results from benchmarks/run.py to compare with",
+    )
+    parser.addoption(
+        "--benchmark-output", help="Save the benchmark results as JSON to this path"
+    )
@@ -0,0 +1,517 @@
+"""
+Load test with concurrent customers, employees and admins.
+
+Each simulated user is a thread that logs in and repeats its role's journey until
+the time is up:
+    customer: browse get_sessions, add sessions to the basket, check out and pay
+    employee: search for a customer, then book and pay for sessions for them
+    admin: page through the members, activities and facilities listings
+Payments go to a fake Stripe gateway running in this process, so nothing is sent to Stripe.
+Prints the throughput and latency percentiles of each step.
+
+By default the app runs in this process against a temporary SQLite db seeded with
+app/datagen.py. To load test a running server instead, seed its db with
+`flask generate-data --employees 10`, start it with STRIPE_API_BASE=http://127.0.0.1:12111
+and STRIPE_SECRET set to anything, and pass its URL and db:
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --database-url <its db>
+
+Usage:
+    python benchmarks/loadtest.py --customers 20 --employees 4 --admins 1 --duration 60
+    python benchmarks/loadtest.py --members 5000 --months 3 --output results.json
+"""
+import argparse
+import collections
+import contextlib
+import datetime
+import html
+import http.cookiejar
+import http.server
+import io
+import json
+import os
+import random
+import re
+import secrets
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import select  # noqa: E402
+from app import create_app, db, init_db, stripe  # noqa: E402
+from app.datagen import generate  # noqa: E402
+from app.models import Roles, User  # noqa: E402
+
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+SESSION_CODE = re.compile(r'type="checkbox" value="([^"]+)"')
+NEXT_PAGE = re.compile(r'href="([^"#]+)">Next</a>')
+
+
+class FakeGateway(http.server.ThreadingHTTPServer):
+    def __init__(self, port: int = 0, latency: float = 0.0) -> None:
+        """
+        Answers the Stripe API calls the app makes when booking, like Stripe would.
+        params:
+            port: Port to listen on, 0 for any free port.
+            latency: Seconds to wait before each response, to match Stripe's.
+        """
+        super().__init__(("127.0.0.1", port), GatewayHandler)
+        self.latency = latency
+        self.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class GatewayHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def respond(self, status: int, body: "dict") -> None:
+        time.sleep(self.server.latency)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        # Customer.retrieve
+        match = re.fullmatch(r"/v1/customers/(\w+)", self.path)
+        if match:
+            return self.respond(200, {"id": match[1], "object": "customer"})
+        self.not_found()
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+
+        if self.path == "/v1/customers":
+            customer = {"id": "cus_" + secrets.token_hex(7), "object": "customer"}
+            customer["email"] = form.get("email", [""])[0]
+            return self.respond(200, customer)
+
+        if self.path == "/v1/checkout/sessions":
+            id = "cs_test_" + secrets.token_hex(12)
+            checkout = {"id": id, "object": "checkout.session"}
+            checkout["url"] = f"{self.server.url}/pay/{id}"
+            return self.respond(200, checkout)
+        self.not_found()
+
+    def not_found(self) -> None:
+        error = {"type": "invalid_request_error", "message": f"No route {self.path}"}
+        self.respond(404, {"error": error})
+
+
+class Response:
+    def __init__(self, status: int, location: str, text: str) -> None:
+        self.status = status
+        self.location = location
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class TestClient:
+    def __init__(self, app) -> None:
+        """
+        Sends requests straight to the app in this process, with its own cookies.
+        """
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, data: "dict" = None) -> Response:
+        response = self.client.open(path, method=method, data=data)
+        return Response(
+            response.status_code,
+            response.headers.get("Location"),
+            response.get_data(as_text=True),
+        )
+
+
+class NoRedirects(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    def __init__(self, url: str) -> None:
+        """
+        Sends requests to a server at url, with its own cookies.
+        Redirects are not followed, as with TestClient.
+        """
+        self.url = url.rstrip("/")
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            NoRedirects(),
+        )
+
+    def request(self, method: str, path: str, data: "dict" = None) -> Response:
+        body = urllib.parse.urlencode(data, doseq=True).encode() if data else None
+        request = urllib.request.Request(self.url + path, body, method=method)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                status, headers = response.status, response.headers
+                text = response.read().decode()
+        except urllib.error.HTTPError as e:
+            status, headers, text = e.code, e.headers, e.read().decode()
+        return Response(status, headers.get("Location"), text)
+
+
+class Results:
+    def __init__(self) -> None:
+        """
+        The latency of every step, shared by all the simulated users.
+        """
+        self._lock = threading.Lock()
+        # step: list of seconds
+        self.latencies = collections.defaultdict(list)
+        # step: count
+        self.errors = collections.Counter()
+        self.journeys = collections.Counter()
+
+    def record(self, step: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies[step].append(seconds)
+            if not ok:
+                self.errors[step] += 1
+
+    def journey_finished(self, role: str) -> None:
+        with self._lock:
+            self.journeys[role] += 1
+
+    def summary(self, duration: float) -> "dict":
+        """
+        Returns the throughput and latency percentiles of each step, in milliseconds.
+        """
+        steps = {}
+        for step, times in sorted(self.latencies.items()):
+            times = sorted(t * 1000 for t in times)
+            percentiles = (
+                statistics.quantiles(times, n=100, method="inclusive")
+                if len(times) > 1
+                else times * 99
+            )
+            steps[step] = {
+                "requests": len(times),
+                "errors": self.errors[step],
+                "per_second": len(times) / duration,
+                "p50_ms": percentiles[49],
+                "p95_ms": percentiles[94],
+                "p99_ms": percentiles[98],
+                "max_ms": times[-1],
+            }
+        requests = sum(len(times) for times in self.latencies.values())
+        return {
+            "duration_s": duration,
+            "requests": requests,
+            "requests_per_second": requests / duration,
+            "journeys": dict(self.journeys),
+            "steps": steps,
+        }
+
+
+class StepFailed(Exception):
+    pass
+
+
+class VirtualUser:
+    def __init__(self, client, results: Results, rng: random.Random, login: tuple):
+        """
+        One simulated user, who logs in with login (username, password) then repeats
+        their journey. Subclasses define journey() for each role.
+        """
+        self.client = client
+        self.results = results
+        self.rng = rng
+        self.username, self.password = login
+
+    def step(self, name: str, method: str, path: str, data=None, expect=(200,)):
+        """
+        Sends a request, recording its latency under name.
+        Raises StepFailed if the response status is not in expect, ending the journey.
+        """
+        start = time.perf_counter()
+        response = self.client.request(method, path, data)
+        ok = response.status in expect
+        self.results.record(name, time.perf_counter() - start, ok)
+        if not ok:
+            raise StepFailed(f"{name}: {method} {path} returned {response.status}")
+        return response
+
+    def form(self, name: str, path: str, data: "dict", action=None, expect=(302,)):
+        """
+        Submits the form on the page at path to action (path by default),
+        getting its CSRF token first like a browser would.
+        """
+        page = self.step(f"{name}_form", "GET", path)
+        token = CSRF_TOKEN.search(page.text)
+        if token:
+            data = dict(data, csrf_token=html.unescape(token[1]))
+        return self.step(name, "POST", action or path, data, expect)
+
+    def login(self) -> None:
+        response = self.form(
+            "login",
+            "/auth/login",
+            {"identifier": self.username, "password": self.password},
+        )
+        if response.location and "login" in response.location:
+            raise StepFailed(f"could not log in as {self.username}")
+
+    def run(self, deadline: float, think_time: float) -> None:
+        try:
+            self.login()
+        except StepFailed as e:
+            print(e, file=sys.stderr)
+            return
+
+        while time.monotonic() < deadline:
+            try:
+                self.journey()
+                self.results.journey_finished(type(self).__name__.lower())
+            except StepFailed as e:
+                print(e, file=sys.stderr)
+            time.sleep(self.rng.uniform(0, think_time * 2))
+
+    def journey(self) -> None:
+        raise NotImplementedError
+
+    def pick_basket(self, codes: "list[str]", size: int) -> "list[str]":
+        """
+        Picks up to size sessions that start at different times, from their unique codes.
+        """
+        self.rng.shuffle(codes)
+        basket = {}
+        for code in codes:
+            # Codes are YYYY-MM-DD-HH-...
+            basket.setdefault(code[:13], code)
+        return list(basket.values())[:size]
+
+    def pay(self) -> None:
+        """
+        Pays for the basket and comes back from the gateway, as after a successful payment.
+        Members skip the payment and go straight to booking_success.
+        """
+        self.step("pay", "POST", "/auth/booking-checkout-session", expect=(302, 303))
+        self.step("booking_success", "GET", "/auth/booking/success", expect=(302,))
+
+
+class Customer(VirtualUser):
+    def journey(self) -> None:
+        codes = []
+        for days in range(self.rng.randint(1, 3)):
+            date = datetime.date.today() + datetime.timedelta(
+                days=self.rng.randint(1, 6)
+            )
+            kind = self.rng.choice(["general", "team", "class"])
+            response = self.step(
+                "get_sessions", "GET", f"/customer/get_sessions/{date}-{kind}"
+            )
+            for activity in response.json():
+                codes += [s["session_code"] for s in activity["sessions"]]
+
+        basket = self.pick_basket(codes, self.rng.randint(1, 4))
+        if not basket:
+            return
+        self.step(
+            "save_session",
+            "POST",
+            "/customer/save_session",
+            {str(i): code for i, code in enumerate(basket)},
+            expect=(302,),
+        )
+        self.step("checkout", "GET", "/customer/checkout")
+        self.pay()
+
+
+class Employee(VirtualUser):
+    def __init__(self, *args, customers: "list[str]") -> None:
+        super().__init__(*args)
+        self.customers = customers
+
+    def journey(self) -> None:
+        customer = self.rng.choice(self.customers)
+        # Type-ahead as the name is typed.
+        for length in range(3, len(customer) + 1, 3):
+            self.step(
+                "search_customers",
+                "GET",
+                "/employee/search/customers?q=" + customer[:length],
+            )
+        self.form("search", "/employee/", {"identifier": customer}, "/employee/search")
+
+        date = datetime.date.today() + datetime.timedelta(days=self.rng.randint(1, 6))
+        page = self.form(
+            "booking",
+            "/employee/booking",
+            {"date": str(date), "type": self.rng.choice(["general", "team", "class"])},
+            expect=(200,),
+        )
+        basket = self.pick_basket(SESSION_CODE.findall(page.text), 2)
+        if not basket:
+            return
+        self.step(
+            "employee_save_session",
+            "POST",
+            "/employee/save_session",
+            {str(i): code for i, code in enumerate(basket)},
+            expect=(302,),
+        )
+        self.step("employee_checkout", "GET", "/employee/checkout")
+        self.pay()
+
+
+class Admin(VirtualUser):
+    def journey(self) -> None:
+        for listing in ["members", "activities", "facilities"]:
+            path = f"/admin/{listing}"
+            for _ in range(5 if listing == "members" else 1):
+                page = self.step(f"admin_{listing}", "GET", path)
+                next_page = NEXT_PAGE.search(page.text)
+                if not next_page:
+                    break
+                path = html.unescape(next_page[1])
+
+
+def usernames(role: Roles, limit: int = 10000) -> "list[str]":
+    return (
+        db.session.execute(select(User.username).where(User.role == role).limit(limit))
+        .scalars()
+        .all()
+    )
+
+
+def main(argv: "list[str]" = None) -> "dict":
+    """
+    Runs the load test with the given command line arguments.
+    Returns the summary of the results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--customers", type=int, default=10)
+    parser.add_argument("--employees", type=int, default=2)
+    parser.add_argument("--admins", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument(
+        "--think-time", type=float, default=0.5, help="Mean seconds between journeys"
+    )
+    parser.add_argument("--members", type=int, default=1000, help="Customers to seed")
+    parser.add_argument("--months", type=float, default=1, help="Months to seed")
+    parser.add_argument("--url", help="Load test the server at url")
+    parser.add_argument(
+        "--database-url", help="The server's db, or a db to seed instead of SQLite"
+    )
+    parser.add_argument("--password", default="password", help="Seeded users password")
+    parser.add_argument("--admin", default="admin:adminpassword", help="user:password")
+    parser.add_argument("--gateway-port", type=int, default=12111)
+    parser.add_argument(
+        "--gateway-latency", type=float, default=0.3, help="Seconds per Stripe call"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Save the results as JSON")
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(), "loadtest.db")
+    test_database_url = os.environ.get("TEST_DATABASE_URL")
+    os.environ["TEST_DATABASE_URL"] = args.database_url or f"sqlite:///{path}"
+    try:
+        app = create_app(testing=True)
+    finally:
+        if test_database_url is None:
+            del os.environ["TEST_DATABASE_URL"]
+        else:
+            os.environ["TEST_DATABASE_URL"] = test_database_url
+
+    gateway = FakeGateway(args.gateway_port if args.url else 0, args.gateway_latency)
+    gateway.start()
+
+    with app.app_context():
+        if not args.url:
+            db.create_all()
+            init_db(db)
+            start = time.perf_counter()
+            generate(
+                args.members, args.months, employees=args.employees, seed=args.seed
+            )
+            print(f"Seeded in {time.perf_counter() - start:.1f}s")
+            stripe.api_base = gateway.url
+            stripe.api_key = stripe.api_key or "sk_test_loadtest"
+        customers = usernames(Roles.CUSTOMER)
+        employees = usernames(Roles.EMPLOYEE, args.employees)
+
+    if args.employees and not employees:
+        parser.error("the db has no employees, seed it with --employees")
+    if not customers:
+        parser.error("the db has no customers to log in as")
+
+    rng = random.Random(args.seed)
+    results = Results()
+    admin_login = tuple(args.admin.split(":", 1))
+
+    def client():
+        return HTTPClient(args.url) if args.url else TestClient(app)
+
+    users = []
+    for login in rng.sample(customers, min(args.customers, len(customers))):
+        rand = random.Random(rng.random())
+        users.append(Customer(client(), results, rand, (login, args.password)))
+    for i in range(args.employees):
+        rand = random.Random(rng.random())
+        login = (employees[i % len(employees)], args.password)
+        users.append(Employee(client(), results, rand, login, customers=customers))
+    for _ in range(args.admins):
+        rand = random.Random(rng.random())
+        users.append(Admin(client(), results, rand, admin_login))
+
+    print(
+        f"Running {args.customers} customers, {args.employees} employees and "
+        f"{args.admins} admins for {args.duration:.0f}s"
+    )
+    start = time.monotonic()
+    deadline = start + args.duration
+    threads = [
+        threading.Thread(target=user.run, args=(deadline, args.think_time))
+        for user in users
+    ]
+    # Session.from_unique_code prints each code.
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    gateway.shutdown()
+
+    summary = results.summary(time.monotonic() - start)
+    print(
+        f"\n{summary['requests']} requests, {summary['requests_per_second']:.1f}/s, "
+        f"journeys {summary['journeys']}"
+    )
+    print(
+        f"{'step':<26}{'requests':>9}{'errors':>8}{'per s':>8}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+    )
+    for step, s in summary["steps"].items():
+        print(
+            f"{step:<26}{s['requests']:>9}{s['errors']:>8}{s['per_second']:>8.1f}"
+            f"{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}{s['max_ms']:>9.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(summary, file, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Benchmarks for the booking hot paths.
+
+Seeds a temporary db of the given size, times each benchmark and prints the results.
+Results can be saved as JSON and compared with a saved baseline, in which case the
+runner exits with status 1 if any benchmark is slower than the baseline by more
+than --threshold.
+
+Usage:
+    python benchmarks/run.py --members 1000 --months 1 --output baseline.json
+    python benchmarks/run.py --members 1000 --months 1 --compare baseline.json
+    python benchmarks/run.py --only checkout,merge_session_times
+    pytest benchmarks --benchmark [--benchmark-compare baseline.json]
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flask_login import FlaskLoginClient, login_user  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+import sqlalchemy  # noqa: E402
+from app import create_app, db, add_facilities, add_activities  # noqa: E402
+from app.datagen import generate  # noqa: E402
+from app.models import Roles, Session, User, user_session_m2m  # noqa: E402
+from app.booking_utils import (  # noqa: E402
+    CalanderItem,
+    merge_session_times,
+    get_facility_attendance,
+)
+from app.auth.auth_utils import can_apply_bulk_discount  # noqa: E402
+
+# name: function(context) -> the function to time
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def seed(members: int, months: float, seed: int) -> None:
+    """
+    Fills the db with the timetable and synthetic members and bookings, see app/datagen.py
+    """
+    db.create_all()
+    add_facilities(db)
+    add_activities(db)
+    generate(members, months, seed=seed)
+
+
+class Context:
+    def __init__(self, app, rng: random.Random) -> None:
+        """
+        What the benchmarks need from the seeded db.
+        """
+        self.app = app
+        self.rng = rng
+        self.customer = db.session.execute(
+            select(User).where(User.role == Roles.CUSTOMER).limit(1)
+        ).scalar()
+        self.busiest_session = db.session.execute(
+            select(Session)
+            .join(user_session_m2m)
+            .group_by(Session.session_id)
+            .order_by(func.count().desc())
+            .limit(1)
+        ).scalar()
+        self.upcoming = (
+            db.session.execute(
+                select(Session)
+                .where(Session.start_time > datetime.datetime.now())
+                .order_by(Session.start_time)
+                .limit(200)
+            )
+            .scalars()
+            .all()
+        )
+
+
+@benchmark("create_JSON_from_activities")
+def bench_calendar(ctx: Context):
+    date = datetime.date.today() + datetime.timedelta(days=1)
+
+    def run():
+        with ctx.app.test_request_context():
+            login_user(ctx.customer)
+            CalanderItem(date, "all").create_JSON_from_activities()
+
+    return run
+
+
+@benchmark("create_columnar_JSON_from_activities")
+def bench_calendar_columnar(ctx: Context):
+    date = datetime.date.today() + datetime.timedelta(days=1)
+
+    def run():
+        with ctx.app.test_request_context():
+            login_user(ctx.customer)
+            CalanderItem(date, "all").create_columnar_JSON_from_activities()
+
+    return run
+
+
+@benchmark("merge_session_times")
+def bench_merge(ctx: Context):
+    start = datetime.datetime(2030, 1, 1, 8)
+    times = []
+    for _ in range(200):
+        begin = start + datetime.timedelta(hours=ctx.rng.randrange(24 * 60))
+        times.append([begin, begin + datetime.timedelta(hours=ctx.rng.choice([1, 2]))])
+
+    # merge_session_times changes the lists it is given.
+    return lambda: merge_session_times([list(t) for t in times])
+
+
+@benchmark("can_apply_bulk_discount")
+def bench_discount(ctx: Context):
+    # Sessions spread out so that no 3 are within a week, the worst case.
+    start = datetime.datetime(2030, 1, 1, 8)
+    dates = [start + datetime.timedelta(days=8 * i) for i in range(30)]
+    return lambda: can_apply_bulk_discount(dates)
+
+
+@benchmark("from_unique_code")
+def bench_from_unique_code(ctx: Context):
+    codes = [s.unique_code() for s in ctx.upcoming[:50]]
+
+    def run():
+        for code in codes:
+            Session.from_unique_code(code)
+
+    return run
+
+
+@benchmark("get_facility_attendance")
+def bench_attendance(ctx: Context):
+    session = ctx.busiest_session
+
+    def run():
+        get_facility_attendance(session)
+        # Don't let the identity map answer the next call.
+        db.session.expire_all()
+
+    return run
+
+
+@benchmark("checkout")
+def bench_checkout(ctx: Context):
+    # A basket of 5 sessions at different times.
+    basket = []
+    for s in ctx.upcoming:
+        if all(s.start_time != b.start_time for b in basket):
+            basket.append(s)
+        if len(basket) == 5:
+            break
+    codes = [s.unique_code() for s in basket]
+
+    ctx.app.test_client_class = FlaskLoginClient
+    client = ctx.app.test_client(user=ctx.customer)
+    with client.session_transaction() as session:
+        session["booked_sessions"] = codes
+
+    def run():
+        response = client.get("/customer/checkout")
+        assert response.status_code == 200, response.status
+
+    return run
+
+
+def measure(function, min_time: float, min_rounds: int, max_rounds: int) -> "dict":
+    """
+    Calls function until it has run at least min_rounds times and for min_time seconds.
+    Returns the timings in milliseconds.
+    """
+    function()  # Warm up caches.
+    times = []
+    total = 0.0
+    while len(times) < max_rounds and (len(times) < min_rounds or total < min_time):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+
+    times = [t * 1000 for t in times]
+    return {
+        "rounds": len(times),
+        "min_ms": min(times),
+        "median_ms": statistics.median(times),
+        "mean_ms": statistics.fmean(times),
+        "p95_ms": statistics.quantiles(times, n=20)[-1] if len(times) > 1 else times[0],
+    }
+
+
+def compare(results: "dict", baseline: "dict", threshold: float) -> bool:
+    """
+    Prints each benchmark's change from the baseline.
+    The fastest round is compared as it is the least affected by other processes.
+    Returns False if any are slower by more than threshold (e.g 0.2 for 20%).
+    """
+    ok = True
+    print(f"\n{'min ms':<38}{'baseline':>12}{'now':>12}{'change':>10}")
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            print(f"{name:<38}{'-':>12}{result['min_ms']:>12.3f}{'new':>10}")
+            continue
+        before = baseline["benchmarks"][name]["min_ms"]
+        change = result["min_ms"] / before - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            ok = False
+        print(
+            f"{name:<38}{before:>12.3f}{result['min_ms']:>12.3f}{change:>+10.1%}{flag}"
+        )
+    return ok
+
+
+def main(argv: "list[str]" = None) -> bool:
+    """
+    Runs the benchmarks with the given command line arguments.
+    Returns False if a benchmark is slower than the baseline.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--months", type=float, default=1, help="Months of bookings")
+    parser.add_argument(
+        "--database-url", help="Benchmark against this (empty) db instead of SQLite"
+    )
+    parser.add_argument("--only", help="Comma seperated benchmarks to run")
+    parser.add_argument("--min-time", type=float, default=1.0)
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Save the results as JSON")
+    parser.add_argument("--compare", help="JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks {unknown}, choose from {list(BENCHMARKS)}")
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    test_database_url = os.environ.get("TEST_DATABASE_URL")
+    os.environ["TEST_DATABASE_URL"] = args.database_url or f"sqlite:///{path}"
+    try:
+        app = create_app(testing=True)
+    finally:
+        if test_database_url is None:
+            del os.environ["TEST_DATABASE_URL"]
+        else:
+            os.environ["TEST_DATABASE_URL"] = test_database_url
+    app.config.update({"TESTING": True, "WTF_CSRF_ENABLED": False})
+    rng = random.Random(args.seed)
+
+    results = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "members": args.members,
+            "months": args.months,
+        },
+        "benchmarks": {},
+    }
+
+    with app.app_context():
+        results["meta"]["database"] = db.engine.dialect.name
+        db.drop_all()
+        start = time.perf_counter()
+        seed(args.members, args.months, args.seed)
+        print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+        ctx = Context(app, rng)
+        print(f"{'benchmark':<38}{'rounds':>8}{'median ms':>12}{'p95 ms':>10}")
+        for name in names:
+            function = BENCHMARKS[name](ctx)
+            # Session.from_unique_code prints each code.
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = measure(
+                    function, args.min_time, args.min_rounds, args.max_rounds
+                )
+            results["benchmarks"][name] = result
+            print(
+                f"{name:<38}{result['rounds']:>8}{result['median_ms']:>12.3f}{result['p95_ms']:>10.3f}"
+            )
+
+        if args.database_url:
+            db.drop_all()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        return compare(results, baseline, args.threshold)
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
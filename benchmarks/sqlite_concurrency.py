@@ -0,0 +1,201 @@
+"""
+Concurrency benchmark for the SQLite settings in app/db_config.py
+
+Runs calendar reads alongside booking writes against a temporary db,
+first with SQLite's default settings and then with the tuned settings from config.py.
+Each reader and writer is a seperate process, like app workers sharing one db file.
+
+Usage:
+    python benchmarks/sqlite_concurrency.py --readers 8 --writers 2 --seconds 10
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import multiprocessing
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from app import db, add_facilities, add_activities  # noqa: E402
+from app.datagen import generate  # noqa: E402
+from app.db_config import configure_db, register_sqlite_pragmas  # noqa: E402
+from app.models import Activity, Days, Session, User  # noqa: E402
+from app.booking_utils import get_facility_attendance  # noqa: E402
+
+# What a fresh SQLite connection does without any tuning.
+UNTUNED = {
+    "SQLITE_JOURNAL_MODE": "DELETE",
+    "SQLITE_SYNCHRONOUS": "FULL",
+    "SQLITE_MMAP_SIZE": 0,
+    "SQLITE_BUSY_TIMEOUT": 5000,
+}
+
+TUNED = {}  # Use the defaults from db_config.py
+
+
+def make_app(path, settings):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    app.config.update(settings)
+    configure_db(app)
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            register_sqlite_pragmas(engine, app.config)
+    return app
+
+
+def seed(app, users):
+    with app.app_context():
+        db.create_all()
+        add_facilities(db)
+        add_activities(db)
+        generate(users, months=1, seed=0)
+
+
+def calendar_read(day: datetime.date):
+    """
+    The queries behind showing a day's activities with their current attendance.
+    """
+    activities = (
+        db.session.execute(select(Activity).where(Activity.day == Days(day.weekday())))
+        .scalars()
+        .all()
+    )
+    for act in activities[:5]:
+        slot = Session(
+            facility_id=act.facility_id,
+            start_time=datetime.datetime.combine(day, act.start_time),
+            end_time=datetime.datetime.combine(day, act.start_time)
+            + datetime.timedelta(hours=1),
+        )
+        get_facility_attendance(slot)
+    db.session.rollback()
+
+
+def booking_write(day: datetime.date, users: int):
+    """
+    The writes behind a booking being paid for, see auth.booking_success
+    """
+    activity = random.choice(
+        db.session.execute(select(Activity).where(Activity.day == Days(day.weekday())))
+        .scalars()
+        .all()
+    )
+    hour = random.randrange(activity.start_time.hour, max(activity.end_time.hour, 1))
+    start = datetime.datetime.combine(day, datetime.time(hour))
+    s = Session(
+        session_type=activity.activity_type,
+        facility_id=activity.facility_id,
+        start_time=start,
+        end_time=start + datetime.timedelta(hours=1),
+        is_class=0,
+    )
+    s.users.append(db.session.get(User, random.randrange(1, users + 1)))
+    db.session.add(s)
+    db.session.commit()
+
+
+def worker(path, settings, kind, seconds, users, results):
+    """
+    Runs reads or writes against the db at path for `seconds`.
+    Puts (kind, latencies, errors) on the results queue when done.
+    """
+    app = make_app(path, settings)
+    day = datetime.date.today()
+    latencies = []
+    errors = 0
+    with app.app_context():
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            try:
+                if kind == "read":
+                    calendar_read(day)
+                else:
+                    booking_write(day, users)
+                latencies.append(time.perf_counter() - start)
+            except OperationalError:
+                # 'database is locked'
+                db.session.rollback()
+                errors += 1
+        db.session.remove()
+    results.put((kind, latencies, errors))
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    return (
+        statistics.quantiles(values, n=100)[pct - 1] if len(values) > 1 else values[0]
+    )
+
+
+def run(name, settings, args):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "bench.db")
+    seed(make_app(path, settings), args.users)
+
+    results = multiprocessing.Queue()
+    kinds = ["read"] * args.readers + ["write"] * args.writers
+    processes = [
+        multiprocessing.Process(
+            target=worker,
+            args=(path, settings, kind, args.seconds, args.users, results),
+        )
+        for kind in kinds
+    ]
+    for p in processes:
+        p.start()
+
+    latencies = {"read": [], "write": []}
+    errors = 0
+    for _ in processes:
+        kind, times, errs = results.get()
+        latencies[kind] += times
+        errors += errs
+    for p in processes:
+        p.join()
+
+    return {
+        "name": name,
+        "reads_per_second": len(latencies["read"]) / args.seconds,
+        "writes_per_second": len(latencies["write"]) / args.seconds,
+        "read_p50_ms": percentile(latencies["read"], 50) * 1000,
+        "read_p99_ms": percentile(latencies["read"], 99) * 1000,
+        "write_p50_ms": percentile(latencies["write"], 50) * 1000,
+        "write_p99_ms": percentile(latencies["write"], 99) * 1000,
+        "locked_errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--users", type=int, default=500)
+    args = parser.parse_args()
+
+    results = [run("untuned", UNTUNED, args), run("tuned", TUNED, args)]
+
+    columns = list(results[0].keys())
+    print("".join(f"{col:>18}" for col in columns))
+    for result in results:
+        print(
+            "".join(
+                f"{value:>18.1f}" if isinstance(value, float) else f"{value:>18}"
+                for value in result.values()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Startup time report.
+
+Starts a fresh interpreter --runs times, each importing the app and calling
+create_app(), and prints how long that took. Then prints the packages that took the
+longest to import in one more run with python -X importtime, adding up the time
+spent in each of their modules.
+
+Usage:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 20 --top 30 --output startup.json
+"""
+import argparse
+import collections
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Prints the seconds taken to import the app and create it.
+TIMED_STARTUP = """
+import time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app(testing=True)
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def start_app(code: str, *options: str) -> subprocess.CompletedProcess:
+    # testing=True so SECRET_KEY doesn't need to be set.
+    return subprocess.run(
+        [sys.executable, *options, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def parse_importtime(output: str) -> "list[dict]":
+    """
+    Parses the stderr of python -X importtime.
+    Returns a dict for each module with its self and cumulative microseconds, and
+    its depth in the tree of imports (0 for modules imported by the code run).
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append(
+            {
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+            }
+        )
+    return modules
+
+
+def main(argv: "list[str]" = None) -> "dict":
+    """
+    Runs the report with the given command line arguments and returns its results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=20, help="Imports to show")
+    parser.add_argument("--output", help="Save the results as JSON")
+    args = parser.parse_args(argv)
+
+    imports, creates = [], []
+    for _ in range(args.runs):
+        imported, created = start_app(TIMED_STARTUP).stdout.split()
+        imports.append(float(imported) * 1000)
+        creates.append(float(created) * 1000)
+    totals = [i + c for i, c in zip(imports, creates)]
+
+    print(f"{'startup ms':<24}{'min':>10}{'median':>10}{'max':>10}")
+    for name, times in [
+        ("import app", imports),
+        ("create_app()", creates),
+        ("total", totals),
+    ]:
+        print(
+            f"{name:<24}{min(times):>10.1f}{statistics.median(times):>10.1f}{max(times):>10.1f}"
+        )
+
+    modules = parse_importtime(start_app(TIMED_STARTUP, "-X", "importtime").stderr)
+    packages = collections.defaultdict(lambda: {"modules": 0, "self_us": 0})
+    for module in modules:
+        package = packages[module["module"].split(".")[0]]
+        package["modules"] += 1
+        package["self_us"] += module["self_us"]
+    slowest = sorted(packages.items(), key=lambda p: p[1]["self_us"], reverse=True)
+
+    print(f"\n{'slowest packages':<32}{'modules':>10}{'ms':>10}")
+    for name, package in slowest[: args.top]:
+        print(f"{name:<32}{package['modules']:>10}{package['self_us'] / 1000:>10.1f}")
+
+    results = {
+        "runs": args.runs,
+        "import_ms": statistics.median(imports),
+        "create_app_ms": statistics.median(creates),
+        "total_ms": statistics.median(totals),
+        "packages": dict(slowest),
+        "modules": modules,
+        "loaded_lazily": {
+            name: not any(m["module"] == name for m in modules)
+            for name in ("stripe", "sqlalchemy.dialects.postgresql")
+        },
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import pytest
+import loadtest
+import run
+
+
+def test_benchmarks(request):
+    """
+    GIVEN the --benchmark option
+    WHEN the benchmarks are run against a seeded db
+    THEN check that none of them are slower than the baseline, if one is given
+    """
+    if not request.config.getoption("--benchmark", default=False):
+        pytest.skip("Run with --benchmark")
+
+    argv = []
+    for option in ("compare", "output"):
+        path = request.config.getoption(f"--benchmark-{option}", default=None)
+        if path:
+            argv += [f"--{option}", path]
+
+    assert run.main(argv), "Slower than the baseline"
+
+
+def test_load_test(request):
+    """
+    GIVEN the --benchmark option
+    WHEN a short load test is run
+    THEN check that every role finished journeys without any failed requests
+    """
+    if not request.config.getoption("--benchmark", default=False):
+        pytest.skip("Run with --benchmark")
+
+    summary = loadtest.main(
+        ["--duration", "5", "--members", "200", "--gateway-latency", "0"]
+    )
+    assert set(summary["journeys"]) == {"customer", "employee", "admin"}
+    assert not any(step["errors"] for step in summary["steps"].values())
@@ -30,5 +30,7 @@ echo "setting up stripe..."
 stripe login -i
 stripe listen --forward-to localhost:5000/auth/webhook &
 echo "stripe listening on localhost:5000/auth/webhook"
+echo "Setting up the db..."
+flask --app main init-db
 echo "Running App"
 python3 main.py
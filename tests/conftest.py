@@ -3,6 +3,7 @@ from app import create_app, db, hasher
 from app.models import Roles, Session, Activities, Facilities
 import datetime
 from flask_login import FlaskLoginClient
+from sqlalchemy import text
 
 
 # Pytest for flask setup from https://flask.palletsprojects.com/en/2.2.x/testing/
@@ -68,3 +69,14 @@ def init_test_db():
     db.session.add(user2)
     db.session.add(s1)
     db.session.commit()
+
+    # Setting the ids by hand doesn't move PostgreSQL's sequences on past them.
+    if db.engine.dialect.name == "postgresql":
+        for table, column in (("user", "user_id"), ("session", "session_id")):
+            db.session.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table}\"', '{column}'), "
+                    f'(SELECT max({column}) FROM "{table}"))'
+                )
+            )
+        db.session.commit()
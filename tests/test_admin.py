@@ -0,0 +1,480 @@
+from app.models import Roles
+from app.utils import create_user
+from app.admin.admin_utils import admin_tables
+from app.slow_queries import (
+    init_slow_query_log,
+    read_slow_queries,
+    stop_slow_query_log,
+)
+from app.profiler import SamplingProfiler
+from app.timetable import IntervalGroup, find_overlaps
+from app.models import Activities, Activity, Days, Facilities, Session, User
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import DBAPIError
+import datetime
+import io
+import threading
+from app import db, add_facilities, add_activities
+import json
+import pytest
+
+
+@pytest.fixture()
+def admin_client(login_client):
+    admin = create_user("admin@mail.com", "admin", "hashed_password", Roles.ADMIN)
+    with login_client(user=admin) as client:
+        yield client
+
+
+def test_export_members_csv(admin_client):
+    """
+    GIVEN an admin user
+    WHEN the members table is exported as CSV
+    THEN check that only customers are included, with a header row
+    """
+    response = admin_client.get("/admin/export/members?format=csv")
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == "id,username,email,stripe_id"
+    assert len(lines) == 3
+    assert "admin" not in response.get_data(as_text=True)
+
+
+def test_export_ndjson_column_selection(admin_client):
+    """
+    GIVEN an admin user and a selection of columns
+    WHEN the employees table is exported as NDJSON
+    THEN check that each line is a JSON object with only the selected columns
+    """
+    response = admin_client.get(
+        "/admin/export/employees?format=ndjson&columns=username,role"
+    )
+    assert response.status_code == 200
+
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert rows == [{"username": "admin", "role": "ADMIN"}]
+
+
+@pytest.mark.parametrize(
+    "url",
+    (
+        "/admin/export/members?columns=password",  # Not an exportable column
+        "/admin/export/members?format=xml",  # Unknown format
+        "/admin/export/sessions",  # Unknown table
+    ),
+)
+def test_export_invalid_request(admin_client, url):
+    """
+    GIVEN an invalid export request
+    WHEN a response is returned
+    THEN check that the admin is redirected instead of being sent data
+    """
+    assert admin_client.get(url).status_code == 302
+
+
+def add_members(count):
+    for i in range(count):
+        create_user(f"member{i}@mail.com", f"member{i:02}", "hashed_password")
+
+
+def test_listing_keyset_pages(admin_client):
+    """
+    GIVEN more members than fit on one page
+    WHEN every page is followed using the next and previous cursors
+    THEN check that each member is shown exactly once, in order
+    """
+    add_members(30)
+    table = admin_tables["members"]
+
+    page = table.page({"sort": "username", "per_page": "10"})
+    assert page.prev_cursor is None
+    seen = [row["username"] for row in page.rows]
+    while page.next_cursor:
+        page = table.page(
+            {"sort": "username", "per_page": "10", "after": page.next_cursor}
+        )
+        seen += [row["username"] for row in page.rows]
+
+    assert seen == sorted(seen)
+    assert len(seen) == len(set(seen)) == 32
+
+    # Walk back one page from the last one
+    previous = table.page(
+        {"sort": "username", "per_page": "10", "before": page.prev_cursor}
+    )
+    assert [row["username"] for row in previous.rows] == seen[20:30]
+
+
+def test_listing_sort_and_filter(admin_client):
+    """
+    GIVEN a sort direction and a filter
+    WHEN a page of the members listing is requested
+    THEN check that only matching members are returned in the right order
+    """
+    add_members(15)
+    page = admin_tables["members"].page(
+        {"sort": "username", "direction": "desc", "username": "member1"}
+    )
+    usernames = [row["username"] for row in page.rows]
+    assert usernames == sorted(usernames, reverse=True)
+    assert usernames[0] == "member14"
+    assert all(name.startswith("member1") for name in usernames)
+
+    response = admin_client.get("/admin/members?username=member0&per_page=5")
+    assert response.status_code == 200
+    assert "member04" in response.get_data(as_text=True)
+    assert "member05" not in response.get_data(as_text=True)
+
+
+def test_activities_not_sorted_by_day(admin_client):
+    """
+    GIVEN the activities listing
+    WHEN it is sorted by day, which is stored by name
+    THEN check it is sorted by id instead of alphabetically by day name
+    """
+    add_facilities(db)
+    add_activities(db)
+    page = admin_tables["activities"].page({"sort": "day"})
+    assert page.sort == "id"
+    ids = [row["id"] for row in page.rows]
+    assert ids == sorted(ids)
+
+
+def test_request_metrics(admin_client):
+    """
+    GIVEN an admin user and a few requests to the app
+    WHEN the metrics page is viewed
+    THEN check that each endpoint's requests and queries have been recorded
+    """
+    admin_client.application.config["PERF_HEADERS"] = True
+    response = admin_client.get("/admin/members")
+    assert int(response.headers["X-SQL-Queries"]) >= 1
+    assert response.headers["Server-Timing"].startswith("app;dur=")
+    admin_client.get("/admin/members")
+
+    stats = admin_client.application.extensions["request_stats"].summary()
+    members = next(row for row in stats if row["endpoint"] == "admin.members")
+    assert members["count"] == 2
+    assert members["avg_queries"] >= 1
+    assert members["avg_template_ms"] > 0
+
+    response = admin_client.get("/admin/metrics")
+    assert response.status_code == 200
+    assert b"admin.members" in response.data
+
+
+def test_slow_query_log(app, admin_client, tmp_path):
+    """
+    GIVEN the slow query log with a threshold of 0ms
+    WHEN a page that queries the db is requested
+    THEN check that its queries are logged with the view and query plan, without
+    the parameter values, and only to the latest log file
+    """
+    old_log = str(tmp_path / "old.log")
+    log = str(tmp_path / "slow_queries.log")
+    app.config.update({"SLOW_QUERY_THRESHOLD_MS": 0, "SLOW_QUERY_LOG": old_log})
+    init_slow_query_log(app, db.engines.values())
+    app.config["SLOW_QUERY_LOG"] = log
+    init_slow_query_log(app, db.engines.values())
+    old_entries = len(read_slow_queries(old_log))
+
+    admin_client.get("/admin/members?email=secret@mail.com")
+
+    entries = read_slow_queries(log)
+    members = [e for e in entries if e["view"] == "app.admin.views.members"]
+    assert members
+    assert members[0]["url"] == "GET /admin/members"
+    assert "user" in members[0]["statement"]
+    if db.engine.dialect.name == "sqlite":
+        assert members[0]["plan"]
+    assert "secret" not in json.dumps(entries)
+    assert len(read_slow_queries(old_log)) == old_entries
+
+    response = admin_client.get("/admin/slow-queries")
+    assert response.status_code == 200
+    assert b"app.admin.views.members" in response.data
+    stop_slow_query_log(app)
+
+
+def test_query_timers_after_error(app, tmp_path):
+    """
+    GIVEN the request instrumentation and slow query log are timing queries
+    WHEN a statement fails
+    THEN check its start time isn't left on the connection
+    """
+    app.config.update(
+        {"SLOW_QUERY_THRESHOLD_MS": 0, "SLOW_QUERY_LOG": str(tmp_path / "slow.log")}
+    )
+    init_slow_query_log(app, db.engines.values())
+    connection = db.session.connection()
+    info = connection.info
+
+    with pytest.raises(DBAPIError):
+        connection.execute(text("SELECT * FROM no_such_table"))
+    db.session.rollback()
+
+    assert info.get("query_start") == []
+    assert info.get("slow_query_start") == []
+    stop_slow_query_log(app)
+
+
+def test_sampling_profiler(tmp_path):
+    """
+    GIVEN a profiler sampling one endpoint
+    WHEN a thread serving that endpoint is sampled
+    THEN check that its stack is written as a collapsed stack
+    """
+    profiler = SamplingProfiler(str(tmp_path))
+    profiler.start(["customer.get_sessions"], rate=1)
+    serving = threading.Event()
+    done = threading.Event()
+
+    def get_sessions():
+        profiler.request_started("customer.get_sessions")
+        serving.set()
+        done.wait()
+        profiler.request_finished()
+
+    thread = threading.Thread(target=get_sessions)
+    thread.start()
+    serving.wait()
+    # Not profiled, so ignored.
+    profiler.request_started("customer.checkout")
+    profiler.sample()
+    done.set()
+    thread.join()
+    profiler.stop()
+
+    [name] = profiler.files()
+    assert name.startswith("customer.get_sessions-")
+    stack, count = (tmp_path / name).read_text().strip().rsplit(" ", 1)
+    assert count == "1"
+    assert "test_sampling_profiler.<locals>.get_sessions;threading:Event.wait" in stack
+
+
+def test_profiler_admin(app, admin_client):
+    """
+    GIVEN an admin user
+    WHEN the profiler is started and stopped from the admin area
+    THEN check that it only accepts known endpoints and finite sample rates
+    """
+    profiler = app.extensions["profiler"]
+
+    admin_client.post("/admin/profiler", data={"endpoints": "customer.nope"})
+    assert not profiler.running
+    for rate in ["nan", "inf"]:
+        admin_client.post(
+            "/admin/profiler",
+            data={"endpoints": "customer.get_sessions", "rate": rate},
+        )
+        assert not profiler.running
+
+    admin_client.post(
+        "/admin/profiler",
+        data={"endpoints": "customer.get_sessions, customer.checkout", "rate": "50"},
+    )
+    assert profiler.running
+    assert profiler.endpoints == {"customer.get_sessions", "customer.checkout"}
+    assert b"Sampling customer.checkout" in admin_client.get("/admin/profiler").data
+
+    admin_client.post("/admin/profiler", data={"action": "stop"})
+    assert not profiler.running
+
+
+def test_find_overlaps():
+    """
+    GIVEN activities where a short one sits inside a long one
+    WHEN they are checked for overlaps
+    THEN check every activity that starts before an earlier one ends is found
+    """
+    rows = [
+        {"start_time": datetime.time(s), "end_time": datetime.time(e), "name": name}
+        for name, s, e in [("C", 11, 12), ("A", 8, 20), ("B", 9, 10), ("D", 20, 21)]
+    ]
+    assert [(a["name"], b["name"]) for a, b in find_overlaps(rows)] == [
+        ("A", "B"),
+        ("A", "C"),
+    ]
+
+
+def test_timetable_export_import(admin_client):
+    """
+    GIVEN the default timetable
+    WHEN it is exported as CSV and JSON and imported again
+    THEN check both exports import without changing anything
+    """
+    add_facilities(db)
+    add_activities(db)
+
+    for file_format in ["csv", "json"]:
+        exported = admin_client.get(f"/admin/timetable/export?format={file_format}")
+        assert exported.status_code == 200
+        if file_format == "csv":
+            assert b"POOL,MON,LANESWIM,08:00,20:00" in exported.data
+
+        response = admin_client.post(
+            "/admin/timetable",
+            data={"file": (io.BytesIO(exported.data), f"timetable.{file_format}")},
+            follow_redirects=True,
+        )
+        assert b"0 activities added, 0 updated, 0 deleted" in response.data
+
+
+def test_timetable_import_validation(admin_client):
+    """
+    GIVEN the default timetable
+    WHEN CSV files with overlapping or out of hours activities are imported
+    THEN check nothing is changed and each problem is shown, and a valid file is applied
+    """
+    add_facilities(db)
+    add_activities(db)
+
+    def count(*criteria):
+        return db.session.execute(
+            select(func.count()).select_from(Activity).where(*criteria)
+        ).scalar()
+
+    total = count()
+
+    def upload(text, replace=False):
+        data = {"file": (io.BytesIO(text.encode()), "timetable.csv")}
+        if replace:
+            data["replace"] = "y"
+        return admin_client.post("/admin/timetable", data=data, follow_redirects=True)
+
+    response = upload(
+        "facility,day,activity,start,end\n"
+        "STUDIO,WED,YOGA,12:00,13:00\n"
+        "STUDIO,WED,YOGA,12:30,13:30\n"
+        "STUDIO,WED,PILATES,07:00,09:00\n"
+        "POOL,MON,LANESWIM,09:00,10:00\n"
+        "POOL,MON,SNORKELLING,09:00,10:00\n"
+    )
+    assert b"Line 6: invalid value" in response.data
+    assert count() == total
+
+    response = upload(
+        "facility,day,activity,start,end\n"
+        "STUDIO,WED,YOGA,12:00,13:00\n"
+        "STUDIO,WED,YOGA,12:30,13:30\n"
+        "STUDIO,WED,PILATES,07:00,09:00\n"
+        "POOL,MON,LANESWIM,09:00,10:00\n"
+    )
+    assert b"Nothing was imported" in response.data
+    assert b"YOGA in STUDIO on WED 12:30-13:30 overlaps YOGA" in response.data
+    assert (
+        b"PILATES in STUDIO on WED 07:00-09:00 is outside the opening" in response.data
+    )
+    assert b"LANESWIM in POOL on MON 09:00-10:00 overlaps LANESWIM" in response.data
+    assert count() == total
+
+    # Replaces the studio's timetable, the other facilities are left alone.
+    response = upload(
+        "facility,day,activity,start,end\n"
+        "STUDIO,WED,YOGA,12:00,13:00\n"
+        "STUDIO,WED,PILATES,13:00,14:00\n",
+        replace=True,
+    )
+    assert b"2 activities added, 0 updated" in response.data
+    assert count(Activity.facility_id == Facilities.STUDIO) == 2
+    assert (
+        count(Activity.day == Days.WED, Activity.facility_id == Facilities.STUDIO) == 2
+    )
+    assert count(Activity.facility_id != Facilities.STUDIO) < total
+
+
+def test_interval_group():
+    """
+    GIVEN the activities of one type in a facility on one day
+    WHEN times are checked against them
+    THEN check overlaps and cover are found, leaving out the activity being edited
+    """
+    t = datetime.time
+    group = IntervalGroup([(t(12), t(13), 2), (t(8), t(20), 1), (t(9), t(10), 3)])
+
+    assert group.overlapping(t(6), t(8)) is None
+    assert group.overlapping(t(19), t(21)) == 1
+    assert group.overlapping(t(19), t(21), exclude=1) is None
+    assert group.overlapping(t(12), t(14), exclude=1) == 2
+    assert group.covers(t(9), t(10), exclude=1)
+    assert not group.covers(t(10), t(11), exclude=1)
+    assert not IntervalGroup([]).covers(t(9), t(10))
+
+
+def test_edit_activity(admin_client):
+    """
+    GIVEN the default timetable and a session booked for lane swimming at 8am next Monday
+    WHEN activities are edited to overlap another, to be outside opening hours,
+    and to start after the booked session
+    THEN check only the last edit is saved and the booked session is reported
+    """
+    add_facilities(db)
+    add_activities(db)
+
+    def find(facility_id, activity_type, day):
+        return db.session.execute(
+            select(Activity)
+            .where(Activity.facility_id == facility_id)
+            .where(Activity.activity_type == activity_type)
+            .where(Activity.day == day)
+        ).scalar()
+
+    def edit(activity, **changes):
+        data = {
+            "activity_id": activity.activity_id,
+            "activity_type": activity.activity_type.value,
+            "facility_id": activity.facility_id.value,
+            "day": activity.day.value,
+            "start_time": activity.start_time.strftime("%H:%M"),
+            "end_time": activity.end_time.strftime("%H:%M"),
+        }
+        data.update(changes)
+        return admin_client.post(
+            f"/admin/activities/edit/{activity.activity_id}",
+            data=data,
+            follow_redirects=True,
+        )
+
+    today = datetime.date.today()
+    monday = today + datetime.timedelta(days=7 - today.weekday())
+    start = datetime.datetime.combine(monday, datetime.time(8))
+    session = Session(
+        session_type=Activities.LANESWIM,
+        facility_id=Facilities.POOL,
+        start_time=start,
+        end_time=start + datetime.timedelta(hours=1),
+        is_class=0,
+    )
+    session.users.append(db.session.get(User, 100))
+    db.session.add(session)
+    db.session.commit()
+
+    team = find(Facilities.POOL, Activities.TEAM, Days.FRI)
+    lanes = find(Facilities.POOL, Activities.LANESWIM, Days.MON)
+
+    response = edit(
+        team,
+        activity_type=Activities.LANESWIM.value,
+        day=Days.MON.value,
+        start_time="08:00",
+        end_time="09:00",
+    )
+    assert f"overlaps activity {lanes.activity_id}".encode() in response.data
+
+    response = edit(lanes, start_time="07:00")
+    assert b"is outside the opening hours 08:00-20:00" in response.data
+
+    db.session.expire_all()
+    assert (team.day, team.activity_type) == (Days.FRI, Activities.TEAM)
+    assert lanes.start_time == datetime.time(8)
+
+    response = edit(lanes, start_time="09:00")
+    assert b"Updated" in response.data
+    assert b"1 booked sessions are no longer within the activity&#39;s hours" in (
+        response.data
+    )
+    assert f"{start:%d/%m/%Y %H:%M}-09:00".encode() in response.data
+    db.session.expire_all()
+    assert lanes.start_time == datetime.time(9)
@@ -0,0 +1,145 @@
+from app.models import (
+    Activities,
+    ArchivedSession,
+    Facilities,
+    Session,
+    User,
+    archived_user_session_m2m,
+)
+from app.archive import archive_sessions, history_page
+from app import db
+from sqlalchemy import func, select
+import datetime
+
+
+def add_past_sessions(days: "list[int]") -> None:
+    """
+    Adds a session booked by users 100 and 101 on each of days ago.
+    """
+    users = [User.get_by_id(100), User.get_by_id(101)]
+    for i, days_ago in enumerate(days):
+        start = datetime.datetime.now().replace(
+            minute=0, second=0, microsecond=0
+        ) - datetime.timedelta(days=days_ago)
+        session = Session(
+            session_id=i + 1,
+            session_type=Activities.GENERAL,
+            facility_id=Facilities.FITNESS,
+            start_time=start,
+            end_time=start + datetime.timedelta(hours=1),
+            is_class=0,
+        )
+        session.users += users
+        db.session.add(session)
+    db.session.commit()
+
+
+def test_archive_sessions(app):
+    """
+    GIVEN sessions that ended 200, 150, 100 and 10 days ago
+    WHEN sessions over 90 days old are archived 2 at a time
+    THEN check the 3 old sessions and their bookings are moved to the archive tables
+    """
+    add_past_sessions([200, 150, 100, 10])
+    before = datetime.datetime.now() - datetime.timedelta(days=90)
+
+    counts = archive_sessions(before, batch_size=2)
+
+    assert counts == {"sessions": 3, "bookings": 6}
+    assert set(db.session.execute(select(Session.session_id)).scalars()) == {4, 100}
+    archived = db.session.execute(select(ArchivedSession)).scalars().all()
+    assert sorted(s.session_id for s in archived) == [1, 2, 3]
+    assert all(len(s.users) == 2 for s in archived)
+    assert archive_sessions(before) == {"sessions": 0, "bookings": 0}
+
+    past = history_page(100, past=True, args={})
+    assert [s.session_id for s in past.rows] == [100, 4, 3, 2, 1]
+    assert [s.archived for s in past.rows] == [False, False, True, True, True]
+
+
+def test_archive_newest_session(app):
+    """
+    GIVEN the newest session is old and has been archived
+    WHEN another old session is added and archived
+    THEN check it is given a new id, so it doesn't clash with the archived ones
+    """
+    start = datetime.datetime.now() - datetime.timedelta(days=200)
+    before = datetime.datetime.now() - datetime.timedelta(days=90)
+
+    def add_old_session() -> int:
+        session = Session(
+            session_type=Activities.GENERAL,
+            facility_id=Facilities.FITNESS,
+            start_time=start,
+            end_time=start + datetime.timedelta(hours=1),
+            is_class=0,
+        )
+        db.session.add(session)
+        db.session.commit()
+        return session.session_id
+
+    first = add_old_session()
+    assert archive_sessions(before)["sessions"] == 1
+
+    second = add_old_session()
+    assert second != first
+    assert archive_sessions(before)["sessions"] == 1
+    assert set(db.session.execute(select(ArchivedSession.session_id)).scalars()) == {
+        first,
+        second,
+    }
+
+
+def test_manage_sessions_shows_archived(app):
+    """
+    GIVEN a customer with an archived session and an upcoming one
+    WHEN they view their sessions
+    THEN check the archived session is shown with the others
+    """
+    add_past_sessions([200, -2])
+    archive_sessions(datetime.datetime.now() - datetime.timedelta(days=90))
+    assert (
+        db.session.execute(
+            select(func.count()).select_from(archived_user_session_m2m)
+        ).scalar()
+        == 2
+    )
+
+    user = User.get_by_id(100)
+    archived = user.archived_sessions[0]
+    with app.test_client(user=user) as client:
+        response = client.get("/customer/manage_sessions")
+
+    assert response.status_code == 200
+    assert archived.display_date().encode() in response.data
+    # Only upcoming sessions can be deleted.
+    assert b'delete_session/2"' in response.data
+    assert b'delete_session/1"' not in response.data
+    assert b'delete_session/100"' not in response.data
+
+
+def test_history_pages(app):
+    """
+    GIVEN a customer who has booked 25 past sessions and 1 upcoming one
+    WHEN their past sessions are paged through 10 at a time
+    THEN check each is shown once, most recent first, and the upcoming one isn't
+    """
+    add_past_sessions(list(range(1, 26)) + [-1])
+    archive_sessions(datetime.datetime.now() - datetime.timedelta(days=20))
+
+    ids = []
+    args = {"history": "past"}
+    while True:
+        page = history_page(100, past=True, args=args)
+        assert len(page.rows) <= 10
+        assert all(s.expired for s in page.rows)
+        ids += [s.session_id for s in page.rows]
+        if page.next_cursor is None:
+            break
+        args = page.args(after=page.next_cursor)
+    assert ids == [100] + list(range(1, 26))
+
+    # Cursors for the past sessions don't move the upcoming ones.
+    upcoming = history_page(100, past=False, args=args)
+    assert [s.session_id for s in upcoming.rows] == [26]
+    assert upcoming.prev_cursor is None
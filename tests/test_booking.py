@@ -1,5 +1,6 @@
-from app.models import Session, User
-from app import db
+from app.models import Activities, DataVersion, Facilities, Facility, Session, User
+from app import db, add_activities, add_facilities
+import datetime
 from sqlalchemy import select
 
 
@@ -26,3 +27,150 @@ def test_cancel_session(login_client):
         ).scalar()
         assert session is not None
         assert session.users[0].user_id == 101
+
+
+def test_get_sessions_etag(login_client):
+    """
+    GIVEN a customer who has fetched a day's sessions
+    WHEN they fetch it again with the ETag, before and after a booking changes
+    THEN check it is a 304 until their bookings change, then the full response
+    """
+    user = db.session.execute(select(User).where(User.user_id == 100)).scalar()
+    url = "/customer/get_sessions/2030-01-07-general"
+
+    with login_client(user=user) as client:
+        r = client.get(url)
+        assert r.status_code == 200
+        assert r.headers["Cache-Control"] == "private, no-cache"
+        etag = r.headers["ETag"]
+
+        r = client.get(url, headers={"If-None-Match": etag})
+        assert r.status_code == 304
+        assert r.headers["ETag"] == etag
+        assert r.data == b""
+
+        # Each day and type has its own ETag.
+        r = client.get(
+            "/customer/get_sessions/2030-01-07-class", headers={"If-None-Match": etag}
+        )
+        assert r.status_code == 200
+
+        client.post("customer/delete_session/100")
+        r = client.get(url, headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert r.headers["ETag"] != etag
+
+
+def test_get_sessions_etag_per_day(login_client):
+    """
+    GIVEN a customer who has fetched the sessions for today and a later day
+    WHEN another customer cancels a booking today
+    THEN check only today's ETag changes
+    """
+    user = db.session.execute(select(User).where(User.user_id == 100)).scalar()
+    today = f"/customer/get_sessions/{datetime.date.today()}-general"
+    later = "/customer/get_sessions/2030-01-07-general"
+
+    with login_client(user=user) as client:
+        etags = {url: client.get(url).headers["ETag"] for url in (today, later)}
+
+        session = db.session.get(Session, 100)
+        session.users.remove(db.session.get(User, 101))
+        db.session.commit()
+
+        assert (
+            client.get(later, headers={"If-None-Match": etags[later]}).status_code
+            == 304
+        )
+        r = client.get(today, headers={"If-None-Match": etags[today]})
+        assert r.status_code == 200
+
+    names = set(db.session.execute(select(DataVersion.name)).scalars())
+    assert f"occupancy:main:{session.start_time.date()}" in names
+    assert not any(name.endswith("2030-01-07") for name in names)
+
+
+def test_get_sessions_columnar(login_client):
+    """
+    GIVEN a customer with a booking today
+    WHEN they fetch today's sessions in the columnar format
+    THEN check the same sessions can be rebuilt from it as the default format lists
+    """
+    add_facilities(db)
+    add_activities(db)
+    user = db.session.execute(select(User).where(User.user_id == 100)).scalar()
+    date = datetime.date.today()
+    url = f"/customer/get_sessions/{date}-all"
+
+    with login_client(user=user) as client:
+        full = client.get(url).json
+        compact = client.get(url + "?format=columnar")
+        assert compact.status_code == 200
+        assert len(compact.data) < len(client.get(url).data) / 3
+
+        data = compact.json
+        col = {name: i for i, name in enumerate(data["columns"])}
+        assert data["date"] == date.isoformat()
+        assert len(data["rows"]) == len(full)
+        for row, activity in zip(data["rows"], full):
+            assert row[col["activity"]] == activity["activity"]
+            codes = [
+                Session(
+                    session_type=Activities(row[col["session_type"]]),
+                    facility_id=Facilities(row[col["facility_id"]]),
+                    start_time=datetime.datetime.combine(date, datetime.time(hour)),
+                    end_time=datetime.datetime.combine(
+                        date, datetime.time(hour + row[col["length"]])
+                    ),
+                ).unique_code()
+                for hour in row[col["starts"]]
+            ]
+            assert codes == [s["session_code"] for s in activity["sessions"]]
+
+
+def test_get_sessions_remaining_capacity(login_client):
+    """
+    GIVEN a squash court with space for 1, booked by another customer at 10:00
+    WHEN a customer fetches that day's sessions, with and without hide_full
+    THEN check each session has the places left, and the full one can be hidden
+    """
+    add_facilities(db)
+    add_activities(db)
+    squash = db.session.execute(
+        select(Facility).where(Facility.facility_id == Facilities.SQUASH)
+    ).scalar()
+    squash.max_capacity = 1
+    booked = Session(
+        session_type=Activities.GENERAL,
+        facility_id=Facilities.SQUASH,
+        start_time=datetime.datetime(2030, 1, 7, 10),
+        end_time=datetime.datetime(2030, 1, 7, 11),
+        is_class=0,
+    )
+    booked.users.append(db.session.get(User, 101))
+    db.session.add(booked)
+    db.session.commit()
+    user = db.session.get(User, 100)
+
+    def squash_sessions(response):
+        for activity in response.json:
+            if activity["facility"] == "Squash Courts":
+                return {
+                    s["start_time"][11:16]: s["remaining"] for s in activity["sessions"]
+                }
+
+    with login_client(user=user) as client:
+        url = "/customer/get_sessions/2030-01-07-general"
+        sessions = squash_sessions(client.get(url))
+        assert sessions["10:00"] == 0
+        assert sessions["11:00"] == 1
+
+        sessions = squash_sessions(client.get(url + "?hide_full=1"))
+        assert "10:00" not in sessions
+        assert sessions["11:00"] == 1
+
+        data = client.get(url + "?format=columnar&hide_full=1").json
+        col = {name: i for i, name in enumerate(data["columns"])}
+        row = next(r for r in data["rows"] if r[col["facility"]] == "Squash Courts")
+        assert 10 not in row[col["starts"]]
+        assert row[col["remaining"]][row[col["starts"]].index(11)] == 1
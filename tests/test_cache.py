@@ -0,0 +1,86 @@
+from app.cache import LRUCache, fragments
+from app.models import Activity, Activities, Days, User
+from app import db, add_activities, add_facilities
+from sqlalchemy import event, select
+import contextlib
+
+
+@contextlib.contextmanager
+def count_queries():
+    queries = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        yield queries
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+
+
+def test_lru_cache():
+    """
+    GIVEN a full LRUCache
+    WHEN another item is added
+    THEN check the least recently used item is dropped
+    """
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_anonymous_pages_cached(client):
+    """
+    GIVEN a visitor who isn't logged in
+    WHEN they request the public pages for a second time
+    THEN check they are sent without querying the db
+    """
+    for url in ("/", "/facilities", "/pricing"):
+        first = client.get(url)
+        assert first.status_code == 200
+
+        with count_queries() as queries:
+            again = client.get(url)
+        assert again.data == first.data
+        assert queries == []
+
+
+def test_booking_overview_cached(login_client):
+    """
+    GIVEN a customer who has seen the sessions for a day
+    WHEN they look again, before and after the timetable changes
+    THEN check the cached sessions are used until the timetable changes
+    """
+    add_facilities(db)
+    add_activities(db)
+    user = db.session.execute(select(User).where(User.user_id == 100)).scalar()
+    form = {"type": "class", "date": "2030-01-07"}
+
+    with login_client(user=user) as client:
+        first = client.post("/customer/booking", data=form)
+        assert b"places left" in first.data
+        cached = len(fragments)
+
+        again = client.post("/customer/booking", data=form)
+        assert again.data == first.data
+        assert len(fragments) == cached
+
+        # 2030-01-07 is a Monday.
+        pilates = db.session.execute(
+            select(Activity).where(
+                (Activity.activity_type == Activities.PILATES)
+                & (Activity.day == Days.MON)
+            )
+        ).scalar()
+        db.session.delete(pilates)
+        db.session.commit()
+
+        changed = client.post("/customer/booking", data=form)
+        assert changed.data != first.data
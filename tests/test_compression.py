@@ -0,0 +1,68 @@
+from app.compression import send_precompressed
+from app.models import User
+from app import db, add_activities, add_facilities
+from sqlalchemy import select
+import gzip
+import os
+
+
+def test_compress_json(login_client):
+    """
+    GIVEN a customer fetching a day's sessions
+    WHEN their client does or doesn't accept gzip
+    THEN check the JSON is gzipped only when it is accepted
+    """
+    add_facilities(db)
+    add_activities(db)
+    user = db.session.execute(select(User).where(User.user_id == 100)).scalar()
+    url = "/customer/get_sessions/2030-01-07-all"
+
+    with login_client(user=user) as client:
+        plain = client.get(url)
+        assert "Content-Encoding" not in plain.headers
+        assert "Accept-Encoding" in plain.headers["Vary"]
+
+        r = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        assert r.headers["Content-Encoding"] == "gzip"
+        assert int(r.headers["Content-Length"]) < len(plain.data)
+        assert gzip.decompress(r.data) == plain.data
+        assert r.headers["ETag"] == "W/" + plain.headers["ETag"]
+
+
+def test_small_responses_not_compressed(app, client):
+    """
+    GIVEN COMPRESS_MIN_SIZE is larger than a response
+    WHEN it is requested by a client that accepts gzip
+    THEN check it is sent uncompressed
+    """
+    app.config["COMPRESS_MIN_SIZE"] = 10**9
+    r = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert "Content-Encoding" not in r.headers
+
+
+def test_precompressed_static(app, tmp_path):
+    """
+    GIVEN a static file with an up to date .gz copy
+    WHEN it is requested with and without gzip
+    THEN check the .gz copy is sent only to clients that accept it
+    """
+    (tmp_path / "app.js").write_text("let x = 1;\n" * 100)
+    (tmp_path / "app.js.gz").write_bytes(gzip.compress(b"let x = 1;\n" * 100))
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        r = send_precompressed(str(tmp_path), "app.js")
+        r.direct_passthrough = False
+        assert r.headers["Content-Encoding"] == "gzip"
+        assert r.mimetype == "text/javascript"
+        assert gzip.decompress(r.get_data()) == b"let x = 1;\n" * 100
+
+    with app.test_request_context():
+        r = send_precompressed(str(tmp_path), "app.js")
+        assert "Content-Encoding" not in r.headers
+
+    # A .gz copy older than the file is out of date.
+    os.utime(tmp_path / "app.js.gz", (0, 0))
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        r = send_precompressed(str(tmp_path), "app.js")
+        assert "Content-Encoding" not in r.headers
@@ -0,0 +1,75 @@
+from app.models import (
+    Activities,
+    Facilities,
+    Facility,
+    Membership,
+    Roles,
+    Session,
+    User,
+    user_session_m2m,
+)
+from app.datagen import generate
+from app.search_utils import search_customers
+from app.utils import create_user
+from app import db, add_facilities, add_activities
+from sqlalchemy import func, select
+import datetime
+
+
+def test_generate(app):
+    """
+    GIVEN the facilities and timetable
+    WHEN synthetic members and bookings are generated
+    THEN check that no session is over capacity, nobody is booked twice at once,
+    and users and sessions added afterwards are given new ids
+    """
+    add_facilities(db)
+    add_activities(db)
+    counts = generate(members=200, months=1, employees=2, seed=1)
+
+    customers = db.session.execute(
+        select(User).where(User.role == Roles.CUSTOMER, User.user_id > 101)
+    ).scalars()
+    customers = list(customers)
+    assert len(customers) == 200
+    assert counts["bookings"] > 0
+    assert all(c.stripe_id for c in customers if c.membership != Membership.NONE)
+    assert {c.membership for c in customers} == set(Membership)
+
+    # Attendance per facility and time slot.
+    attendance = db.session.execute(
+        select(Facility.max_capacity, func.count())
+        .select_from(Session)
+        .join(user_session_m2m)
+        .join(Facility, Facility.facility_id == Session.facility_id)
+        .group_by(Session.facility_id, Session.start_time, Facility.max_capacity)
+    ).all()
+    assert all(count <= capacity for capacity, count in attendance)
+
+    clashes = db.session.execute(
+        select(user_session_m2m.c.user_id, Session.start_time)
+        .join(Session)
+        .group_by(user_session_m2m.c.user_id, Session.start_time)
+        .having(func.count() > 1)
+    ).all()
+    assert clashes == []
+
+    # The search index is rebuilt after the bulk insert.
+    assert search_customers(customers[0].username)[0]["id"] == customers[0].user_id
+
+    # The db gave out the ids, so it carries on after them.
+    user = create_user("new@mail.com", "new", "hash")
+    session = Session(
+        session_type=Activities.GENERAL,
+        facility_id=Facilities.FITNESS,
+        start_time=datetime.datetime.now(),
+        end_time=datetime.datetime.now() + datetime.timedelta(hours=1),
+        is_class=0,
+    )
+    db.session.add(session)
+    db.session.commit()
+    assert user.user_id > max(c.user_id for c in customers)
+    assert (
+        session.session_id
+        == db.session.execute(select(func.max(Session.session_id))).scalar()
+    )
@@ -0,0 +1,55 @@
+from app import db
+from app.db_config import sqlite_pragmas, database_uri
+import pytest
+
+
+def test_sqlite_pragmas_applied(app):
+    """
+    GIVEN the default db settings
+    WHEN a connection to the SQLite db is opened
+    THEN check that the tuning pragmas have been applied
+    """
+    if db.engine.dialect.name != "sqlite":
+        pytest.skip("Only applies to SQLite")
+
+    with db.engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        # NORMAL
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+
+    assert db.engine.pool.size() == app.config["DB_POOL_SIZE"]
+
+
+def test_sqlite_pragmas_can_be_disabled():
+    """
+    GIVEN settings set to None
+    WHEN the pragmas are generated
+    THEN check that those settings are left at SQLite's defaults
+    """
+    pragmas = sqlite_pragmas(
+        {
+            "SQLITE_JOURNAL_MODE": None,
+            "SQLITE_SYNCHRONOUS": "FULL",
+            "SQLITE_MMAP_SIZE": None,
+            "SQLITE_BUSY_TIMEOUT": 100,
+        }
+    )
+    assert pragmas == ["PRAGMA busy_timeout = 100", "PRAGMA synchronous = FULL"]
+
+
+def test_database_uri_from_environment(monkeypatch):
+    """
+    GIVEN a DATABASE_URL environment variable
+    WHEN the db URI is chosen for each mode
+    THEN check that it is used everywhere except the tests
+    """
+    monkeypatch.setenv("DATABASE_URL", "postgres://user:pw@localhost/leisure")
+    monkeypatch.delenv("TEST_DATABASE_URL", raising=False)
+
+    expected = "postgresql://user:pw@localhost/leisure"
+    assert database_uri({"DEBUG": False}) == expected
+    assert database_uri({"DEBUG": True}) == expected
+    assert database_uri({"DEBUG": False}, testing=True) == (
+        "sqlite:///leisure_centre_test.db"
+    )
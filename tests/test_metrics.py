@@ -0,0 +1,113 @@
+from app.models import User
+from app.metrics import Histogram, BOOKINGS, WEBHOOK_EVENTS, registry
+from app import db
+from sqlalchemy import select
+import json
+
+
+def test_histogram_buckets():
+    """
+    GIVEN a histogram
+    WHEN values are observed
+    THEN check that the buckets are cumulative and the sum and count are exposed
+    """
+    histogram = Histogram("test_seconds", "Test.", ("endpoint",), buckets=(0.1, 1))
+    histogram.observe(0.05, endpoint="a")
+    histogram.observe(0.5, endpoint="a")
+    histogram.observe(5, endpoint="a")
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{endpoint="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{endpoint="a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{endpoint="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_sum{endpoint="a"} 5.55' in lines
+    assert 'test_seconds_count{endpoint="a"} 3' in lines
+
+
+def test_metrics_endpoint(client):
+    """
+    GIVEN a request to the app
+    WHEN /metrics is scraped
+    THEN check that the request's latency is in the output
+    """
+    client.get("/facilities")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    assert (
+        'http_request_duration_seconds_count{blueprint="main",endpoint="main.facilities",method="GET"}'
+        in text
+    )
+    assert "password_hashes_in_progress 0" in text
+
+
+def test_metrics_token(app, client):
+    """
+    GIVEN a METRICS_TOKEN
+    WHEN /metrics is scraped with and without the token
+    THEN check that only requests with the token are allowed
+    """
+    app.config["METRICS_TOKEN"] = "secret"
+    assert client.get("/metrics").status_code == 401
+    assert (
+        client.get("/metrics", headers={"Authorization": "secret"}).status_code == 401
+    )
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+
+
+def test_metrics_need_token_in_production(app, client):
+    """
+    GIVEN an app outside debug and testing without a METRICS_TOKEN
+    WHEN /metrics is scraped
+    THEN check that it isn't served
+    """
+    app.config["METRICS_TOKEN"] = None
+    app.testing = False
+    assert client.get("/metrics").status_code == 404
+
+
+def test_booking_counter(login_client):
+    """
+    GIVEN a customer with sessions in their basket
+    WHEN the booking is completed
+    THEN check that the booked sessions are counted
+    """
+    user = db.session.execute(select(User).where(User.user_id == 100)).scalar()
+    before = BOOKINGS.value(booked_by="customer")
+
+    with login_client(user=user) as client:
+        with client.session_transaction() as session:
+            session["booked_sessions"] = ["1-0-01/01/30-10-11", "1-0-01/01/30-11-12"]
+        client.get("/auth/booking/success")
+
+    assert BOOKINGS.value(booked_by="customer") == before + 2
+    assert "bookings_total" in registry.render()
+
+
+def test_webhook_event_labels(client, monkeypatch):
+    """
+    GIVEN Stripe webhook events of a type the app handles and of other types
+    WHEN they are received
+    THEN check only the handled type gets its own label, the others are counted together
+    """
+    import stripe
+
+    monkeypatch.setattr(
+        stripe.Webhook,
+        "construct_event",
+        lambda payload, signature, secret: stripe.Event.construct_from(
+            json.loads(payload), "sk_test"
+        ),
+    )
+    WEBHOOK_EVENTS.reset()
+    for event_type in ["price.updated", "made.up.1", "made.up.2"]:
+        response = client.post(
+            "/auth/webhook",
+            data=json.dumps({"type": event_type, "data": {"object": {}}}),
+        )
+        assert response.json == {"success": True}
+
+    assert WEBHOOK_EVENTS.value(type="price.updated") == 1
+    assert WEBHOOK_EVENTS.value(type="other") == 2
+    assert "made.up" not in "\n".join(WEBHOOK_EVENTS.render())
@@ -0,0 +1,103 @@
+from app.models import (
+    Activities,
+    Facilities,
+    Membership,
+    ScheduledJob,
+    Session,
+    Statistics,
+    User,
+)
+from app.scheduler import JOBS, run_pending
+from app.metrics import SCHEDULED_JOB_RUNS
+from app import db
+from sqlalchemy import select
+import datetime
+
+
+def test_jobs_run_once_when_due(app):
+    """
+    GIVEN no jobs have run
+    WHEN the scheduler checks for due jobs twice at the same time
+    THEN check every job runs once and is next due after its interval
+    """
+    now = datetime.datetime(2030, 1, 7, 12)
+    before = SCHEDULED_JOB_RUNS.value(job="refresh_pricing", outcome="success")
+
+    assert run_pending(now) == dict.fromkeys(JOBS, True)
+    assert run_pending(now) == {}
+    assert run_pending(now + datetime.timedelta(hours=1)) == {
+        "expire_memberships": True,
+        "purge_orphaned_sessions": True,
+        "refresh_pricing": True,
+    }
+
+    scheduled = db.session.get(ScheduledJob, "rollup_statistics")
+    assert scheduled.runs == 1
+    assert scheduled.last_error is None
+    assert scheduled.next_run == now + datetime.timedelta(hours=6)
+    assert (
+        SCHEDULED_JOB_RUNS.value(job="refresh_pricing", outcome="success") == before + 2
+    )
+
+
+def test_housekeeping_jobs(app):
+    """
+    GIVEN a membership that expired two days ago and a session nobody has booked
+    WHEN the jobs run
+    THEN check the membership is ended, the session deleted and statistics rolled up
+    """
+    user = User.get_by_id(100)
+    user.membership = Membership.MONTH
+    user.membership_expiration_date = datetime.datetime.now() - datetime.timedelta(
+        days=2
+    )
+    renewed = User.get_by_id(101)
+    renewed.membership = Membership.YEAR
+    renewed.membership_expiration_date = datetime.datetime.now() + datetime.timedelta(
+        days=2
+    )
+    db.session.add(
+        Session(
+            session_id=200,
+            session_type=Activities.GENERAL,
+            facility_id=Facilities.FITNESS,
+            start_time=datetime.datetime.now(),
+            end_time=datetime.datetime.now() + datetime.timedelta(hours=1),
+            is_class=0,
+        )
+    )
+    db.session.commit()
+
+    assert all(run_pending().values())
+    db.session.expire_all()
+
+    assert User.get_by_id(100).membership == Membership.NONE
+    assert User.get_by_id(101).membership == Membership.YEAR
+    assert db.session.get(Session, 200) is None
+    assert len(db.session.get(Session, 100).users) == 2
+
+    statistics = db.session.execute(select(Statistics)).scalar()
+    assert statistics.year == datetime.date.today().year
+    assert statistics.members == 1
+    assert statistics.sales == 2
+
+
+def test_failed_job_recorded(app, monkeypatch):
+    """
+    GIVEN a job that raises an exception
+    WHEN it is run
+    THEN check the error is recorded and the other jobs still run
+    """
+
+    def fail():
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(JOBS["refresh_pricing"], "function", fail)
+    results = run_pending()
+
+    assert results["refresh_pricing"] is False
+    assert results["expire_memberships"] is True
+    assert (
+        db.session.get(ScheduledJob, "refresh_pricing").last_error
+        == "RuntimeError: boom"
+    )
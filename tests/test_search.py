@@ -0,0 +1,137 @@
+from app.models import Roles, User
+from app.utils import create_user, update_username, update_email
+from app.search_utils import (
+    CREATE_UPDATE_TRIGGER,
+    _indexed_engines,
+    customer_index_suspended,
+    ensure_customer_index,
+    search_customers,
+)
+from app import db
+from sqlalchemy import select
+import pytest
+
+
+def usernames(results):
+    return [user["username"] for user in results]
+
+
+def test_search_ranking(client):
+    """
+    GIVEN customers with similar usernames
+    WHEN searching for part of a username
+    THEN check that exact and prefix matches are ranked before other matches
+    """
+    create_user("a@mail.com", "testing", "hash")
+    create_user("b@mail.com", "mytest", "hash")
+    create_user("c@mail.com", "employee_test", "hash", Roles.EMPLOYEE)
+
+    results = usernames(search_customers("test"))
+    assert results[0] == "test"
+    assert set(results[1:3]) == {"testing", "tester2"}
+    assert results[3] == "mytest"
+    # Only customers can be searched for
+    assert "employee_test" not in results
+
+
+def test_search_email_and_typos(client):
+    """
+    GIVEN an existing customer
+    WHEN searching by email, or with a typo in the username
+    THEN check that the customer is found
+    """
+    assert usernames(search_customers("tester2@mail"))[0] == "tester2"
+    assert usernames(search_customers("te")) == ["test", "tester2"]
+
+    if db.engine.dialect.name != "sqlite":
+        pytest.skip("Typo matching needs the SQLite FTS5 index")
+    assert "tester2" in usernames(search_customers("tseter2"))
+
+
+def test_search_prefix_any_case(client):
+    """
+    GIVEN customers whose username and email have capital letters
+    WHEN searching for the start of them in another case
+    THEN check that they are found
+    """
+    create_user("Bob.Smith@Mail.com", "Alice", "hash")
+
+    assert usernames(search_customers("al")) == ["Alice"]
+    assert usernames(search_customers("BOB")) == ["Alice"]
+
+
+def test_search_index_kept_in_sync(client):
+    """
+    GIVEN a customer whose username and email are changed
+    WHEN searching for the old and new details
+    THEN check that only the new details are found
+    """
+    user = db.session.execute(select(User).where(User.user_id == 100)).scalar()
+    update_username("renamed", user)
+    update_email("changed@example.com", user)
+
+    assert "test" not in usernames(search_customers("test"))
+    assert usernames(search_customers("renamed")) == ["renamed"]
+    assert usernames(search_customers("example.com")) == ["renamed"]
+
+
+def test_search_index_after_failed_bulk_insert(client):
+    """
+    GIVEN the search index is suspended for a bulk insert
+    WHEN the insert fails
+    THEN check that customers can still be searched for afterwards
+    """
+    assert usernames(search_customers("tester2"))[0] == "tester2"
+
+    with pytest.raises(ValueError):
+        with customer_index_suspended():
+            raise ValueError("insert failed")
+    db.session.rollback()
+
+    assert usernames(search_customers("tester2"))[0] == "tester2"
+
+
+def test_search_index_update_trigger(client):
+    """
+    GIVEN a db whose search index update trigger fires on every update to the user table
+    WHEN the index is checked, then a customer's password is changed
+    THEN check the trigger is replaced, and the index isn't rewritten for the password
+    """
+    if db.engine.dialect.name != "sqlite":
+        pytest.skip("The search index triggers are SQLite only")
+    connection = db.session.connection()
+    connection.exec_driver_sql("DROP TRIGGER customer_search_update")
+    connection.exec_driver_sql(
+        CREATE_UPDATE_TRIGGER.replace("UPDATE OF username, email, role", "UPDATE")
+    )
+    db.session.commit()
+    _indexed_engines.clear()
+    assert ensure_customer_index()
+
+    user = db.session.get(User, 100)
+    sqlite_connection = db.session.connection().connection.dbapi_connection
+    changes = sqlite_connection.total_changes
+    user.password = "new hash"
+    db.session.commit()
+    # Counts the rows changed by triggers too.
+    assert sqlite_connection.total_changes - changes == 1
+
+    update_username("renamed", user)
+    assert usernames(search_customers("renamed")) == ["renamed"]
+
+
+def test_search_endpoint(login_client):
+    """
+    GIVEN a logged in employee
+    WHEN the search endpoint is queried
+    THEN check that matching customers are returned as JSON
+    """
+    employee = create_user("", "employee", "hash", Roles.EMPLOYEE)
+    with login_client(user=employee) as client:
+        response = client.get("/employee/search/customers?q=tester")
+        assert response.status_code == 200
+        assert response.json[0] == {
+            "id": 101,
+            "username": "tester2",
+            "email": "tester2@mail.com",
+        }
@@ -0,0 +1,197 @@
+from app.models import Activity, Facility, Roles, User
+from app.sites import ENVIRON_KEY, SiteMiddleware, current_site, using_site
+from app.utils import create_user
+from app.timetable import DEFAULT_TIMETABLE, load_timetables, read_timetables
+from app import create_app, db
+from sqlalchemy import func, select
+import datetime
+import json
+
+
+def test_site_middleware():
+    """
+    GIVEN sites told apart by host and by path
+    WHEN requests come in for each
+    THEN check each is given the right site, and path prefixes are moved to SCRIPT_NAME
+    """
+    seen = []
+
+    def wsgi_app(environ, start_response):
+        seen.append(
+            (environ[ENVIRON_KEY], environ["SCRIPT_NAME"], environ["PATH_INFO"])
+        )
+        return []
+
+    middleware = SiteMiddleware(
+        wsgi_app,
+        hosts={"North.example.com": "north"},
+        paths={"/east": "east", "/east-2/": "east2"},
+    )
+    for host, path in [
+        ("example.com", "/customer/"),
+        ("north.example.com:8000", "/customer/"),
+        ("example.com", "/east"),
+        ("north.example.com", "/east/customer/"),
+        ("example.com", "/east-2/customer/"),
+        ("example.com", "/eastern/"),
+    ]:
+        middleware(
+            {"HTTP_HOST": host, "SCRIPT_NAME": "", "PATH_INFO": path}, lambda *a: None
+        )
+
+    assert seen == [
+        ("main", "", "/customer/"),
+        ("north", "", "/customer/"),
+        ("east", "/east", "/"),
+        ("east", "/east", "/customer/"),
+        ("east2", "/east-2", "/customer/"),
+        ("main", "", "/eastern/"),
+    ]
+
+
+def test_sites_sharing_a_db(app, login_client):
+    """
+    GIVEN two sites in the same db with different timetables
+    WHEN a customer fetches a day's sessions at each
+    THEN check they only see the site's own activities
+    """
+    main, north = read_timetables(DEFAULT_TIMETABLE) * 2
+    north = dict(json.loads(json.dumps(north)), site="north")
+    north["facilities"] = {"SQUASH": north["facilities"]["SQUASH"]}
+    load_timetables([main, north])
+
+    # As if SITE_PATHS = {"/north": "north"} in config.py
+    app.wsgi_app = SiteMiddleware(app.wsgi_app.wsgi_app, paths={"/north": "north"})
+
+    user = db.session.get(User, 100)
+    url = f"/customer/get_sessions/{datetime.date.today()}-all"
+    with login_client(user=user) as client:
+        facilities = {}
+        for site, prefix in [("main", ""), ("north", "/north")]:
+            response = client.get(prefix + url)
+            facilities[site] = {activity["facility"] for activity in response.json}
+
+    assert len(facilities["main"]) > 1
+    assert facilities["north"] == {"Squash Courts"}
+
+    with app.test_request_context(environ_overrides={ENVIRON_KEY: "north"}):
+        assert current_site() == "north"
+        with using_site("main"):
+            assert current_site() == "main"
+        assert current_site() == "north"
+
+
+def test_admin_delete_scoped_to_site(app, login_client):
+    """
+    GIVEN two sites in the same db
+    WHEN an admin at one site deletes a facility and an activity by id
+    THEN check those of the other site can't be deleted
+    """
+    main, north = read_timetables(DEFAULT_TIMETABLE) * 2
+    load_timetables([main, dict(north, site="north")])
+    app.wsgi_app = SiteMiddleware(app.wsgi_app.wsgi_app, paths={"/north": "north"})
+    facility = db.session.execute(
+        select(Facility).where(Facility.site == "main")
+    ).scalar()
+    activity = db.session.execute(
+        select(Activity).where(Activity.site == "main")
+    ).scalar()
+
+    admin = create_user("admin@mail.com", "admin", "hashed_password", Roles.ADMIN)
+    with login_client(user=admin) as client:
+        client.get(f"/north/admin/delete/facility/{facility.id}")
+        client.get(f"/north/admin/delete/activity/{activity.activity_id}")
+        assert db.session.get(Facility, facility.id) is not None
+        assert db.session.get(Activity, activity.activity_id) is not None
+
+        client.get(f"/admin/delete/activity/{activity.activity_id}")
+    db.session.expire_all()
+    assert db.session.get(Activity, activity.activity_id) is None
+
+
+def test_admin_edit_facility_scoped_to_site(app, login_client):
+    """
+    GIVEN two sites in the same db
+    WHEN an admin at one site edits the other site's facility
+    THEN check they are sent back to the facilities and it isn't changed
+    """
+    main, north = read_timetables(DEFAULT_TIMETABLE) * 2
+    load_timetables([main, dict(north, site="north")])
+    app.wsgi_app = SiteMiddleware(app.wsgi_app.wsgi_app, paths={"/north": "north"})
+    facility = db.session.execute(
+        select(Facility).where(Facility.site == "main")
+    ).scalar()
+    capacity = facility.max_capacity
+
+    admin = create_user("admin@mail.com", "admin", "hashed_password", Roles.ADMIN)
+    with login_client(user=admin) as client:
+        url = f"/north/admin/facilities/edit/{facility.id}"
+        response = client.get(url)
+        assert response.status_code == 302
+        assert response.location.endswith("/north/admin/facilities")
+
+        response = client.post(url, data={"max_capacity": capacity + 10})
+        assert response.status_code == 302
+        assert b"Unknown facility" in client.get("/north/admin/facilities").data
+
+    db.session.expire_all()
+    assert db.session.get(Facility, facility.id).max_capacity == capacity
+
+
+def test_site_with_own_db(tmp_path):
+    """
+    GIVEN a site with its own SQLite db, told apart by path
+    WHEN the dbs are set up, its timetable loaded, and its pages requested
+    THEN check its data only goes to its db, and its requests are served from it
+    """
+    north_db = tmp_path / "north.db"
+    app = create_app(
+        testing=True,
+        config={
+            "WTF_CSRF_ENABLED": False,
+            "SECRET_KEY": "testing",
+            "SQLALCHEMY_BINDS": {"north": f"sqlite:///{north_db}"},
+            "SITE_BINDS": {"north": "north"},
+            "SITE_PATHS": {"/north": "north"},
+        },
+    )
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=["init-db", "--reset"]).exit_code == 0
+
+    north = dict(read_timetables(DEFAULT_TIMETABLE)[0], site="north")
+    path = tmp_path / "north.json"
+    path.write_text(json.dumps(north))
+    result = runner.invoke(args=["load-timetable", str(path)])
+    assert "north: facilities: 6 added" in result.output
+
+    def count(model):
+        return db.session.execute(
+            select(model.site, func.count()).group_by(model.site)
+        ).all()
+
+    with app.app_context():
+        # The main site's timetable is added by init-db, north's only by the load.
+        activities = count(Activity)
+        assert count(Facility) == [("main", 6)]
+        with using_site("north"):
+            assert count(Facility) == [("north", 6)]
+            assert count(Activity) == [("north", activities[0][1])]
+            assert db.session.execute(select(User.username)).scalars().all() == [
+                "admin"
+            ]
+        db.session.remove()
+
+    client = app.test_client()
+    assert client.get("/north/").status_code == 200
+    assert client.get("/north/facilities").status_code == 200
+    cookies = {cookie.name for cookie in client.cookie_jar}
+    assert cookies == {"session_north"}
+
+    with app.app_context():
+        with using_site("north"):
+            db.metadata.drop_all(db.session.get_bind())
+        db.session.remove()
+        db.drop_all()
+    # Flask-SQLAlchemy keeps a metadata for each bind key it has seen, which the
+    # next app's db.drop_all() would look for an engine for.
+    db.metadatas.pop("north")
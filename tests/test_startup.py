@@ -0,0 +1,76 @@
+from app.models import Activity, Facility, Roles, User
+from app.lazy import LazyModule
+from app import db
+from sqlalchemy import func, select
+import subprocess
+import sys
+import os
+
+
+def test_lazy_module():
+    """
+    GIVEN a LazyModule with a callback
+    WHEN one of the module's attributes is used
+    THEN check the module is imported and the callback called once
+    """
+    called = []
+    module = LazyModule("colorsys")
+    module.on_import(called.append)
+    assert not module.loaded
+    assert called == []
+
+    assert module.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    module.rgb_to_hsv(0, 1, 0)
+    assert module.loaded
+    assert [m.__name__ for m in called] == ["colorsys"]
+
+    # Callbacks added after the import are called straight away.
+    module.on_import(called.append)
+    assert len(called) == 2
+
+
+def test_create_app_doesnt_import_stripe():
+    """
+    GIVEN a new interpreter
+    WHEN the app is created
+    THEN check the stripe SDK hasn't been imported
+    """
+    code = (
+        "import sys\n"
+        "from app import create_app\n"
+        "create_app(testing=True)\n"
+        "print('stripe' in sys.modules)\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.join(os.path.dirname(__file__), ".."),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_init_db_command(app):
+    """
+    GIVEN an empty db
+    WHEN flask init-db is run twice
+    THEN check the admin, facilities and timetable are only added once
+    """
+    runner = app.test_cli_runner()
+
+    def count(model, *criteria):
+        return db.session.execute(
+            select(func.count()).select_from(model).where(*criteria)
+        ).scalar()
+
+    counts = []
+    for _ in range(2):
+        result = runner.invoke(args=["init-db"])
+        assert result.exit_code == 0, result.output
+        counts.append(
+            (count(User, User.role == Roles.ADMIN), count(Facility), count(Activity))
+        )
+
+    assert counts[0] == counts[1]
+    assert counts[0][:2] == (1, 6)
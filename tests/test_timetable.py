@@ -0,0 +1,106 @@
+from app.models import Activities, Activity, Days, Facilities, Facility
+from app.timetable import DEFAULT_TIMETABLE, load_timetable, read_timetables
+from app.cache import TIMETABLE, get_versions
+from app import db, add_facilities, add_activities
+from sqlalchemy import func, select
+import datetime
+import json
+import pytest
+
+
+def test_reload_timetable(app):
+    """
+    GIVEN the default timetable has been loaded
+    WHEN it is loaded again, then with a changed capacity and an extra class
+    THEN check nothing changes the first time, and only the changes are made the second
+    """
+    add_facilities(db)
+    add_activities(db)
+    activities = db.session.execute(select(func.count()).select_from(Activity)).scalar()
+    timetable = read_timetables(DEFAULT_TIMETABLE)[0]
+    version = get_versions([TIMETABLE])[TIMETABLE]
+
+    assert load_timetable(db.session, timetable) == {
+        "facilities": {"added": 0, "updated": 0},
+        "activities": {"added": 0, "updated": 0},
+    }
+    assert get_versions([TIMETABLE])[TIMETABLE] == version
+
+    studio = timetable["facilities"]["STUDIO"]
+    studio["capacity"] = 30
+    studio["timetable"]["WED"] = [
+        {"start": "12:00", "end": "13:00", "activities": ["YOGA"]}
+    ]
+    assert load_timetable(db.session, timetable) == {
+        "facilities": {"added": 0, "updated": 1},
+        "activities": {"added": 1, "updated": 0},
+    }
+    assert get_versions([TIMETABLE])[TIMETABLE] > version
+
+    db.session.expire_all()
+    assert (
+        db.session.execute(
+            select(Facility.max_capacity).where(
+                Facility.facility_id == Facilities.STUDIO
+            )
+        ).scalar()
+        == 30
+    )
+    yoga = db.session.execute(
+        select(Activity)
+        .where(Activity.day == Days.WED)
+        .where(Activity.facility_id == Facilities.STUDIO)
+    ).scalar()
+    assert yoga.activity_type == Activities.YOGA
+    assert yoga.start_time == datetime.time(12)
+    assert (
+        db.session.execute(select(func.count()).select_from(Activity)).scalar()
+        == activities + 1
+    )
+
+
+def test_load_timetable_command(app, tmp_path):
+    """
+    GIVEN a timetable file with an invalid entry, and one with two sites
+    WHEN they are loaded with flask load-timetable
+    THEN check the invalid one fails with a message and nothing is loaded,
+    and both sites are loaded from the other
+    """
+    with open(DEFAULT_TIMETABLE) as file:
+        timetable = json.load(file)
+    second = dict(timetable, site="second")
+    invalid = json.loads(json.dumps(second).replace('"YOGA"', '"YOGGA"'))
+
+    runner = app.test_cli_runner()
+    path = tmp_path / "timetable.json"
+    path.write_text(json.dumps([timetable, invalid]))
+    result = runner.invoke(args=["load-timetable", str(path)])
+    assert result.exit_code != 0
+    assert "Invalid timetable entry for STUDIO" in result.output
+    assert db.session.execute(select(Facility)).first() is None
+
+    path.write_text(json.dumps([timetable, second]))
+    result = runner.invoke(args=["load-timetable", str(path)])
+    assert result.exit_code == 0
+    assert "main: facilities: 6 added" in result.output
+    assert "second: facilities: 6 added" in result.output
+    assert dict(
+        db.session.execute(
+            select(Facility.site, func.count()).group_by(Facility.site)
+        ).all()
+    ) == {"main": 6, "second": 6}
+
+
+@pytest.mark.parametrize("extension", [".yaml", ".yml"])
+def test_read_yaml_timetable(tmp_path, extension):
+    """
+    GIVEN a timetable written as YAML
+    WHEN it is read
+    THEN check it matches the JSON version
+    """
+    yaml = pytest.importorskip("yaml")
+    timetables = read_timetables(DEFAULT_TIMETABLE)
+    path = tmp_path / f"timetable{extension}"
+    path.write_text(yaml.safe_dump(timetables[0]))
+
+    assert read_timetables(str(path)) == timetables